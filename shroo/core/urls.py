@@ -1,5 +1,6 @@
 from django.urls import path, include, re_path
 from . import views
+from infrasot import views as infrasot_views
 
 app_name = 'core'
 urlpatterns = [
@@ -7,5 +8,10 @@ urlpatterns = [
     path('customers', views.customers, name='customers'),
     re_path('health/?.*', views.health, name='health'),
     re_path('menu/?', views.menu_items, name='menu'),
+    path('metrics', infrasot_views.metrics, name='metrics'),
+    path('search', infrasot_views.search_async if infrasot_views.ASYNC_VIEWS else infrasot_views.search, name='search'),
+    path('batch', infrasot_views.batch_async if infrasot_views.ASYNC_VIEWS else infrasot_views.batch, name='batch'),
+    path('events', infrasot_views.events_async if infrasot_views.ASYNC_VIEWS else infrasot_views.events, name='events'),
+    path('webhook', infrasot_views.webhook, name='webhook'),
     re_path('^(dcim|ipam|core)/',include('infrasot.urls'))
 ]
\ No newline at end of file
@@ -0,0 +1,13 @@
+# -*- encoding: utf-8 -*-
+# ASGI alternative to gunicorn-cfg.py: gunicorn -c gunicorn-asgi-cfg.py shroo.asgi:application
+
+bind = '0.0.0.0:8000'
+workers = 1
+# One event loop per worker serves every request concurrently
+worker_class = 'uvicorn_worker.UvicornWorker'
+accesslog = '-'
+loglevel = 'debug'
+capture_output = True
+enable_stdio_inheritance = True
+# Warm, sync and snapshot the InfraSoT cache in the workers (manage.py doesn't)
+raw_env = ['INFRASOT_BACKGROUND_JOBS=true']
@@ -6,3 +6,5 @@ accesslog = '-'
 loglevel = 'debug'
 capture_output = True
 enable_stdio_inheritance = True
+# Warm, sync and snapshot the InfraSoT cache in the workers (manage.py doesn't)
+raw_env = ['INFRASOT_BACKGROUND_JOBS=true']
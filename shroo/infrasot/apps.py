@@ -1,26 +1,121 @@
+import atexit
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from django.apps import AppConfig
-from decouple import config
+from django.conf import settings
+from decouple import config, Csv
 import pynetbox
 import asyncio
+import gzip
+import hashlib
 import json
+import pickle
+import queue
+import sys
 import time
 
-from typing import Dict, Tuple, List, Optional, Generator, Any, AsyncGenerator
+from typing import Dict, Tuple, List, Optional, Generator, Any, AsyncGenerator, Set, Callable, Union
 
 from datetime import datetime, timedelta
-from dataclasses import dataclass
-
-
-@dataclass
-class CacheEntry:
-    data: List[Dict]
-    timestamp: float
-    ttl: int
-    endpoint_name: str
-    filters: Optional[Dict]
+from urllib.parse import parse_qsl
+from collections.abc import Mapping
+from dataclasses import dataclass, field, replace
+from functools import reduce
+
+from .backends import CacheBackend, LocalMemoryBackend, get_backend
+from .columnar import ColumnarRecords
+from .events import EventBus
+from .iptrie import IPIndex
+from .joins import JoinIndex, JOIN_KEYS, CONTAINING_PREFIX
+from .search import SearchIndex, SEARCH_FIELDS
+from .singleflight import SingleFlight
+from .metrics import ClientMetrics
+from .query import (EntryIndex, Query, INDEXED_FIELDS, ORDERED_FIELDS, GROUPED_FIELDS,
+                    UnsupportedQuery, can_evaluate, filters_to_query)
+from .snapshot import Snapshot, write_snapshot
+
+try:
+    import orjson
+except ImportError:  # Optional, a much faster JSON parser
+    orjson = None
+
+
+def json_loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def json_dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default)
+    return json.dumps(data, default=_json_default, separators=(',', ':')).encode()
+
+
+def _json_default(obj: Any) -> Any:
+    # Compact records and their row views encode like the dicts they replace
+    if isinstance(obj, ColumnarRecords):
+        return obj.to_dicts()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return str(obj)
+
+
+# Content codings we can pre-compress into, in server preference order.
+# br and zstd need the optional brotli / zstandard packages.
+COMPRESSORS = {}
+try:
+    import zstandard
+    COMPRESSORS['zstd'] = lambda body: zstandard.ZstdCompressor(level=3).compress(body)
+except ImportError:
+    pass
+try:
+    import brotli
+    COMPRESSORS['br'] = lambda body: brotli.compress(body, quality=5)
+except ImportError:
+    pass
+COMPRESSORS['gzip'] = lambda body: gzip.compress(body, compresslevel=6)
+
+
+def compress_body(body: bytes, encodings: List[str], min_bytes: int) -> Dict[str, bytes]:
+    """Compress body once into each available encoding, small bodies are left alone"""
+    if len(body) < min_bytes:
+        return {}
+    return {name: COMPRESSORS[name](body) for name in encodings if name in COMPRESSORS}
+
+
+# NetBox changelog object types and the cached endpoint holding them
+SYNCED_MODELS = {
+    'dcim.device': 'dcim.devices',
+    'ipam.prefix': 'ipam.prefixes',
+    'ipam.vlan': 'ipam.vlans',
+    'ipam.ipaddress': 'ipam.ip_addresses',
+}
+
+# Models shown nested inside the records of cached endpoints. Their
+# changes can't be patched record by record, webhooks for them drop the
+# endpoints' entries instead.
+DEPENDENT_MODELS = {
+    'dcim.site': ('dcim.devices', 'ipam.prefixes', 'ipam.vlans'),
+    'dcim.rack': ('dcim.devices',),
+    'dcim.devicerole': ('dcim.devices',),
+    'dcim.devicetype': ('dcim.devices',),
+    'dcim.platform': ('dcim.devices',),
+    'dcim.interface': ('ipam.ip_addresses',),
+    'ipam.vrf': ('ipam.prefixes', 'ipam.ip_addresses'),
+    'ipam.role': ('ipam.prefixes', 'ipam.vlans'),
+    'ipam.vlangroup': ('ipam.vlans',),
+    'tenancy.tenant': ('dcim.devices', 'ipam.prefixes', 'ipam.vlans', 'ipam.ip_addresses'),
+    'extras.tag': ('dcim.devices', 'ipam.prefixes', 'ipam.vlans', 'ipam.ip_addresses'),
+}
+
+# Entries the IP/prefix trie is built from
+IP_INDEX_ENDPOINTS = ('ipam.prefixes', 'ipam.ip_addresses')
+
+
+class _Lifetime:
+    """TTL arithmetic over timestamp and ttl, shared by CacheEntry and EntryInfo"""
 
     @property
     def is_expired(self) -> bool:
@@ -34,22 +129,200 @@ class CacheEntry:
     def remaining_ttl(self) -> float:
         return max(0.0, self.ttl - self.age_seconds)
 
+    @property
+    def stale_seconds(self) -> float:
+        return max(0.0, self.age_seconds - self.ttl)
+
+    @property
+    def freshness(self) -> str:
+        return "stale" if self.is_expired else "fresh"
+
+    def is_servable(self, stale_grace: int) -> bool:
+        """Fresh, or expired for no longer than the stale grace window"""
+        return self.stale_seconds <= stale_grace
+
+
+@dataclass
+class CacheEntry(_Lifetime):
+    data: List[Dict]
+    timestamp: float
+    ttl: int
+    endpoint_name: str
+    filters: Optional[Dict]
+    size_bytes: int = 0
+    hits: int = 0
+    last_access: float = 0.0
+    # data encoded once as JSON, and a digest of it used as a strong ETag
+    body: bytes = b''
+    version: str = ''
+    # body pre-compressed per content coding (gzip, br, zstd)
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+    # Loaded from a snapshot written by a previous process
+    restored: bool = False
+    # Records per value of GROUPED_FIELDS, e.g. {'status': {'active': 120}}
+    group_counts: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    # Secondary indexes for server-side queries, rebuilt lazily after unpickling
+    index: Optional[EntryIndex] = field(default=None, repr=False, compare=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['index'] = None
+        return state
+
+    def json_body(self) -> bytes:
+        """body, encoded on first use for entries derived per request"""
+        if not self.body:
+            self.body = json_dumps(self.data)
+        return self.body
+
+    def info(self) -> 'EntryInfo':
+        return EntryInfo(
+            endpoint_name=self.endpoint_name,
+            filters=self.filters,
+            timestamp=self.timestamp,
+            ttl=self.ttl,
+            size_bytes=self.size_bytes,
+            item_count=len(self.data),
+            body_bytes=len(self.body),
+            encoded_bytes={name: len(value) for name, value in self.encodings.items()},
+            version=self.version,
+            columnar=isinstance(self.data, ColumnarRecords),
+            restored=self.restored,
+            hits=self.hits,
+            last_access=self.last_access,
+        )
+
+
+@dataclass
+class EntryInfo(_Lifetime):
+    """
+    What cleanup, eviction, status and metrics need to know of an entry.
+    Backends keep it next to the entry, so those never load (or, for shared
+    backends, unpickle) the data.
+    """
+    endpoint_name: str
+    filters: Optional[Dict]
+    timestamp: float
+    ttl: int
+    size_bytes: int
+    item_count: int
+    body_bytes: int
+    encoded_bytes: Dict[str, int]
+    version: str
+    columnar: bool
+    restored: bool
+    hits: int = 0
+    last_access: float = 0.0
 
 
 class OptimizedNetBoxClient:
-    def __init__(self, netbox_url: str, token: str, default_ttl: int = 300):
+    def __init__(self, netbox_url: str, token: str, default_ttl: int = 300,
+                 stale_grace: int = 0, backend: Optional[CacheBackend] = None,
+                 max_bytes: int = 0, max_entries: int = 0, eviction_policy: str = 'lru',
+                 page_size: int = 500, page_workers: int = 8,
+                 raw_endpoints: Optional[Set[str]] = None,
+                 compress_encodings: Optional[List[str]] = None, compress_min_bytes: int = 1024,
+                 compact: bool = False, fill_timeout: Optional[float] = None, fill_workers: int = 32):
         self.nb = pynetbox.api(netbox_url, token=token)
         self.default_ttl = default_ttl
-        self.cache: Dict[str, CacheEntry] = {}
-        self.fetch_locks: Dict[str, threading.Lock] = {}
-        self.async_fetch_locks: Dict[str, asyncio.Lock] = {}
+        # Seconds an expired entry may still be served while it is refreshed
+        # in the background (0 disables stale-while-revalidate)
+        self.stale_grace = stale_grace
+        # Where entries live; shared backends let gunicorn workers share one
+        # stored copy (plus what each keeps unpickled, see _MemoizedSharedBackend)
+        self.cache: CacheBackend = backend if backend is not None else LocalMemoryBackend()
+        # Memory budget (0 = unbounded), enforced on insert by evicting the
+        # least recently ('lru') or least frequently ('lfu') used entries
+        if eviction_policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown eviction policy: {eviction_policy}")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.eviction_policy = eviction_policy
+        self.evictions = 0
+        self.evicted_bytes = 0
+        # One NetBox fill per key at a time, shared by sync, async and
+        # background callers; waiters give up after fill_timeout seconds
+        self.fills = SingleFlight()
+        self.fill_timeout = fill_timeout
+        # Refreshed/patched/evicted notifications for the SSE view
+        self.events = EventBus(json_dumps)
+        self.refreshing: Set[str] = set()  # Keys with a background refresh in flight
         self.cleanup_thread = None
         self.is_running = False
+        self.warmer_thread = None
+        self.warm_targets: List[Tuple[str, Optional[Dict]]] = []
+        self.warm_status: Dict[str, Dict] = {}
+        self.snapshot: Optional[Snapshot] = None
+        self.snapshot_path: Optional[str] = None
+        self.snapshot_thread = None
+        self.snapshot_max_age = 86400
+        self.snapshot_status: Dict[str, Any] = {
+            "restored_entries": 0,
+            "last_saved_at": None,
+            "last_save_seconds": None,
+            "last_saved_entries": 0,
+            "last_error": None,
+        }
+        self.delta_sync_thread = None
+        self.changelog_endpoint = 'core.object_changes'
+        self.change_cursor: Optional[int] = None  # Last applied object change id
+        self.delta_status: Dict[str, Any] = {
+            "last_sync_at": None,
+            "changes_applied": 0,
+            "full_refetches": 0,
+            "last_error": None,
+        }
         self._cache_lock = threading.RLock()  # Protects cache dictionary
 
         # Thread pool for async operations
         self.thread_pool = ThreadPoolExecutor(max_workers=4)
 
+        self.metrics = ClientMetrics()
+        # Endpoint label values: endpoint names come from request paths, so
+        # only ones NetBox answered for get their own series, the rest are
+        # counted as 'other'
+        self.metric_endpoints: Set[str] = {
+            name for base in SYNCED_MODELS.values() for name in (base, f"{base}.count")
+        }
+        self.metrics.counter('cache_requests_total', "Cache lookups by endpoint and result (hit, stale, miss)")
+        self.metrics.counter('upstream_errors_total', "Failed NetBox fetches")
+        self.metrics.counter('upstream_items_total', "Records fetched from NetBox")
+        self.metrics.counter('evictions_total', "Entries evicted to stay within the memory budget")
+        self.metrics.counter('cleanup_runs_total', "Runs of the expired entry cleanup")
+        self.metrics.counter('cleanup_removed_total', "Expired entries removed by cleanup")
+        self.metrics.histogram('upstream_fetch_seconds', "NetBox fetch latency")
+        self.metrics.counter('singleflight_shared_total', "Requests served by another caller's in-flight fill")
+        self.metrics.counter('events_published_total', "Cache events published to subscribers, by type")
+        self.metrics.histogram('singleflight_wait_seconds', "Time spent waiting on another caller's in-flight fill")
+
+        # Separate pool for page requests, since fetches themselves run on
+        # thread_pool and must not wait on their own workers
+        self.page_size = page_size
+        self.page_pool = ThreadPoolExecutor(max_workers=page_workers)
+        # Fills started by async callers; their own pool for the same reason,
+        # sized for many slow NetBox fetches at once
+        self.fill_pool = ThreadPoolExecutor(max_workers=fill_workers)
+        # Endpoints read as raw JSON instead of through pynetbox Records
+        self.raw_endpoints: Set[str] = set(raw_endpoints or ())
+
+        # Compressed variants built once per refresh, served by Accept-Encoding
+        self.compress_encodings: List[str] = [
+            name for name in (compress_encodings if compress_encodings is not None else ['gzip'])
+            if name in COMPRESSORS
+        ]
+        self.compress_min_bytes = compress_min_bytes
+        # Store record lists as ColumnarRecords instead of lists of dicts
+        self.compact = compact
+        # Prefix/address tries, rebuilt when either ipam entry changes
+        self.ip_index = IPIndex()
+        self._ip_index_lock = threading.Lock()
+        # Full-text index, one part per endpoint in SEARCH_FIELDS
+        self.search_index = SearchIndex()
+        self._search_index_lock = threading.Lock()
+        # Foreign-key maps for ?expand=, one part per endpoint in JOIN_KEYS
+        self.join_index = JoinIndex()
+        self._join_index_lock = threading.Lock()
+
     def start_cache_manager(self, cleanup_interval: int = 60):
         """Start the cache manager with automatic cleanup (thread-based)"""
         if self.is_running:
@@ -73,8 +346,20 @@ class OptimizedNetBoxClient:
             # Give cleanup thread time to finish
             self.cleanup_thread.join(timeout=2)
 
-        # Shutdown thread pool
+        if self.warmer_thread and self.warmer_thread.is_alive():
+            self.warmer_thread.join(timeout=2)
+
+        if self.delta_sync_thread and self.delta_sync_thread.is_alive():
+            self.delta_sync_thread.join(timeout=2)
+
+        if self.snapshot_path:
+            # Last snapshot so the next process starts warm
+            self.save_snapshot()
+
+        # Shutdown thread pools
         self.thread_pool.shutdown(wait=False)
+        self.page_pool.shutdown(wait=False)
+        self.fill_pool.shutdown(wait=False)
 
     def _cleanup_expired_entries_thread(self, interval: int):
         """Background thread to clean up expired cache entries"""
@@ -85,22 +370,315 @@ class OptimizedNetBoxClient:
                 if not self.is_running:
                     break
 
-                with self._cache_lock:
-                    expired_keys = []
-                    for cache_key, entry in self.cache.items():
-                        if entry.is_expired:
-                            expired_keys.append(cache_key)
+                removed = 0
+                for cache_key, info in self.cache.infos().items():
+                    if not self._is_servable(info) and self._evict(cache_key, 'expired', info):
+                        removed += 1
+
+                self.metrics.inc('cleanup_runs_total')
+                self.metrics.inc('cleanup_removed_total', removed)
+
+            except Exception as e:
+                print(e)
+
+    def start_cache_warmer(self, targets: List[Tuple[str, Optional[Dict]]],
+                           refresh_lead: int = 60, check_interval: int = 5):
+        """
+        Pre-fetch the given (endpoint_name, filters) targets in parallel, then
+        keep refreshing each one before it expires.
+        Refreshes are staggered across the refresh_lead window so the targets
+        don't all hit NetBox at the same moment.
+        Call after start_cache_manager; the warmer stops with it.
+        """
+        if self.warmer_thread is not None:
+            return
+
+        self.warm_targets = list(targets)
+        with self._cache_lock:
+            for endpoint_name, filters in self.warm_targets:
+                self.warm_status[self._get_cache_key(endpoint_name, filters)] = {
+                    "endpoint": endpoint_name,
+                    "filters": filters,
+                    "state": "pending",
+                    "last_warmed_at": None,
+                    "last_duration_seconds": None,
+                    "last_error": None,
+                }
+
+        # Initial warm-up runs on the thread pool so boot isn't blocked
+        for endpoint_name, filters in self.warm_targets:
+            self._submit_warm(endpoint_name, filters)
+
+        self.warmer_thread = threading.Thread(
+            target=self._cache_warmer_thread,
+            args=(refresh_lead, check_interval),
+            daemon=True
+        )
+        self.warmer_thread.start()
+
+    def _cache_warmer_thread(self, refresh_lead: int, check_interval: int):
+        """Background thread that refreshes warm targets ahead of their expiry"""
+        while self.is_running:
+            try:
+                time.sleep(check_interval)
+
+                if not self.is_running:
+                    break
+
+                total = len(self.warm_targets)
+                for position, (endpoint_name, filters) in enumerate(self.warm_targets):
+                    cache_key = self._get_cache_key(endpoint_name, filters)
+                    # Spread the targets over the lead window: the first one
+                    # refreshes refresh_lead seconds early, the last one just
+                    # ahead of the next check
+                    lead = check_interval + (refresh_lead * (total - position)) / total
+
+                    with self._cache_lock:
+                        state = self.warm_status[cache_key]["state"]
+
+                    if state == "warming":
+                        continue
+                    info = self.cache.info(cache_key)
+                    if info is None or info.is_expired or info.remaining_ttl <= lead:
+                        self._submit_warm(endpoint_name, filters)
+
+            except Exception as e:
+                print(e)
+
+    def _submit_warm(self, endpoint_name: str, filters: Optional[Dict]):
+        cache_key = self._get_cache_key(endpoint_name, filters)
+        with self._cache_lock:
+            self.warm_status[cache_key]["state"] = "warming"
+        try:
+            self.thread_pool.submit(self._warm_target, endpoint_name, filters)
+        except RuntimeError:
+            # Thread pool already shut down
+            with self._cache_lock:
+                self.warm_status[cache_key]["state"] = "pending"
+
+    def _warm_target(self, endpoint_name: str, filters: Optional[Dict]):
+        cache_key = self._get_cache_key(endpoint_name, filters)
+        start_time = time.time()
+        try:
+            self.get_entry_sync(endpoint_name, filters, force_refresh=True)
+        except Exception as e:
+            with self._cache_lock:
+                self.warm_status[cache_key].update(state="error", last_error=str(e))
+            return
+
+        with self._cache_lock:
+            self.warm_status[cache_key].update(
+                state="warm",
+                last_warmed_at=datetime.now().isoformat(),
+                last_duration_seconds=round(time.time() - start_time, 2),
+                last_error=None,
+            )
+
+    def start_delta_sync(self, interval: int = 30, changelog_endpoint: str = 'core.object_changes',
+                         max_changes: int = 1000):
+        """
+        Keep cached endpoints in sync by polling the NetBox changelog and
+        patching created/updated/deleted records into the cached lists.
+        Falls back to a full refetch when the change window is lost.
+        Call after start_cache_manager; delta sync stops with it.
+        """
+        if self.delta_sync_thread is not None:
+            return
+
+        self.changelog_endpoint = changelog_endpoint
+        self.delta_sync_thread = threading.Thread(
+            target=self._delta_sync_thread,
+            args=(interval, max_changes),
+            daemon=True
+        )
+        self.delta_sync_thread.start()
+
+    def _delta_sync_thread(self, interval: int, max_changes: int):
+        """Background thread polling the changelog"""
+        try:
+            # Pin the cursor right away so changes made while the cache is
+            # warming up are not missed
+            self.sync_changes(max_changes)
+        except Exception as e:
+            self.delta_status["last_error"] = str(e)
+            print(e)
+
+        while self.is_running:
+            try:
+                time.sleep(interval)
+
+                if not self.is_running:
+                    break
+
+                self.sync_changes(max_changes)
+                self.delta_status["last_error"] = None
+
+            except Exception as e:
+                self.delta_status["last_error"] = str(e)
+                print(e)
+
+    def sync_changes(self, max_changes: int = 1000) -> int:
+        """
+        Apply NetBox object changes recorded since the last sync to the cache
+        Returns the number of changes applied
+        """
+        changelog = self._resolve_endpoint(self.changelog_endpoint)
+
+        if self.change_cursor is None:
+            # First run: the cache was filled by full fetches, start from now
+            self.change_cursor = self._latest_change_id(changelog)
+            self.delta_status["last_sync_at"] = datetime.now().isoformat()
+            return 0
+
+        changes = [dict(change) for change in changelog.filter(
+            id__gt=self.change_cursor, ordering='id', limit=max_changes + 1, offset=0
+        )]
+
+        if len(changes) > max_changes or self._change_window_lost(changelog, changes):
+            self._full_resync()
+            self.change_cursor = self._latest_change_id(changelog)
+            self.delta_status["last_sync_at"] = datetime.now().isoformat()
+            return 0
+
+        if changes:
+            self._apply_changes(changes)
+            self.change_cursor = changes[-1]['id']
+            self.delta_status["changes_applied"] += len(changes)
+
+        self.delta_status["last_sync_at"] = datetime.now().isoformat()
+        return len(changes)
+
+    @staticmethod
+    def _latest_change_id(changelog) -> int:
+        latest = list(changelog.filter(ordering='-id', limit=1, offset=0))
+        return latest[0].id if latest else 0
+
+    def _change_window_lost(self, changelog, changes: List[Dict]) -> bool:
+        """
+        True when changes after our cursor may have been pruned by the
+        changelog retention, i.e. we can no longer see a contiguous history
+        """
+        if changes and changes[0]['id'] == self.change_cursor + 1:
+            return False
+        # Ids can have gaps (rolled back transactions); the window is only
+        # lost if our cursor itself is gone
+        return self.change_cursor > 0 and changelog.count(id=self.change_cursor) == 0
+
+    def _apply_changes(self, changes: List[Dict]):
+        """Patch the unfiltered cached lists of the synced endpoints"""
+        upserts: Dict[str, Set[int]] = {}
+        deletes: Dict[str, Set[int]] = {}
+
+        for change in changes:
+            endpoint_name = SYNCED_MODELS.get(change['changed_object_type'])
+            if endpoint_name is None:
+                continue
+            object_id = change['changed_object_id']
+            action = change['action']['value'] if isinstance(change['action'], dict) else change['action']
+
+            if action == 'delete':
+                upserts.setdefault(endpoint_name, set()).discard(object_id)
+                deletes.setdefault(endpoint_name, set()).add(object_id)
+            else:
+                deletes.setdefault(endpoint_name, set()).discard(object_id)
+                upserts.setdefault(endpoint_name, set()).add(object_id)
+
+        for endpoint_name in set(upserts) | set(deletes):
+            self._patch_endpoint(endpoint_name, upserts.get(endpoint_name, set()),
+                                 deletes.get(endpoint_name, set()))
+
+    def _patch_endpoint(self, endpoint_name: str, upsert_ids: Set[int], delete_ids: Set[int]):
+        cache_key = self._get_cache_key(endpoint_name, None)
+
+        # Filtered and count entries can't be patched reliably, drop them
+        for key in list(self.cache.keys()):
+            if key != cache_key and _belongs_to(key, endpoint_name):
+                self._evict(key, 'invalidated')
+
+        if cache_key not in self.cache:
+            return
+
+        records = self._fetch_records_by_id(endpoint_name, sorted(upsert_ids))
+
+        def patch():
+            with self.cache.fill_lock(cache_key):
+                entry = self.cache.get(cache_key)
+                if entry is None or entry.restored:
+                    # Evicted meanwhile (readers joining this call still need
+                    # an entry), or restored and maybe missing older changes
+                    return self._refresh_entry_sync(cache_key, endpoint_name, None,
+                                                    entry.ttl if entry is not None else self.default_ttl)
+                patched = patch_records(entry.data, records, delete_ids)
+                return self._store_entry(cache_key, endpoint_name, None, patched, entry.ttl, event='patched',
+                                         delta={"upserted": records, "deleted": sorted(delete_ids)})
 
-                    for key in expired_keys:
-                        del self.cache[key]
-                        # Also clean up the locks
-                        if key in self.fetch_locks:
-                            del self.fetch_locks[key]
-                        if key in self.async_fetch_locks:
-                            del self.async_fetch_locks[key]
+        # Runs after any fill already in flight, which may predate these changes
+        self.fills.do(cache_key, patch, not_before=time.time())
 
+    def apply_webhook(self, object_type: str, event: str, object_id: Optional[int]) -> str:
+        """
+        Bring the cache up to date with one NetBox object change ("dcim.device",
+        "updated", 12): patch the record into its endpoint's cached list, or
+        drop the entries it appears in when that isn't possible. Returns
+        'patched', 'invalidated' or 'ignored'.
+        """
+        endpoint_name = SYNCED_MODELS.get(object_type)
+        if endpoint_name is not None and object_id is not None:
+            # Snapshot copies predate the change, don't restore them later
+            self._discard_snapshot(endpoint_name)
+            deleted = event in ('deleted', 'object_deleted')
+            try:
+                self._patch_endpoint(endpoint_name, set() if deleted else {object_id},
+                                     {object_id} if deleted else set())
+                return 'patched'
             except Exception as e:
+                # Couldn't refetch the record, don't keep serving the old one
                 print(e)
+                self._invalidate_endpoint(endpoint_name)
+                return 'invalidated'
+
+        dependents = DEPENDENT_MODELS.get(object_type, ())
+        if endpoint_name is not None:
+            dependents = (endpoint_name,)
+        for name in dependents:
+            self._invalidate_endpoint(name)
+        return 'invalidated' if dependents else 'ignored'
+
+    def _invalidate_endpoint(self, endpoint_name: str):
+        """Drop every entry of endpoint_name, filtered and .count ones included"""
+        for key in list(self.cache.keys()):
+            if _belongs_to(key, endpoint_name):
+                self._evict(key, 'invalidated')
+        self._discard_snapshot(endpoint_name)
+
+    def _discard_snapshot(self, endpoint_name: str):
+        """Forget the startup snapshot's copies of endpoint_name's entries"""
+        with self._cache_lock:
+            if self.snapshot is not None:
+                for key in [key for key in self.snapshot.keys() if _belongs_to(key, endpoint_name)]:
+                    self.snapshot.discard(key)
+
+    def _fetch_records_by_id(self, endpoint_name: str, ids: List[int],
+                             batch_size: int = 100) -> List[Dict]:
+        endpoint = self._resolve_endpoint(endpoint_name)
+        records = []
+        for i in range(0, len(ids), batch_size):
+            records.extend(dict(item) for item in endpoint.filter(id=ids[i:i + batch_size]))
+        return records
+
+    def _full_resync(self):
+        """Refetch every cached entry of the synced endpoints"""
+        self.delta_status["full_refetches"] += 1
+        entries = [
+            (info.endpoint_name, info.filters, info.ttl) for info in self.cache.infos().values()
+            if any(info.endpoint_name.startswith(name) for name in SYNCED_MODELS.values())
+        ]
+        for endpoint_name, filters, ttl in entries:
+            self.get_entry_sync(endpoint_name, filters, ttl, force_refresh=True)
+
+    def _resolve_endpoint(self, endpoint_name: str):
+        """Turn "dcim.devices" into self.nb.dcim.devices"""
+        return reduce(getattr, endpoint_name.split('.'), self.nb)
 
     # Synchronous version (for use in Django, Flask, etc.)
     def get_data_sync(self, endpoint_name: str,
@@ -111,52 +689,467 @@ class OptimizedNetBoxClient:
         Synchronous version - get data from cache or fetch from NetBox
         Use this in Django views, Flask routes, etc.
         """
+        return self.get_entry_sync(endpoint_name, filters, ttl, force_refresh).data
+
+    def get_entry_sync(self, endpoint_name: str,
+                       filters: Optional[Dict] = None,
+                       ttl: Optional[int] = None,
+                       force_refresh: bool = False) -> CacheEntry:
+        """
+        Same as get_data_sync but returns the whole CacheEntry, so callers can
+        tell fresh data from stale data served during the grace window
+        """
         cache_key = self._get_cache_key(endpoint_name, filters)
         ttl = ttl or self.default_ttl
+        requested_at = time.time()
 
         # Check cache first (unless force refresh)
         if not force_refresh:
+            entry = self._cached_entry(cache_key, endpoint_name, filters, ttl)
+            if entry is not None:
+                return entry
+        return self._fill_sync(cache_key, endpoint_name, filters, ttl, force_refresh, requested_at)
+
+    def _fill_sync(self, cache_key: str, endpoint_name: str, filters: Optional[Dict],
+                   ttl: int, force_refresh: bool, requested_at: float) -> CacheEntry:
+        # One fill per key, concurrent callers get its entry (or error)
+        entry, shared = self.fills.do(
+            cache_key,
+            lambda: self._fill_entry_sync(cache_key, endpoint_name, filters, ttl, force_refresh, requested_at),
+            timeout=self.fill_timeout,
+            not_before=requested_at if force_refresh else 0,
+        )
+        self._record_fill(endpoint_name, shared, requested_at)
+        return entry
+
+    def iter_entries_sync(self, requests: List[Tuple[str, Optional[Dict]]],
+                          ttl: Optional[int] = None) -> Generator[Tuple[int, Any], None, None]:
+        """
+        (position in requests, CacheEntry or the exception raised) for each
+        (endpoint_name, filters): cache hits right away, then misses in the
+        order they complete, filled concurrently on thread_pool
+        """
+        ttl = ttl or self.default_ttl
+        pending = {}
+        for position, (endpoint_name, filters) in enumerate(requests):
+            cache_key = self._get_cache_key(endpoint_name, filters)
+            try:
+                entry = self._cached_entry(cache_key, endpoint_name, filters, ttl)
+                if entry is None:
+                    future = self.thread_pool.submit(self._fill_sync, cache_key, endpoint_name,
+                                                     filters, ttl, False, time.time())
+                    pending[future] = position
+                    continue
+            except Exception as e:
+                entry = e
+            yield position, entry
+
+        for future in as_completed(pending):
+            try:
+                yield pending[future], future.result()
+            except Exception as e:
+                yield pending[future], e
+
+    def _cached_entry(self, cache_key: str, endpoint_name: str,
+                      filters: Optional[Dict], ttl: int) -> Optional[CacheEntry]:
+        """Servable cached or derived entry for a request, refreshing it in the background when stale"""
+        entry = self._lookup_entry(cache_key)
+        # Counts always come from the full list when it is fresh, other
+        # filtered requests only when they aren't cached themselves
+        if endpoint_name.endswith('.count') or (filters and (entry is None or entry.is_expired)):
+            derived = self._derive_entry(endpoint_name, filters)
+            if derived is not None:
+                self.metrics.inc('cache_requests_total', endpoint=self._endpoint_label(endpoint_name),
+                                 result='derived')
+                return derived
+        self._record_lookup(endpoint_name, entry)
+        # Restored entries may miss changes made while no process was
+        # running, refresh them however fresh they look
+        if entry is not None and (entry.is_expired or entry.restored):
+            self._schedule_refresh(cache_key, endpoint_name, filters, ttl)
+        return entry
+
+    def _record_fill(self, endpoint_name: str, shared: bool, requested_at: float):
+        if shared:
+            self.metrics.inc('singleflight_shared_total', endpoint=self._endpoint_label(endpoint_name))
+            self.metrics.observe('singleflight_wait_seconds', time.time() - requested_at,
+                                 endpoint=self._endpoint_label(endpoint_name))
+
+    def _derive_entry(self, endpoint_name: str, filters: Optional[Dict]) -> Optional[CacheEntry]:
+        """
+        Answer a filtered or .count request from the fresh unfiltered entry of
+        the same endpoint, when the filters can be evaluated locally. The
+        result holds references to the cached records, not copies, and is not
+        cached itself.
+        """
+        counting = endpoint_name.endswith('.count')
+        base_name = endpoint_name[:-len('.count')] if counting else endpoint_name
+        filters = filters or {}
+        base_key = self._get_cache_key(base_name, None)
+        base = self.cache.get(base_key)
+        if base is None or base.is_expired:
+            return None
+        if base.restored:
+            self._schedule_refresh(base_key, base_name, None, base.ttl)
+        if filters and (not base.data or not can_evaluate(base.data[0], filters)):
+            return None
+
+        if not filters:
+            positions = range(len(base.data))
+        else:
+            if base.index is None:
+                base.index = EntryIndex(base.data)
+            positions = sorted(base.index.positions(filters_to_query(filters).filters))
+
+        if counting:
+            data = [len(positions)]
+        else:
+            data = [base.data[position] for position in positions]
+
+        # The same base version and filters always select the same rows, so
+        # the ETag needs no encoding and a 304 never encodes the body at all
+        derived_key = self._get_cache_key(endpoint_name, filters)
+        return CacheEntry(
+            data=data,
+            timestamp=base.timestamp,
+            ttl=base.ttl,
+            endpoint_name=endpoint_name,
+            filters=filters,
+            last_access=time.time(),
+            version=hashlib.blake2b(f"{base.version}:{derived_key}".encode(), digest_size=12).hexdigest()
+        )
+
+    def _endpoint_label(self, endpoint_name: str) -> str:
+        return endpoint_name if endpoint_name in self.metric_endpoints else 'other'
+
+    def _record_lookup(self, endpoint_name: str, entry: Optional[CacheEntry]):
+        if entry is None:
+            result = 'miss'
+        elif entry.is_expired:
+            result = 'stale'
+        else:
+            result = 'hit'
+        self.metrics.inc('cache_requests_total', endpoint=self._endpoint_label(endpoint_name), result=result)
+
+    def _fill_entry_sync(self, cache_key: str, endpoint_name: str,
+                         filters: Optional[Dict], ttl: int,
+                         force_refresh: bool, requested_at: float,
+                         on_page: Optional[Callable[[List[Dict]], None]] = None) -> CacheEntry:
+        """
+        Refetch under the backend's fill lock, so only one worker process hits
+        NetBox per key. Whoever waited on the lock reuses the entry stored
+        meanwhile: any fresh entry, or (for forced refreshes) one stored after
+        the request started. on_page only sees pages of an actual refetch.
+        """
+        with self.cache.fill_lock(cache_key):
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                if entry.timestamp >= requested_at:
+                    return entry
+                if not force_refresh and not entry.is_expired and not entry.restored:
+                    return entry
+
+            return self._refresh_entry_sync(cache_key, endpoint_name, filters, ttl, on_page)
+
+    def _lookup_entry(self, cache_key: str) -> Optional[CacheEntry]:
+        """Return a fresh or still-servable stale entry, dropping dead ones"""
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            entry = self._restore_entry(cache_key)
+        if entry is None:
+            return None
+        if self._is_servable(entry):
+            self.cache.touch(cache_key)
+            return entry
+        # Remove expired entry
+        self._evict(cache_key, 'expired', entry.info())
+        return None
+
+    def _is_servable(self, entry: Union[CacheEntry, EntryInfo]) -> bool:
+        # Restored entries get served however stale (up to snapshot_max_age)
+        # while the refresh runs, that is the point of a warm restart
+        if entry.restored:
+            return entry.age_seconds <= self.snapshot_max_age
+        return entry.is_servable(self.stale_grace)
+
+    def _restore_entry(self, cache_key: str) -> Optional[CacheEntry]:
+        """Move cache_key from the startup snapshot into the cache"""
+        if self.snapshot is None or cache_key not in self.snapshot:
+            return None
+
+        # Once per key, and _store_entry must not slip a newer entry in
+        # between loading and storing the snapshot copy
+        with self._cache_lock:
+            if cache_key not in self.snapshot:
+                # Restored by another thread meanwhile
+                return self.cache.get(cache_key)
+            try:
+                entry = self.snapshot.load(cache_key)
+            except Exception as e:
+                print(e)
+                entry = None
+            self.snapshot.discard(cache_key)
+            if entry is None:
+                return None
+
+            entry.restored = True
+            self.cache[cache_key] = entry
+            self.snapshot_status["restored_entries"] += 1
+        return entry
+
+    def load_snapshot(self, path: str, max_age: int = 86400) -> int:
+        """
+        Open the snapshot at path. Entries are unpickled from the mmapped file
+        on first access rather than all up front, and refreshed in the
+        background right after.
+        Returns the number of entries available.
+        """
+        self.snapshot_path = path
+        self.snapshot_max_age = max_age
+        self.snapshot = Snapshot.open(path)
+        if self.snapshot is None:
+            return 0
+        for key in self.snapshot.keys():
+            if time.time() - (self.snapshot.timestamp(key) or 0) > max_age:
+                self.snapshot.discard(key)
+        return len(self.snapshot)
+
+    def save_snapshot(self) -> int:
+        """Write every cache entry (and not yet restored snapshot entries) to snapshot_path"""
+        if not self.snapshot_path:
+            return 0
+
+        start_time = time.time()
+        try:
+            blobs = {}
+            if self.snapshot is not None:
+                # Never-requested entries from the previous snapshot carry over
+                # as is, until they are snapshot_max_age old like the others
+                for key in self.snapshot.keys():
+                    timestamp = self.snapshot.timestamp(key)
+                    blob = self.snapshot.blob(key)
+                    if blob is not None and timestamp is not None and time.time() - timestamp <= self.snapshot_max_age:
+                        blobs[key] = (blob, timestamp)
+            for key, info in self.cache.infos().items():
+                entry = self.cache.get(key) if info.age_seconds <= self.snapshot_max_age else None
+                if entry is not None:
+                    blobs[key] = (pickle.dumps(replace(entry, restored=False), protocol=pickle.HIGHEST_PROTOCOL),
+                                  entry.timestamp)
+
+            write_snapshot(self.snapshot_path, blobs)
+        except Exception as e:
+            self.snapshot_status["last_error"] = str(e)
+            print(e)
+            return 0
+
+        self.snapshot_status.update(
+            last_saved_at=datetime.now().isoformat(),
+            last_save_seconds=round(time.time() - start_time, 2),
+            last_saved_entries=len(blobs),
+            last_error=None,
+        )
+        return len(blobs)
+
+    def start_snapshots(self, interval: int = 300):
+        """
+        Periodically snapshot the cache to snapshot_path (set by load_snapshot).
+        Call after start_cache_manager; snapshots stop with it.
+        """
+        if self.snapshot_thread is not None or not self.snapshot_path:
+            return
+
+        self.snapshot_thread = threading.Thread(
+            target=self._snapshot_thread,
+            args=(interval,),
+            daemon=True
+        )
+        self.snapshot_thread.start()
+
+    def _snapshot_thread(self, interval: int):
+        """Background thread writing cache snapshots"""
+        while self.is_running:
+            time.sleep(interval)
+
+            if not self.is_running:
+                break
+
+            self.save_snapshot()
+
+    def _refresh_entry_sync(self, cache_key: str, endpoint_name: str,
+                            filters: Optional[Dict], ttl: int,
+                            on_page: Optional[Callable[[List[Dict]], None]] = None) -> CacheEntry:
+        """Fetch from NetBox and store the result; caller holds the fetch lock"""
+        # Fetch fresh data
+        start_time = time.time()
+
+        try:
+            data = self._fetch_netbox_data_sync(endpoint_name, filters, on_page)
+        except Exception:
+            self.metrics.inc('upstream_errors_total', endpoint=self._endpoint_label(endpoint_name))
+            raise
+
+        self.metric_endpoints.add(endpoint_name)
+        fetch_time = time.time() - start_time
+        self.metrics.observe('upstream_fetch_seconds', fetch_time, endpoint=self._endpoint_label(endpoint_name))
+        self.metrics.inc('upstream_items_total', len(data), endpoint=self._endpoint_label(endpoint_name))
+
+        return self._store_entry(cache_key, endpoint_name, filters, data, ttl)
+
+    def _store_entry(self, cache_key: str, endpoint_name: str,
+                     filters: Optional[Dict], data: List[Dict], ttl: int,
+                     event: str = 'refreshed', delta: Optional[Dict] = None) -> CacheEntry:
+        """
+        Cache freshly fetched (or patched) data under cache_key and publish
+        event, with delta (upserted records, deleted ids) for patches
+        """
+        now = time.time()
+        body = json_dumps(data)
+        encodings = compress_body(body, self.compress_encodings, self.compress_min_bytes)
+        if self.compact and data and isinstance(data[0], Mapping):
+            data = ColumnarRecords(data)
+        entry = CacheEntry(
+            data=data,
+            timestamp=now,
+            ttl=ttl,
+            endpoint_name=endpoint_name,
+            filters=filters,
+            size_bytes=estimate_size(data) + len(body) + sum(len(value) for value in encodings.values()),
+            last_access=now,
+            body=body,
+            version=hashlib.blake2b(body, digest_size=12).hexdigest(),
+            encodings=encodings
+        )
+        if data and isinstance(data[0], Mapping):
+            entry.index = EntryIndex(data).build(INDEXED_FIELDS, ORDERED_FIELDS)
+            entry.group_counts = {
+                name: entry.index.group_counts(name)
+                for name in GROUPED_FIELDS if name in data[0]
+            }
+
+        if self.snapshot is not None:
             with self._cache_lock:
-                if cache_key in self.cache:
-                    entry = self.cache[cache_key]
-                    if not entry.is_expired:
-                        return entry.data
-                    else:
-                        # Remove expired entry
-                        del self.cache[cache_key]
-
-        # Ensure we have a lock for this cache key
-        if cache_key not in self.fetch_locks:
-            self.fetch_locks[cache_key] = threading.Lock()
-
-        # Fetch data (with lock to prevent concurrent fetches)
-        with self.fetch_locks[cache_key]:
-            # Double-check cache in case another thread fetched while we waited
-            if not force_refresh:
-                with self._cache_lock:
-                    if cache_key in self.cache and not self.cache[cache_key].is_expired:
-                        return self.cache[cache_key].data
-
-            # Fetch fresh data
-            start_time = time.time()
-
-            data = self._fetch_netbox_data_sync(endpoint_name, filters)
-
-            fetch_time = time.time() - start_time
-
-            # Cache the result
-            entry = CacheEntry(
-                data=data,
-                timestamp=time.time(),
-                ttl=ttl,
-                endpoint_name=endpoint_name,
-                filters=filters
-            )
+                # The snapshot copy is older than what we store now
+                self.snapshot.discard(cache_key)
+        # Writing to a shared backend pickles the entry, keep that and the
+        # budget check off _cache_lock
+        previous = self.cache.info(cache_key)
+        if previous is not None:
+            # Keep the usage history across refreshes for LFU
+            entry.hits = previous.hits
+        self.cache[cache_key] = entry
+        self._enforce_budget(keep=cache_key)
+
+        self._on_entry_stored(cache_key, entry)
+        self._publish(event, cache_key, entry, {
+            "previous_version": previous.version if previous is not None else None,
+            "changed": previous is None or previous.version != entry.version,
+            "count": len(data),
+        }, delta)
+        return entry
+
+    def _publish(self, event: str, cache_key: str, entry: Union[CacheEntry, EntryInfo], extra: Dict,
+                  delta: Optional[Dict] = None):
+        payload = {
+            "key": cache_key,
+            "endpoint": entry.endpoint_name,
+            "filters": entry.filters,
+            "version": entry.version,
+            "timestamp": entry.timestamp,
+            **extra,
+        }
+        self.events.publish(event, entry.endpoint_name, payload, delta)
+        self.metrics.inc('events_published_total', type=event)
+
+    def _evict(self, cache_key: str, reason: str, info: Optional[EntryInfo] = None) -> bool:
+        """
+        Delete cache_key and announce it, only if it still holds the entry
+        info describes (when given): it may have been refreshed since.
+        False when there was nothing to delete.
+        """
+        current = self.cache.info(cache_key)
+        if current is None or (info is not None and current.timestamp != info.timestamp):
+            return False
+        try:
+            del self.cache[cache_key]
+        except KeyError:
+            return False
+        self._publish('evicted', cache_key, current, {"reason": reason})
+        return True
+
+    def _on_entry_stored(self, cache_key: str, entry: CacheEntry):
+        """Bring the derived indexes up to date with a newly stored entry"""
+        if cache_key in IP_INDEX_ENDPOINTS:
+            self.thread_pool.submit(self._update_ip_index)
+        if cache_key in SEARCH_FIELDS:
+            self.thread_pool.submit(self._update_index_part, self.search_index,
+                                    self._search_index_lock, cache_key, entry)
+        if cache_key in JOIN_KEYS:
+            self.thread_pool.submit(self._update_index_part, self.join_index,
+                                    self._join_index_lock, cache_key, entry)
+
+    def _enforce_budget(self, keep: str):
+        """Evict entries until the cache fits max_entries/max_bytes, going by their infos only"""
+        if not self.max_entries and not self.max_bytes:
+            return
+
+        infos = self.cache.infos()
+        kept = infos.pop(keep, None)
+        total_bytes = sum(info.size_bytes for info in infos.values())
+        if kept is not None:
+            total_bytes += kept.size_bytes
 
+        if self.eviction_policy == 'lfu':
+            victims = sorted(infos, key=lambda key: (infos[key].hits, infos[key].last_access))
+        else:
+            victims = sorted(infos, key=lambda key: infos[key].last_access)
+
+        count = len(infos) + 1
+        for key in victims:
+            over_entries = self.max_entries and count > self.max_entries
+            over_bytes = self.max_bytes and total_bytes > self.max_bytes
+            if not over_entries and not over_bytes:
+                break
+
+            if not self._evict(key, 'budget', infos[key]):
+                # Refreshed meanwhile (its size is unknown here) or already gone
+                continue
+            count -= 1
+            total_bytes -= infos[key].size_bytes
             with self._cache_lock:
-                self.cache[cache_key] = entry
+                self.evictions += 1
+                self.evicted_bytes += infos[key].size_bytes
+            self.metrics.inc('evictions_total', endpoint=self._endpoint_label(infos[key].endpoint_name))
+
+    def _schedule_refresh(self, cache_key: str, endpoint_name: str,
+                          filters: Optional[Dict], ttl: int):
+        """Start a background refresh for a stale entry unless one is already running"""
+        with self._cache_lock:
+            if cache_key in self.refreshing:
+                return
+            self.refreshing.add(cache_key)
 
-            return data
+        try:
+            self.thread_pool.submit(self._background_refresh, cache_key, endpoint_name, filters, ttl)
+        except RuntimeError:
+            # Thread pool already shut down
+            with self._cache_lock:
+                self.refreshing.discard(cache_key)
+
+    def _background_refresh(self, cache_key: str, endpoint_name: str,
+                            filters: Optional[Dict], ttl: int):
+        try:
+            # Joins a foreground fill of the same key, and reuses the entry if
+            # someone refreshed it while we were queued
+            requested_at = time.time()
+            self.fills.do(
+                cache_key,
+                lambda: self._fill_entry_sync(cache_key, endpoint_name, filters, ttl, False, requested_at),
+            )
+        except Exception as e:
+            print(e)
+        finally:
+            with self._cache_lock:
+                self.refreshing.discard(cache_key)
 
     # Async version (for use in async frameworks like FastAPI)
     async def get_data_async(self, endpoint_name: str,
@@ -165,61 +1158,173 @@ class OptimizedNetBoxClient:
                              force_refresh: bool = False) -> List[Dict]:
         """
         Async version - get data from cache or fetch from NetBox
-        Use this in FastAPI, aiohttp, etc.
+        Use this in FastAPI, aiohttp, ASGI Django views, etc.
         """
+        return (await self.get_entry_async(endpoint_name, filters, ttl, force_refresh)).data
+
+    async def get_entry_async(self, endpoint_name: str,
+                              filters: Optional[Dict] = None,
+                              ttl: Optional[int] = None,
+                              force_refresh: bool = False) -> CacheEntry:
+        """Same as get_data_async but returns the whole CacheEntry, like get_entry_sync"""
         cache_key = self._get_cache_key(endpoint_name, filters)
         ttl = ttl or self.default_ttl
+        requested_at = time.time()
 
         # Check cache first (unless force refresh)
         if not force_refresh:
-            with self._cache_lock:
-                if cache_key in self.cache:
-                    entry = self.cache[cache_key]
-                    if not entry.is_expired:
-                        return entry.data
-                    else:
-                        # Remove expired entry
-                        del self.cache[cache_key]
-
-        # Ensure we have an async lock for this cache key
-        if cache_key not in self.async_fetch_locks:
-            self.async_fetch_locks[cache_key] = asyncio.Lock()
-
-        # Fetch data (with lock to prevent concurrent fetches)
-        async with self.async_fetch_locks[cache_key]:
-            # Double-check cache in case another coroutine fetched while we waited
-            if not force_refresh:
-                with self._cache_lock:
-                    if cache_key in self.cache and not self.cache[cache_key].is_expired:
-                        self.logger.info(f"Cache populated by another request for {endpoint_name}")
-                        return self.cache[cache_key].data
-
-            # Fetch fresh data in thread pool
-            start_time = time.time()
-
-            loop = asyncio.get_event_loop()
-            data = await loop.run_in_executor(
-                self.thread_pool,
-                self._fetch_netbox_data_sync,
-                endpoint_name,
-                filters
-            )
+            entry = self._cached_entry(cache_key, endpoint_name, filters, ttl)
+            if entry is not None:
+                return entry
+        return await self._fill_async(cache_key, endpoint_name, filters, ttl, force_refresh, requested_at)
+
+    async def _fill_async(self, cache_key: str, endpoint_name: str, filters: Optional[Dict],
+                          ttl: int, force_refresh: bool, requested_at: float) -> CacheEntry:
+        # Same in-flight registry as the sync path. The fill runs on fill_pool:
+        # thread_pool tasks (background refreshes, index rebuilds) may
+        # themselves be waiting on this key.
+        entry, shared = await self.fills.do_async(
+            cache_key,
+            lambda: self._fill_entry_sync(cache_key, endpoint_name, filters, ttl, force_refresh, requested_at),
+            executor=self.fill_pool,
+            timeout=self.fill_timeout,
+            not_before=requested_at if force_refresh else 0,
+        )
+        self._record_fill(endpoint_name, shared, requested_at)
+        return entry
 
-            fetch_time = time.time() - start_time
+    async def iter_entries_async(self, requests: List[Tuple[str, Optional[Dict]]],
+                                 ttl: Optional[int] = None) -> AsyncGenerator[Tuple[int, Any], None]:
+        """Async iter_entries_sync, the misses being filled through fill_pool"""
+        ttl = ttl or self.default_ttl
 
-            # Cache the result
-            entry = CacheEntry(
-                data=data,
-                timestamp=time.time(),
-                ttl=ttl,
-                endpoint_name=endpoint_name,
-                filters=filters
-            )
+        async def fill(position, cache_key, endpoint_name, filters):
+            try:
+                return position, await self._fill_async(cache_key, endpoint_name, filters, ttl, False, time.time())
+            except Exception as e:
+                return position, e
 
-            with self._cache_lock:
-                self.cache[cache_key] = entry
+        pending = []
+        for position, (endpoint_name, filters) in enumerate(requests):
+            cache_key = self._get_cache_key(endpoint_name, filters)
+            try:
+                entry = self._cached_entry(cache_key, endpoint_name, filters, ttl)
+                if entry is None:
+                    pending.append(fill(position, cache_key, endpoint_name, filters))
+                    continue
+            except Exception as e:
+                entry = e
+            yield position, entry
 
-            return data
+        for result in asyncio.as_completed(pending):
+            yield await result
+
+    def stream_pages_sync(self, endpoint_name: str,
+                          filters: Optional[Dict] = None,
+                          ttl: Optional[int] = None,
+                          chunk_size: int = 500) -> Generator[List[Dict], None, None]:
+        """
+        Records in lists, from the cache (chunk_size at a time) when it can
+        answer, otherwise each NetBox page as soon as it arrives. The fill
+        caches the result whether or not the consumer reads to the end.
+        """
+        cache_key = self._get_cache_key(endpoint_name, filters)
+        ttl = ttl or self.default_ttl
+        entry = self._cached_entry(cache_key, endpoint_name, filters, ttl)
+        if entry is None:
+            items = queue.Queue()
+            if self._start_streaming_fill(cache_key, endpoint_name, filters, ttl,
+                                          lambda *item: items.put(item)):
+                streamed = False
+                while True:
+                    kind, value = items.get()
+                    if kind == 'page':
+                        streamed = True
+                        yield value
+                    elif kind == 'error':
+                        raise value
+                    else:
+                        # No pages when the fill found an entry stored by another process
+                        entry = None if streamed else value
+                        break
+            else:
+                # Someone else is filling this key, wait for their entry
+                entry = self.get_entry_sync(endpoint_name, filters, ttl)
+        if entry is not None:
+            for i in range(0, len(entry.data), chunk_size):
+                yield entry.data[i:i + chunk_size]
+
+    async def stream_pages_async(self, endpoint_name: str,
+                                 filters: Optional[Dict] = None,
+                                 ttl: Optional[int] = None,
+                                 chunk_size: int = 500) -> AsyncGenerator[List[Dict], None]:
+        """Async stream_pages_sync, waiting for pages without holding a thread"""
+        cache_key = self._get_cache_key(endpoint_name, filters)
+        ttl = ttl or self.default_ttl
+        entry = self._cached_entry(cache_key, endpoint_name, filters, ttl)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            items = asyncio.Queue()
+
+            def emit(*item):
+                try:
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+                except RuntimeError:
+                    # Consumer's loop is gone, the fill still completes
+                    pass
+
+            if self._start_streaming_fill(cache_key, endpoint_name, filters, ttl, emit):
+                streamed = False
+                while True:
+                    kind, value = await items.get()
+                    if kind == 'page':
+                        streamed = True
+                        yield value
+                    elif kind == 'error':
+                        raise value
+                    else:
+                        entry = None if streamed else value
+                        break
+            else:
+                entry = await self.get_entry_async(endpoint_name, filters, ttl)
+        if entry is not None:
+            for i in range(0, len(entry.data), chunk_size):
+                yield entry.data[i:i + chunk_size]
+                # Yield control to allow other coroutines to run
+                await asyncio.sleep(0)
+
+    def _start_streaming_fill(self, cache_key: str, endpoint_name: str,
+                              filters: Optional[Dict], ttl: int,
+                              emit: Callable[..., None]) -> bool:
+        """
+        Fill cache_key on fill_pool, calling emit('page', records) per NetBox
+        page, then emit('done', entry) or emit('error', exception). The fill
+        is registered in self.fills so other callers join it. False when a
+        fill for cache_key is already in flight.
+        """
+        call = self.fills.lead(cache_key)
+        if call is None:
+            return False
+        requested_at = time.time()
+
+        def fill():
+            try:
+                entry = self._fill_entry_sync(cache_key, endpoint_name, filters, ttl, False, requested_at,
+                                              on_page=lambda page: emit('page', page))
+            except BaseException as e:
+                self.fills.settle(cache_key, call, error=e)
+                emit('error', e)
+            else:
+                self.fills.settle(cache_key, call, result=entry)
+                emit('done', entry)
+
+        try:
+            self.fill_pool.submit(fill)
+        except RuntimeError as e:
+            # Pool shut down, fail the call instead of leaving it registered
+            self.fills.settle(cache_key, call, error=e)
+            raise
+        return True
 
     def get_data_streaming_sync(self, endpoint_name: str,
                                 filters: Optional[Dict] = None,
@@ -227,37 +1332,39 @@ class OptimizedNetBoxClient:
                                 force_refresh: bool = False,
                                 chunk_size: int = 100) -> Generator[Dict, None, None]:
         """
-        Synchronous streaming version
+        Synchronous streaming version. Chunks are sent as NetBox pages arrive,
+        so the total isn't known up front; force_refresh drops the cached copy.
         """
+        if force_refresh:
+            self.force_refresh(endpoint_name, filters)
+        sent = 0
+        chunk_number = 0
         try:
-            data = self.get_data_sync(endpoint_name, filters, ttl, force_refresh)
-
             # Yield metadata first
             yield {
                 "status": "start",
                 "endpoint": endpoint_name,
-                "total_items": len(data),
                 "chunk_size": chunk_size,
-                "total_chunks": (len(data) + chunk_size - 1) // chunk_size,
-                "from_cache": not force_refresh
+                "from_cache": self.is_cached(endpoint_name, filters)[0]
             }
 
             # Stream data in chunks
-            for i in range(0, len(data), chunk_size):
-                chunk = data[i:i + chunk_size]
-                chunk_number = (i // chunk_size) + 1
-
-                yield {
-                    "status": "chunk",
-                    "chunk_number": chunk_number,
-                    "items_in_chunk": len(chunk),
-                    "data": chunk
-                }
+            for page in self.stream_pages_sync(endpoint_name, filters, ttl, chunk_size):
+                for i in range(0, len(page), chunk_size):
+                    chunk = page[i:i + chunk_size]
+                    chunk_number += 1
+                    sent += len(chunk)
+                    yield {
+                        "status": "chunk",
+                        "chunk_number": chunk_number,
+                        "items_in_chunk": len(chunk),
+                        "data": chunk
+                    }
 
             # Yield completion
             yield {
                 "status": "complete",
-                "total_items_sent": len(data)
+                "total_items_sent": sent
             }
 
         except Exception as e:
@@ -271,43 +1378,40 @@ class OptimizedNetBoxClient:
                                        filters: Optional[Dict] = None,
                                        ttl: Optional[int] = None,
                                        force_refresh: bool = False,
-                                       chunk_size: int = 100) -> AsyncGenerator[
-        dict[str, str | int | bool] | dict[str, str | int | list[dict]] | dict[str, str | int] | dict[str, str], None]:
+                                       chunk_size: int = 100) -> AsyncGenerator[Dict, None]:
         """
-        Async streaming version
+        Async streaming version, chunks are sent as NetBox pages arrive
         """
+        if force_refresh:
+            self.force_refresh(endpoint_name, filters)
+        sent = 0
+        chunk_number = 0
         try:
-            data = await self.get_data_async(endpoint_name, filters, ttl, force_refresh)
-
             # Yield metadata first
             yield {
                 "status": "start",
                 "endpoint": endpoint_name,
-                "total_items": len(data),
                 "chunk_size": chunk_size,
-                "total_chunks": (len(data) + chunk_size - 1) // chunk_size,
-                "from_cache": not force_refresh
+                "from_cache": self.is_cached(endpoint_name, filters)[0]
             }
 
             # Stream data in chunks
-            for i in range(0, len(data), chunk_size):
-                chunk = data[i:i + chunk_size]
-                chunk_number = (i // chunk_size) + 1
-
-                yield {
-                    "status": "chunk",
-                    "chunk_number": chunk_number,
-                    "items_in_chunk": len(chunk),
-                    "data": chunk
-                }
-
-                # Yield control to allow other coroutines to run
-                await asyncio.sleep(0)
+            async for page in self.stream_pages_async(endpoint_name, filters, ttl, chunk_size):
+                for i in range(0, len(page), chunk_size):
+                    chunk = page[i:i + chunk_size]
+                    chunk_number += 1
+                    sent += len(chunk)
+                    yield {
+                        "status": "chunk",
+                        "chunk_number": chunk_number,
+                        "items_in_chunk": len(chunk),
+                        "data": chunk
+                    }
 
             # Yield completion
             yield {
                 "status": "complete",
-                "total_items_sent": len(data)
+                "total_items_sent": sent
             }
 
         except Exception as e:
@@ -318,31 +1422,78 @@ class OptimizedNetBoxClient:
             }
 
     def _fetch_netbox_data_sync(self, endpoint_name: str,
-                                filters: Optional[Dict]) -> List[Dict]:
-        """Synchronous NetBox data fetch"""
-        endpoint= eval(f'self.nb.{endpoint_name}')
-
-        if 'count' in endpoint_name:
+                                filters: Optional[Dict],
+                                on_page: Optional[Callable[[List[Dict]], None]] = None) -> List[Dict]:
+        """Synchronous NetBox data fetch, passing each page to on_page in order as it arrives"""
+        if endpoint_name.endswith('.count'):
+            endpoint = self._resolve_endpoint(endpoint_name[:-len('.count')])
+            return [endpoint.count(**(filters or {}))]
+
+        endpoint = self._resolve_endpoint(endpoint_name)
+        fetch_page = self._fetch_page_raw if endpoint_name in self.raw_endpoints else self._fetch_page
+        return self._fetch_pages_parallel(endpoint, filters or {}, fetch_page, on_page)
+
+    def _fetch_pages_parallel(self, endpoint, filters: Dict, fetch_page,
+                              on_page: Optional[Callable[[List[Dict]], None]] = None) -> List[Dict]:
+        """
+        Read the total count, then fetch offset/limit pages concurrently on
+        page_pool and reassemble them in order
+        """
+        page_size = self.page_size
+        total = endpoint.count(**filters)
 
-            if filters:
-                query = eval(f'{endpoint_name}(**filters)')
-            else:
-                query = eval(f'self.nb.{endpoint_name}()')
-        elif filters:
-            query = endpoint.filter(**filters)
-        else:
-            query = endpoint.all()
+        offsets = list(range(0, total, page_size)) or [0]
+        futures = [self.page_pool.submit(fetch_page, endpoint, filters, offset, page_size) for offset in offsets]
+        pages = []
+        try:
+            for future in futures:
+                pages.append(future.result())
+                if on_page is not None:
+                    on_page(pages[-1])
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        # Records created between the count and the last page would be cut
+        # off, keep reading while pages come back full
+        offset = offsets[-1]
+        while len(pages[-1]) == page_size:
+            offset += page_size
+            pages.append(fetch_page(endpoint, filters, offset, page_size))
+            if on_page is not None:
+                on_page(pages[-1])
 
-        # Convert all items to dictionaries
         data = []
-        if 'count' in endpoint_name:
-            data=[query]
-        else:
-            for item in query:
-                data.append(dict(item))
-
+        for page in pages:
+            data.extend(page)
         return data
 
+    @staticmethod
+    def _fetch_page(endpoint, filters: Dict, offset: int, limit: int) -> List[Dict]:
+        """One page through pynetbox, hydrating Records and flattening them back"""
+        return [dict(item) for item in endpoint.filter(limit=limit, offset=offset, **filters)]
+
+    def _fetch_page_raw(self, endpoint, filters: Dict, offset: int, limit: int) -> List[Dict]:
+        """
+        One page straight from the REST API as plain dicts, skipping pynetbox
+        Record construction entirely
+        """
+        params = {key: value if value is not None else 'null' for key, value in filters.items()}
+        params.update(limit=limit, offset=offset)
+
+        token = self.nb.token
+        headers = {'accept': 'application/json'}
+        if token:
+            scheme = 'Bearer' if token.startswith('nbt_') else 'Token'
+            headers['authorization'] = f"{scheme} {token}"
+
+        response = self.nb.http_session.get(endpoint.url + '/', params=params, headers=headers)
+        if not response.ok:
+            raise pynetbox.RequestError(response)
+
+        return json_loads(response.content)['results']
+
     def force_refresh(self, endpoint_name: str, filters: Optional[Dict] = None) -> bool:
         """
         Force refresh of specific endpoint data
@@ -350,12 +1501,7 @@ class OptimizedNetBoxClient:
         """
         cache_key = self._get_cache_key(endpoint_name, filters)
 
-        with self._cache_lock:
-            if cache_key in self.cache:
-                del self.cache[cache_key]
-                return True
-            else:
-                return False
+        return self._evict(cache_key, 'cleared')
 
     def clear_cache(self, endpoint_name: Optional[str] = None,
                     filters: Optional[Dict] = None):
@@ -365,18 +1511,13 @@ class OptimizedNetBoxClient:
                 # Clear entire cache
                 cleared_count = len(self.cache)
                 self.cache.clear()
-                self.fetch_locks.clear()
-                self.async_fetch_locks.clear()
+                # One event for everything, clients refetch whatever they show
+                self.events.publish('evicted', None, {"key": None, "endpoint": None, "reason": "cleared"})
+                self.metrics.inc('events_published_total', type='evicted')
             else:
                 if filters is not None:
                     # Clear specific endpoint+filters combination
-                    cache_key = self._get_cache_key(endpoint_name, filters)
-                    if cache_key in self.cache:
-                        del self.cache[cache_key]
-                        if cache_key in self.fetch_locks:
-                            del self.fetch_locks[cache_key]
-                        if cache_key in self.async_fetch_locks:
-                            del self.async_fetch_locks[cache_key]
+                    self._evict(self._get_cache_key(endpoint_name, filters), 'cleared')
                 else:
                     # Clear all entries for this endpoint (any filters)
                     keys_to_remove = [
@@ -385,61 +1526,320 @@ class OptimizedNetBoxClient:
                     ]
 
                     for key in keys_to_remove:
-                        del self.cache[key]
-                        if key in self.fetch_locks:
-                            del self.fetch_locks[key]
-                        if key in self.async_fetch_locks:
-                            del self.async_fetch_locks[key]
+                        self._evict(key, 'cleared')
 
 
 
     def get_cache_status(self) -> Dict:
         """Get detailed cache status"""
+        # Entry infos, not the entries: nothing gets loaded or unpickled
+        infos = self.cache.infos()
         with self._cache_lock:
             status = {
                 "is_running": self.is_running,
                 "default_ttl_seconds": self.default_ttl,
-                "total_entries": len(self.cache),
-                "entries": {}
+                "stale_grace_seconds": self.stale_grace,
+                "refreshing": sorted(self.refreshing),
+                "in_flight": self.fills.in_flight(),
+                "fill_timeout_seconds": self.fill_timeout,
+                "total_entries": len(infos),
+                "memory": {
+                    "bytes": 0,
+                    "max_bytes": self.max_bytes,
+                    "max_entries": self.max_entries,
+                    "eviction_policy": self.eviction_policy,
+                    "evictions": self.evictions,
+                    "evicted_bytes": self.evicted_bytes,
+                },
+                "compression": {
+                    "encodings": self.compress_encodings,
+                    "min_bytes": self.compress_min_bytes,
+                    "body_bytes": 0,
+                    "encoded_bytes": {},
+                },
+                "entries": {},
+                "snapshot": {
+                    "path": self.snapshot_path,
+                    "pending_entries": len(self.snapshot) if self.snapshot is not None else 0,
+                    **self.snapshot_status,
+                },
+                "delta_sync": {
+                    "is_running": self.delta_sync_thread is not None and self.delta_sync_thread.is_alive(),
+                    "change_cursor": self.change_cursor,
+                    **self.delta_status,
+                },
+                "ip_index": {
+                    "prefixes": self.ip_index.prefix_count,
+                    "ip_addresses": self.ip_index.address_count,
+                    "tries": len(self.ip_index.tries),
+                    "built_at": datetime.fromtimestamp(self.ip_index.built_at).isoformat()
+                    if self.ip_index.built_at else None,
+                    "build_seconds": round(self.ip_index.build_seconds, 3),
+                },
+                "search_index": {
+                    endpoint_name: {
+                        "records": len(part.data),
+                        "tokens": len(part.tokens),
+                        "build_seconds": round(part.build_seconds, 3),
+                    }
+                    for endpoint_name, part in list(self.search_index.parts.items())
+                },
+                "events": {
+                    "last_event_id": self.events.last_event_id,
+                    "subscribers": len(self.events.subscribers),
+                },
+                "join_index": {
+                    endpoint_name: {name: len(join_map) for name, join_map in part.maps.items()}
+                    for endpoint_name, part in list(self.join_index.parts.items())
+                },
+                "warmer": {
+                    "is_running": self.warmer_thread is not None and self.warmer_thread.is_alive(),
+                    "targets": len(self.warm_targets),
+                    "warm": sum(1 for t in self.warm_status.values() if t["state"] == "warm"),
+                    "status": {key: dict(target) for key, target in self.warm_status.items()},
+                }
             }
 
-            for cache_key, entry in self.cache.items():
-                status["entries"][cache_key] = {
-                    "endpoint": entry.endpoint_name,
-                    "filters": entry.filters,
-                    "item_count": len(entry.data),
-                    "cached_at": datetime.fromtimestamp(entry.timestamp).isoformat(),
-                    "age_seconds": round(entry.age_seconds, 2),
-                    "ttl_seconds": entry.ttl,
-                    "remaining_ttl_seconds": round(entry.remaining_ttl, 2),
-                    "is_expired": entry.is_expired
-                }
+        for cache_key, info in infos.items():
+            status["entries"][cache_key] = {
+                "endpoint": info.endpoint_name,
+                "filters": info.filters,
+                "item_count": info.item_count,
+                "columnar": info.columnar,
+                "cached_at": datetime.fromtimestamp(info.timestamp).isoformat(),
+                "age_seconds": round(info.age_seconds, 2),
+                "ttl_seconds": info.ttl,
+                "remaining_ttl_seconds": round(info.remaining_ttl, 2),
+                "is_expired": info.is_expired,
+                "freshness": info.freshness,
+                "restored": info.restored,
+                "size_bytes": info.size_bytes,
+                "body_bytes": info.body_bytes,
+                "encoded_bytes": info.encoded_bytes,
+                "version": info.version,
+                "hits": info.hits
+            }
+            status["memory"]["bytes"] += info.size_bytes
+            status["compression"]["body_bytes"] += info.body_bytes
+            for name, size in info.encoded_bytes.items():
+                status["compression"]["encoded_bytes"][name] = \
+                    status["compression"]["encoded_bytes"].get(name, 0) + size
 
         return status
 
+    def query_entry(self, entry: CacheEntry, query: Query) -> Tuple[int, List[Dict]]:
+        """
+        Filter, order and paginate a cached entry in memory using its
+        secondary indexes; returns (total matches, requested page)
+        Raises UnsupportedQuery for lookups that can't be answered locally
+        """
+        if query.filters and entry.data and not can_evaluate(entry.data[0], query.filters):
+            raise UnsupportedQuery(f"{', '.join(query.filters)} can't be evaluated on cached {entry.endpoint_name}")
+        if entry.index is None:
+            entry.index = EntryIndex(entry.data)
+        return entry.index.select(query)
+
+    def count_groups(self, entry: CacheEntry, names: List[str],
+                     filters: Optional[Dict] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Records per value of each field in names, within the rows matching
+        filters. Unfiltered counts of GROUPED_FIELDS come precomputed with the
+        entry. Raises UnsupportedQuery for lookups that can't be answered locally
+        """
+        if not filters and all(name in entry.group_counts for name in names):
+            return {name: entry.group_counts[name] for name in names}
+
+        if entry.index is None:
+            entry.index = EntryIndex(entry.data)
+        positions = entry.index.positions(filters_to_query(filters).filters) if filters else None
+        return {name: entry.index.group_counts(name, positions) for name in names}
+
+    def get_ip_index(self) -> IPIndex:
+        """
+        The prefix/address index over the cached ipam.prefixes and
+        ipam.ip_addresses, rebuilt when either entry has a new version
+        """
+        return self._build_ip_index(*(self.get_entry_sync(name) for name in IP_INDEX_ENDPOINTS))
+
+    def _update_ip_index(self):
+        """
+        Rebuild the IP index after a store when both entries are cached.
+        Fetching a missing one is left to the ip_index endpoints: storing
+        prefixes shouldn't pull every address from NetBox.
+        """
+        entries = [self.cache.get(self._get_cache_key(name, None)) for name in IP_INDEX_ENDPOINTS]
+        if all(entry is not None for entry in entries):
+            self._build_ip_index(*entries)
+
+    def _build_ip_index(self, prefixes: CacheEntry, addresses: CacheEntry) -> IPIndex:
+        versions = (prefixes.version, addresses.version)
+        if self.ip_index.versions == versions:
+            return self.ip_index
+
+        with self._ip_index_lock:
+            if self.ip_index.versions != versions:
+                self.ip_index = IPIndex.build(prefixes.data, addresses.data, versions)
+            return self.ip_index
+
+    def get_search_index(self, endpoints: Optional[List[str]] = None) -> SearchIndex:
+        """
+        The full-text index, with the part of every endpoint whose cached
+        entry changed since it was indexed rebuilt (and only those)
+        """
+        for endpoint_name in endpoints or SEARCH_FIELDS:
+            self._update_index_part(self.search_index, self._search_index_lock,
+                                    endpoint_name, self.get_entry_sync(endpoint_name))
+        return self.search_index
+
+    def expand_records(self, endpoint_name: str, records: List[Dict], names: List[str]) -> List[Dict]:
+        """
+        Copies of records with the named relations (joins.RELATIONS) resolved
+        from the cached related endpoints.
+        Raises UnsupportedQuery for relations endpoint_name doesn't have
+        """
+        return self.expander(endpoint_name, names)(records)
+
+    def expander(self, endpoint_name: str, names: List[str]) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        expand_records bound to endpoint_name and names, with the join maps
+        brought up to date once, for expanding a large result batch by batch.
+        Raises UnsupportedQuery right away.
+        """
+        relations = JoinIndex.relations(endpoint_name, names)
+        ip_index = None
+        for relation in relations.values():
+            if relation.join_map == CONTAINING_PREFIX:
+                ip_index = self.get_ip_index()
+        for source in {relation.source for relation in relations.values()
+                       if relation.join_map != CONTAINING_PREFIX}:
+            self._update_index_part(self.join_index, self._join_index_lock,
+                                    source, self.get_entry_sync(source))
+        join_index = self.join_index
+        return lambda records: join_index.expand(endpoint_name, records, names, ip_index)
+
+    def _update_index_part(self, index, lock: threading.Lock, endpoint_name: str, entry: CacheEntry):
+        """Rebuild endpoint_name's part of a search/join index if entry is newer"""
+        if index.version(endpoint_name) == entry.version:
+            return
+        with lock:
+            if index.version(endpoint_name) != entry.version:
+                index.update(endpoint_name, entry.data, entry.version)
+
+    def render_metrics(self) -> str:
+        """Prometheus text exposition of the client metrics and per-entry gauges"""
+        # Entry infos are read without the lock and never load the data
+        infos = self.cache.infos()
+        with self._cache_lock:
+            in_flight = len(self.refreshing)
+
+        entry_bytes = {}
+        entry_items = {}
+        entry_age = {}
+        for cache_key, info in infos.items():
+            labels = (('endpoint', info.endpoint_name), ('key', cache_key))
+            entry_bytes[labels] = info.size_bytes
+            entry_items[labels] = info.item_count
+            entry_age[labels] = round(info.age_seconds, 3)
+
+        fill_waiters = {(('key', key),): call["waiters"] for key, call in self.fills.in_flight().items()}
+
+        return self.metrics.render({
+            'cache_entries': ("Entries currently cached", {(): len(infos)}),
+            'cache_bytes': ("Estimated bytes held by the cache", {(): sum(entry_bytes.values())}),
+            'cache_background_refreshes': ("Background refreshes in flight", {(): in_flight}),
+            'fills_in_flight': ("NetBox fills in flight", {(): len(fill_waiters)}),
+            'fill_waiters': ("Callers attached to each in-flight fill, leader included", fill_waiters),
+            'event_subscribers': ("Clients subscribed to cache events", {(): len(self.events.subscribers)}),
+            'entry_bytes': ("Estimated bytes per cache entry", entry_bytes),
+            'entry_items': ("Records per cache entry", entry_items),
+            'entry_age_seconds': ("Age of each cache entry", entry_age),
+        })
+
     def is_cached(self, endpoint_name: str, filters: Optional[Dict] = None) -> Tuple[bool, Optional[float]]:
         """Check if data is cached and fresh"""
         cache_key = self._get_cache_key(endpoint_name, filters)
 
-        with self._cache_lock:
-            if cache_key not in self.cache:
-                return False, None
-
-            entry = self.cache[cache_key]
-            if entry.is_expired:
-                return False, None
+        info = self.cache.info(cache_key)
+        if info is None or info.is_expired:
+            return False, None
 
-            return True, entry.remaining_ttl
+        return True, info.remaining_ttl
 
     @staticmethod
     def _get_cache_key( endpoint_name: str, filters: Optional[Dict]) -> str:
-        """Generate cache key from endpoint and filters"""
+        """
+        Generate cache key from endpoint and filters
+        Content-addressed, so it is the same in every worker process
+        """
         if filters:
-            filter_str = json.dumps(filters, sort_keys=True)
-            return f"{endpoint_name}:{hash(filter_str)}"
+            filter_str = json.dumps(filters, sort_keys=True, default=str)
+            digest = hashlib.blake2b(filter_str.encode(), digest_size=8).hexdigest()
+            return f"{endpoint_name}:{digest}"
         return endpoint_name
 
 
+def estimate_size(data: List[Dict], sample_size: int = 50) -> int:
+    """
+    Rough deep size of a list of records in bytes, measured on an evenly
+    spread sample and extrapolated, so large datasets stay cheap to size
+    """
+    if isinstance(data, ColumnarRecords):
+        return data.nbytes
+    if not data:
+        return sys.getsizeof(data)
+
+    step = max(1, len(data) // sample_size)
+    sample = data[::step][:sample_size]
+    sample_bytes = sum(_deep_size(item) for item in sample)
+    return sys.getsizeof(data) + int(sample_bytes * len(data) / len(sample))
+
+
+def _deep_size(obj: Any) -> int:
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key) + _deep_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_size(item) for item in obj)
+    return size
+
+
+def _belongs_to(cache_key: str, endpoint_name: str) -> bool:
+    """True for the cache keys of endpoint_name: unfiltered, filtered and counts"""
+    return (cache_key == endpoint_name or cache_key.startswith(f"{endpoint_name}:")
+            or cache_key.startswith(f"{endpoint_name}.count"))
+
+
+def patch_records(data: List[Dict], records: List[Dict], delete_ids: Set[int]) -> List[Dict]:
+    """
+    Return a copy of data with records replaced in place (matched on id),
+    new records appended and delete_ids removed
+    """
+    updates = {record['id']: record for record in records}
+    patched = []
+    for item in data:
+        item_id = item.get('id')
+        if item_id in delete_ids:
+            continue
+        patched.append(updates.pop(item_id, item))
+    patched.extend(updates.values())
+    return patched
+
+
+def parse_warm_targets(specs: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Turn warm-up specs like "dcim.devices" or "ipam.prefixes?status=active"
+    into (endpoint_name, filters) pairs
+    """
+    targets = []
+    for spec in specs:
+        endpoint_name, _, query = spec.strip().partition('?')
+        if not endpoint_name:
+            continue
+        filters = dict(parse_qsl(query)) if query else None
+        targets.append((endpoint_name, filters))
+    return targets
+
+
 nb:OptimizedNetBoxClient|None=None
 
 class InfrasotConfig(AppConfig):
@@ -450,5 +1850,53 @@ class InfrasotConfig(AppConfig):
 
     def ready(self):
         global nb
-        nb=OptimizedNetBoxClient(netbox_url=config('INFRASOT_API_URL'),token=config('INFRASOT_API_TOKEN'),default_ttl=300)
+        backend_name = config('INFRASOT_CACHE_BACKEND', default='local')
+        # Shared backends: entries each worker keeps unpickled on top of the shared copy
+        memo_bytes = config('INFRASOT_CACHE_MEMO_BYTES', default=256 * 1024 * 1024, cast=int)
+        backend_options = {
+            'local': {},
+            'django': {'alias': config('INFRASOT_CACHE_ALIAS', default='default'), 'memo_bytes': memo_bytes},
+            'shm': {'directory': config('INFRASOT_CACHE_DIR', default='/dev/shm/infrasot'), 'memo_bytes': memo_bytes},
+        }.get(backend_name, {})
+        nb=OptimizedNetBoxClient(netbox_url=config('INFRASOT_API_URL'),token=config('INFRASOT_API_TOKEN'),
+                                 default_ttl=config('INFRASOT_DEFAULT_TTL', default=300, cast=int),
+                                 stale_grace=config('INFRASOT_STALE_GRACE', default=300, cast=int),
+                                 backend=get_backend(backend_name, **backend_options),
+                                 max_bytes=config('INFRASOT_CACHE_MAX_BYTES', default=512 * 1024 * 1024, cast=int),
+                                 max_entries=config('INFRASOT_CACHE_MAX_ENTRIES', default=0, cast=int),
+                                 eviction_policy=config('INFRASOT_CACHE_EVICTION', default='lru'),
+                                 page_size=config('INFRASOT_PAGE_SIZE', default=500, cast=int),
+                                 page_workers=config('INFRASOT_PAGE_WORKERS', default=8, cast=int),
+                                 raw_endpoints=set(config('INFRASOT_RAW_ENDPOINTS', cast=Csv(), default=(
+                                     'dcim.devices,ipam.prefixes,ipam.vlans,ipam.ip_addresses'))),
+                                 compress_encodings=config('INFRASOT_COMPRESSION', cast=Csv(), default='zstd,br,gzip'),
+                                 compress_min_bytes=config('INFRASOT_COMPRESSION_MIN_BYTES', default=1024, cast=int),
+                                 compact=config('INFRASOT_COMPACT_STORAGE', default=True, cast=bool),
+                                 fill_timeout=config('INFRASOT_FILL_TIMEOUT', default=0, cast=float) or None,
+                                 fill_workers=config('INFRASOT_FILL_WORKERS', default=32, cast=int))
         nb.start_cache_manager(cleanup_interval=60)
+        atexit.register(nb.stop_cache_manager)
+
+        # Snapshots, delta sync and warming pull from NetBox in the
+        # background, which only serving processes want (shroo/wsgi.py and
+        # shroo/asgi.py turn this on), not every manage.py command
+        if not config('INFRASOT_BACKGROUND_JOBS', default=False, cast=bool):
+            return
+
+        # Private to the app: snapshots get unpickled, see snapshot.check_private
+        snapshot_path = config('INFRASOT_SNAPSHOT_PATH',
+                               default=str(settings.BASE_DIR / 'var' / 'infrasot' / 'cache.snapshot'))
+        if snapshot_path:
+            nb.load_snapshot(snapshot_path, max_age=config('INFRASOT_SNAPSHOT_MAX_AGE', default=86400, cast=int))
+        nb.start_snapshots(interval=config('INFRASOT_SNAPSHOT_INTERVAL', default=300, cast=int))
+        sync_interval = config('INFRASOT_DELTA_SYNC_INTERVAL', default=30, cast=int)
+        if sync_interval:
+            nb.start_delta_sync(
+                interval=sync_interval,
+                changelog_endpoint=config('INFRASOT_CHANGELOG_ENDPOINT', default='core.object_changes'),
+            )
+        nb.start_cache_warmer(
+            parse_warm_targets(config('INFRASOT_WARM_ENDPOINTS', cast=Csv(), default=(
+                'dcim.devices,ipam.prefixes,ipam.vlans,ipam.ip_addresses'))),
+            refresh_lead=config('INFRASOT_WARM_LEAD', default=60, cast=int),
+        )
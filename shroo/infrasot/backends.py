@@ -0,0 +1,421 @@
+import fcntl
+import os
+import pickle
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from mmap import mmap, ACCESS_READ
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from .snapshot import check_private
+
+
+class CacheBackend(MutableMapping):
+    """
+    Storage for OptimizedNetBoxClient cache entries, keyed by cache key.
+    Behaves like a dict so the client can keep using self.cache as before.
+    Entries provide info(), a small summary (CacheEntry.info) that backends
+    hand out without loading the entry itself.
+    """
+    # True when other worker processes see the same entries
+    shared = False
+
+    def fill_lock(self, key: str):
+        """Lock held while (re)fetching key, so only one worker hits NetBox"""
+        return nullcontext()
+
+    def info(self, key: str) -> Optional[Any]:
+        """Summary of key's entry, None if there is none"""
+        raise NotImplementedError
+
+    def infos(self) -> Dict[str, Any]:
+        """Summary of every entry by key"""
+        raise NotImplementedError
+
+    def touch(self, key: str):
+        """Count a read of key (hits, last access) for LRU/LFU eviction"""
+        raise NotImplementedError
+
+
+class LocalMemoryBackend(CacheBackend):
+    """Per-process dict, the original behaviour"""
+
+    def __init__(self):
+        self._entries: Dict[str, Any] = {}
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __setitem__(self, key, entry):
+        self._entries[key] = entry
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        return entry.info() if entry is not None else None
+
+    def infos(self) -> Dict[str, Any]:
+        return {key: entry.info() for key, entry in list(self._entries.items())}
+
+    def touch(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.hits += 1
+            entry.last_access = time.time()
+
+
+class _MemoizedSharedBackend(CacheBackend):
+    """
+    Base for shared backends. The data is stored once for every worker, but
+    each worker also keeps the entries it read most recently unpickled,
+    together with a cheap stamp, up to memo_bytes (by the entries'
+    size_bytes; 0 keeps none and unpickles on every read). It only
+    unpickles a stored entry again when its stamp changes. Summaries are
+    stored next to the entries; hits and last access are counted per
+    worker on top of them.
+    """
+    shared = True
+
+    def __init__(self, memo_bytes: int = 256 * 1024 * 1024):
+        self.memo_bytes = memo_bytes
+        self._local: 'OrderedDict[str, Tuple[object, object]]' = OrderedDict()
+        self._local_bytes = 0
+        self._usage: Dict[str, Tuple[int, float]] = {}
+        self._local_lock = threading.Lock()
+
+    def _stamp(self, key: str):
+        raise NotImplementedError
+
+    def _load(self, key: str):
+        raise NotImplementedError
+
+    def _stored_infos(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        stamp = self._stamp(key)
+        if stamp is None:
+            self._forget(key)
+            raise KeyError(key)
+
+        with self._local_lock:
+            memo = self._local.get(key)
+            if memo is not None and memo[0] == stamp:
+                self._local.move_to_end(key)
+                return memo[1]
+
+        entry = self._load(key)
+        if entry is None:
+            raise KeyError(key)
+        self._remember(key, stamp, entry)
+        return entry
+
+    def __contains__(self, key) -> bool:
+        # Only look at the stamp, never unpickle the entry
+        return self._stamp(key) is not None
+
+    def _remember(self, key: str, stamp, entry):
+        size = getattr(entry, 'size_bytes', 0)
+        with self._local_lock:
+            self._drop_local(key)
+            if not self.memo_bytes or size > self.memo_bytes:
+                return
+            self._local[key] = (stamp, entry)
+            self._local_bytes += size
+            # Least recently read entries go first
+            while self._local_bytes > self.memo_bytes:
+                self._drop_local(next(iter(self._local)))
+
+    def _drop_local(self, key: str):
+        """Drop key's memo; caller holds _local_lock"""
+        memo = self._local.pop(key, None)
+        if memo is not None:
+            self._local_bytes -= getattr(memo[1], 'size_bytes', 0)
+
+    def _forget(self, key: str):
+        with self._local_lock:
+            self._drop_local(key)
+            self._usage.pop(key, None)
+
+    def _stored_infos_of(self, keys) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def info(self, key: str) -> Optional[Any]:
+        return self._with_usage(key, self._stored_infos_of([key]).get(key))
+
+    def infos(self) -> Dict[str, Any]:
+        return {key: self._with_usage(key, info) for key, info in self._stored_infos().items()}
+
+    def _with_usage(self, key: str, info):
+        if info is not None:
+            with self._local_lock:
+                usage = self._usage.get(key)
+            if usage is not None:
+                info.hits += usage[0]
+                info.last_access = max(info.last_access, usage[1])
+        return info
+
+    def touch(self, key: str):
+        with self._local_lock:
+            hits, _ = self._usage.get(key, (0, 0.0))
+            self._usage[key] = (hits + 1, time.time())
+
+    def _stored(self, key: str):
+        """A new entry was written for key; its info carries the usage so far"""
+        with self._local_lock:
+            self._usage.pop(key, None)
+
+
+class DjangoCacheBackend(_MemoizedSharedBackend):
+    """
+    Entries stored in a Django cache (e.g. Redis or Memcached via CACHES),
+    shared by every worker using the same cache alias
+    """
+
+    def __init__(self, alias: str = 'default', prefix: str = 'infrasot',
+                 max_stale: int = 3600, lock_timeout: int = 120, **options):
+        super().__init__(**options)
+        from django.core.cache import caches
+        self.store = caches[alias]
+        self.prefix = prefix
+        # Entries outlive their TTL by this long so stale ones can still be served
+        self.max_stale = max_stale
+        self.lock_timeout = lock_timeout
+
+    def _key(self, key: str, kind: str) -> str:
+        return f"{self.prefix}:{kind}:{key}"
+
+    @property
+    def _index_key(self) -> str:
+        return f"{self.prefix}:keys"
+
+    def _stamp(self, key: str):
+        # The info key holds (stamp, entry info)
+        stamped = self.store.get(self._key(key, 'info'))
+        return stamped[0] if stamped is not None else None
+
+    def _load(self, key: str):
+        return self.store.get(self._key(key, 'entry'))
+
+    def _stored_infos_of(self, keys) -> Dict[str, Any]:
+        stamped = self.store.get_many([self._key(key, 'info') for key in keys])
+        return {key: stamped[self._key(key, 'info')][1] for key in keys if self._key(key, 'info') in stamped}
+
+    def _stored_infos(self) -> Dict[str, Any]:
+        return self._stored_infos_of(self.store.get(self._index_key, set()))
+
+    def __setitem__(self, key, entry):
+        stamp = f"{entry.timestamp}:{os.getpid()}:{uuid.uuid4().hex}"
+        timeout = entry.ttl + self.max_stale
+        self.store.set_many({
+            self._key(key, 'entry'): entry,
+            self._key(key, 'info'): (stamp, entry.info()),
+        }, timeout=timeout)
+        self._stored(key)
+        self._remember(key, stamp, entry)
+
+        if key not in self.store.get(self._index_key, set()):
+            with self._index_lock():
+                keys = self.store.get(self._index_key, set())
+                keys.add(key)
+                self.store.set(self._index_key, keys, timeout=None)
+
+    def __delitem__(self, key):
+        if self._stamp(key) is None:
+            raise KeyError(key)
+        self.store.delete_many([self._key(key, 'entry'), self._key(key, 'info')])
+        self._forget(key)
+
+        with self._index_lock():
+            keys = self.store.get(self._index_key, set())
+            keys.discard(key)
+            self.store.set(self._index_key, keys, timeout=None)
+
+    def __iter__(self) -> Iterator[str]:
+        keys = self.store.get(self._index_key, set())
+        stamps = self.store.get_many([self._key(key, 'info') for key in keys])
+        return iter([key for key in keys if self._key(key, 'info') in stamps])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear(self):
+        with self._index_lock():
+            keys = self.store.get(self._index_key, set())
+            self.store.delete_many(
+                [self._key(key, kind) for key in keys for kind in ('entry', 'info')] + [self._index_key]
+            )
+        with self._local_lock:
+            self._local.clear()
+            self._local_bytes = 0
+            self._usage.clear()
+
+    def fill_lock(self, key: str):
+        return self._lease(self._key(key, 'lock'), poll=0.1)
+
+    def _index_lock(self):
+        """Every worker rewrites the key index, one at a time"""
+        return self._lease(f"{self.prefix}:keys:lock", poll=0.01)
+
+    @contextmanager
+    def _lease(self, lock_key: str, poll: float):
+        """
+        Lock taken with cache.add under a token of our own; it expires after
+        lock_timeout if the holder dies. Raises TimeoutError when it can't
+        be taken by then: waiting longer means a live holder overran it.
+        """
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.lock_timeout + poll
+        while not self.store.add(lock_key, token, timeout=self.lock_timeout):
+            if time.time() > deadline:
+                raise TimeoutError(f"Gave up waiting {self.lock_timeout}s for {lock_key}")
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            # After an overrun the lease may be someone else's, leave it be.
+            # Not atomic, but only a lease expiring right here slips through.
+            if self.store.get(lock_key) == token:
+                self.store.delete(lock_key)
+
+
+_INFO_LENGTH = struct.Struct('<Q')
+
+
+class SharedFileBackend(_MemoizedSharedBackend):
+    """
+    One file per entry in a directory shared by same-host workers, /dev/shm
+    by default so it stays in memory: the pickled entry info, then the
+    pickled entry. Files are read through mmap and replaced atomically on
+    write. /dev/shm is writable by everyone, so the directory and every
+    file must be private to us (see check_private) before anything in them
+    gets unpickled.
+    """
+
+    def __init__(self, directory: str = '/dev/shm/infrasot', **options):
+        super().__init__(**options)
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(f"cache directory {directory}", os.stat(directory))
+
+    def _path(self, key: str, suffix: str = '.entry') -> str:
+        return os.path.join(self.directory, quote(key, safe='') + suffix)
+
+    def _stamp(self, key: str):
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _open(self, key: str):
+        """key's file for reading, refused when it isn't private"""
+        f = open(self._path(key), 'rb')
+        try:
+            check_private(f"cache file {f.name}", os.fstat(f.fileno()))
+        except ValueError as e:
+            print(e)
+            f.close()
+            raise
+        return f
+
+    def _load(self, key: str):
+        try:
+            with self._open(key) as f, mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+                (info_length,) = _INFO_LENGTH.unpack_from(data)
+                with memoryview(data) as view:
+                    return pickle.loads(view[_INFO_LENGTH.size + info_length:])
+        except (FileNotFoundError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _read_info(self, key: str):
+        """The entry info at the head of key's file, without reading the entry"""
+        try:
+            with self._open(key) as f:
+                (info_length,) = _INFO_LENGTH.unpack(f.read(_INFO_LENGTH.size))
+                return pickle.loads(f.read(info_length))
+        except (FileNotFoundError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _stored_infos_of(self, keys) -> Dict[str, Any]:
+        infos = {key: self._read_info(key) for key in keys}
+        return {key: info for key, info in infos.items() if info is not None}
+
+    def _stored_infos(self) -> Dict[str, Any]:
+        return self._stored_infos_of(list(self))
+
+    def __setitem__(self, key, entry):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        info = pickle.dumps(entry.info(), protocol=pickle.HIGHEST_PROTOCOL)
+        with open(_create_private(tmp_path, os.O_TRUNC), 'wb') as f:
+            f.write(_INFO_LENGTH.pack(len(info)))
+            f.write(info)
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._stored(key)
+        self._remember(key, self._stamp(key), entry)
+
+    def __delitem__(self, key):
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([
+            unquote(name[:-len('.entry')]) for name in os.listdir(self.directory)
+            if name.endswith('.entry')
+        ])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear(self):
+        for key in list(self):
+            try:
+                del self[key]
+            except KeyError:
+                pass
+
+    @contextmanager
+    def fill_lock(self, key: str):
+        with open(_create_private(self._path(key, '.lock'), os.O_APPEND), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _create_private(path: str, flags: int) -> int:
+    """Descriptor of path opened for writing, created readable by us only"""
+    return os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0o600)
+
+
+def get_backend(name: str = 'local', **options) -> CacheBackend:
+    """Build a cache backend from its config name: local, django or shm"""
+    if name == 'local':
+        return LocalMemoryBackend()
+    if name == 'django':
+        return DjangoCacheBackend(**options)
+    if name == 'shm':
+        return SharedFileBackend(**options)
+    raise ValueError(f"Unknown InfraSoT cache backend: {name}")
@@ -0,0 +1,176 @@
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Placeholder for rows that don't carry a column
+_MISSING = object()
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+class _Interner:
+    """
+    Hands out one shared object per distinct string / nested value, so the
+    same site, role or tenant dict is stored once for all records using it
+    """
+
+    def __init__(self):
+        self.strings: Dict[str, str] = {}
+        self.objects: Dict[Any, Any] = {}
+        self.nbytes = 0
+
+    def value(self, value: Any) -> Any:
+        if type(value) is str:
+            shared = self.strings.get(value)
+            if shared is None:
+                shared = self.strings[value] = value
+                self.nbytes += sys.getsizeof(value)
+            return shared
+        if isinstance(value, (dict, list)):
+            key = _freeze(value)
+            shared = self.objects.get(key)
+            if shared is None:
+                if isinstance(value, dict):
+                    shared = {self.value(name): self.value(item) for name, item in value.items()}
+                else:
+                    shared = [self.value(item) for item in value]
+                self.objects[key] = shared
+                self.nbytes += sys.getsizeof(shared)
+            return shared
+        return value
+
+
+def _freeze(value: Any) -> Any:
+    """Hashable key with the same equality as the JSON value"""
+    if isinstance(value, dict):
+        return dict, tuple((name, _freeze(item)) for name, item in value.items())
+    if isinstance(value, list):
+        return list, tuple(_freeze(item) for item in value)
+    if type(value) is str:
+        return value
+    # Keep 1, 1.0 and True apart
+    return type(value), value
+
+
+class ColumnarRecords(Sequence):
+    """
+    Read-only list of records stored by column: one list (or int64 array)
+    per key, strings and nested objects shared between rows, and the key
+    order of each distinct record shape kept once. Indexing returns a
+    RowView that reads like the original dict.
+
+    Nested values are shared between rows and must not be mutated.
+    """
+
+    def __init__(self, records: Iterable[Mapping]):
+        interner = _Interner()
+        shape_ids: Dict[Tuple[str, ...], int] = {}
+        self.shapes: List[Tuple[str, ...]] = []
+        self.shape_keys: List[frozenset] = []
+        self.row_shapes = array('H')
+        columns: Dict[str, List[Any]] = {}
+        scalar_bytes: Dict[str, int] = {}
+
+        length = 0
+        for record in records:
+            keys = tuple(record)
+            shape = shape_ids.get(keys)
+            if shape is None:
+                shape = shape_ids[keys] = len(self.shapes)
+                self.shapes.append(tuple(interner.value(key) for key in keys))
+                self.shape_keys.append(frozenset(keys))
+            self.row_shapes.append(shape)
+
+            for key in keys:
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [_MISSING] * length
+                    scalar_bytes[key] = 0
+                value = record[key]
+                if isinstance(value, (str, dict, list)):
+                    value = interner.value(value)
+                else:
+                    scalar_bytes[key] += sys.getsizeof(value)
+                column.append(value)
+
+            length += 1
+            if len(columns) > len(keys):
+                for column in columns.values():
+                    if len(column) < length:
+                        column.append(_MISSING)
+
+        self.columns: Dict[str, Any] = {}
+        nbytes = interner.nbytes + sys.getsizeof(self.row_shapes)
+        for key, column in columns.items():
+            if all(type(value) is int and _INT64_MIN <= value <= _INT64_MAX for value in column):
+                # ids and other integer columns as 8 bytes per row
+                column = array('q', column)
+            else:
+                nbytes += scalar_bytes[key]
+            self.columns[interner.value(key)] = column
+            nbytes += sys.getsizeof(column)
+
+        self.length = length
+        # Deep size of the stored data, shared objects counted once
+        self.nbytes = nbytes
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [RowView(self, row) for row in range(*position.indices(self.length))]
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('record index out of range')
+        return RowView(self, position)
+
+    def __iter__(self) -> Iterator['RowView']:
+        for row in range(self.length):
+            yield RowView(self, row)
+
+    def to_dicts(self) -> List[Dict]:
+        """Plain dict copies of every record (nested values still shared)"""
+        return [row.to_dict() for row in self]
+
+
+class RowView(Mapping):
+    """One record of a ColumnarRecords, read through its columns"""
+    __slots__ = ('records', 'row')
+
+    def __init__(self, records: ColumnarRecords, row: int):
+        self.records = records
+        self.row = row
+
+    def __getitem__(self, key):
+        records = self.records
+        if key not in records.shape_keys[records.row_shapes[self.row]]:
+            raise KeyError(key)
+        return records.columns[key][self.row]
+
+    def get(self, key, default=None):
+        records = self.records
+        if key not in records.shape_keys[records.row_shapes[self.row]]:
+            return default
+        return records.columns[key][self.row]
+
+    def __contains__(self, key) -> bool:
+        records = self.records
+        return key in records.shape_keys[records.row_shapes[self.row]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.records.shapes[self.records.row_shapes[self.row]])
+
+    def __len__(self) -> int:
+        return len(self.records.shapes[self.records.row_shapes[self.row]])
+
+    def to_dict(self) -> Dict:
+        columns = self.records.columns
+        row = self.row
+        return {key: columns[key][row] for key in self}
+
+    def __repr__(self) -> str:
+        return f"RowView({self.to_dict()!r})"
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Set
+
+
+@dataclass
+class Event:
+    id: int
+    type: str                            # refreshed, patched, evicted or reset
+    endpoint: Optional[str]
+    data: bytes                          # JSON payload
+    delta_data: Optional[bytes] = None   # Same with the delta, for patches
+
+    def encode(self, delta: bool = False) -> bytes:
+        """The event in text/event-stream framing"""
+        data = self.delta_data if delta and self.delta_data is not None else self.data
+        return b'id: %d\nevent: %s\ndata: %s\n\n' % (self.id, self.type.encode(), data)
+
+
+def _reset(event_id: int) -> Event:
+    """Tells a client it missed events and should refetch everything"""
+    return Event(event_id, 'reset', None, b'{}')
+
+
+class Subscription:
+    """Events for one client, queued on its event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, endpoints: Optional[Iterable[str]], max_queue: int):
+        self.loop = loop
+        self.endpoints = set(endpoints) if endpoints else None
+        self.max_queue = max_queue
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def wants(self, event: Event) -> bool:
+        if self.endpoints is None or event.endpoint is None:
+            return True
+        # dcim.devices also covers dcim.devices.count
+        return any(event.endpoint == name or event.endpoint.startswith(name + '.') for name in self.endpoints)
+
+    def deliver(self, event: Event):
+        """Queue event from any thread"""
+        if self.wants(event):
+            try:
+                self.loop.call_soon_threadsafe(self._put, event)
+            except RuntimeError:
+                # Loop closed, the client is gone and unsubscribes on its way out
+                pass
+
+    def _put(self, event: Event):
+        if self.queue.qsize() >= self.max_queue:
+            # Too far behind, a reset replaces the backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = _reset(event.id)
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """Next event, None after timeout seconds without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """
+    Fan-out of cache events from any thread to subscribers on event loops.
+    Publishing never blocks on a slow client: one that falls max_queue
+    events behind gets a reset instead. The last history events are kept so
+    reconnecting clients can resume from their Last-Event-ID.
+    """
+
+    def __init__(self, dumps: Callable[[Any], bytes], history: int = 1000, max_queue: int = 1000):
+        self.dumps = dumps
+        self.max_queue = max_queue
+        self.history: Deque[Event] = deque(maxlen=history)
+        self.subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def publish(self, type: str, endpoint: Optional[str], payload: Dict[str, Any],
+                delta: Optional[Dict[str, Any]] = None) -> Event:
+        data = self.dumps(payload)
+        delta_data = self.dumps(dict(payload, delta=delta)) if delta is not None else None
+        # Ids and delivery under one lock keep every client's events in order
+        with self._lock:
+            event = Event(self._next_id, type, endpoint, data, delta_data)
+            self._next_id += 1
+            self.history.append(event)
+            for subscription in self.subscribers:
+                subscription.deliver(event)
+        return event
+
+    def subscribe(self, endpoints: Optional[Iterable[str]] = None,
+                  last_event_id: Optional[int] = None) -> Subscription:
+        """
+        Subscribe the running event loop, replaying what came after
+        last_event_id (or a reset if that is no longer in history)
+        """
+        subscription = Subscription(asyncio.get_running_loop(), endpoints, self.max_queue)
+        with self._lock:
+            if last_event_id is not None and last_event_id < self._next_id - 1:
+                oldest = self.history[0].id if self.history else self._next_id
+                if oldest > last_event_id + 1:
+                    subscription._put(_reset(self._next_id - 1))
+                else:
+                    for event in self.history:
+                        if event.id > last_event_id and subscription.wants(event):
+                            subscription._put(event)
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    @property
+    def last_event_id(self) -> int:
+        return self._next_id - 1
@@ -0,0 +1,310 @@
+import ipaddress
+import socket
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ('key', 'length', 'children', 'prefixes', 'addresses', 'address_count')
+
+    def __init__(self, key: int, length: int):
+        self.key = key
+        self.length = length
+        self.children: List[Optional['_Node']] = [None, None]
+        self.prefixes: Optional[List[Any]] = None   # ipam.prefixes records for exactly this network
+        self.addresses: Optional[List[Any]] = None  # ipam.ip_addresses records for this host
+        self.address_count = 0                      # Distinct hosts with addresses in this subtree
+
+
+class PrefixTrie:
+    """
+    Path-compressed binary (Patricia) trie of the prefixes and addresses of
+    one VRF and address family. Nodes only exist for stored networks and
+    for the branch points between them, so depth is bounded by the number
+    of distinct prefix lengths rather than the address width.
+    """
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.root = _Node(0, 0)
+
+    def _bit(self, key: int, position: int) -> int:
+        """Bit of key right after the first position bits"""
+        return (key >> (self.bits - position - 1)) & 1
+
+    def _matches(self, node: _Node, key: int, length: int) -> bool:
+        """True when key/length falls inside node's network"""
+        if node.length > length:
+            return False
+        shift = self.bits - node.length
+        return key >> shift == node.key >> shift
+
+    def node(self, key: int, length: int) -> _Node:
+        """The node for key/length, created (and spliced in) if needed"""
+        bits = self.bits
+        node = self.root
+        while True:
+            if node.length == length:
+                return node
+            bit = (key >> (bits - node.length - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = node.children[bit] = _Node(key, length)
+                return child
+
+            common = bits - (key ^ child.key).bit_length()
+            if common > length:
+                common = length
+            if common >= child.length:
+                node = child
+                continue
+
+            if common == length:
+                # The new network contains the child
+                new = _Node(key, length)
+                new.children[self._bit(child.key, length)] = child
+                node.children[bit] = new
+                return new
+
+            # Diverging below node: add a branch point at the common bits
+            mask = ((1 << common) - 1) << (self.bits - common)
+            branch = _Node(key & mask, common)
+            branch.children[self._bit(child.key, common)] = child
+            new = branch.children[self._bit(key, common)] = _Node(key, length)
+            node.children[bit] = branch
+            return new
+
+    def count_addresses(self):
+        """Fill address_count bottom-up once everything is inserted"""
+        order = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for child in node.children if child is not None)
+        for node in reversed(order):
+            node.address_count = (1 if node.addresses else 0) + sum(
+                child.address_count for child in node.children if child is not None)
+
+    def covering(self, key: int, length: int) -> List[_Node]:
+        """Nodes holding prefixes that contain key/length, outermost first"""
+        found = []
+        node = self.root
+        while node is not None and self._matches(node, key, length):
+            if node.prefixes:
+                found.append(node)
+            if node.length == self.bits:
+                break
+            node = node.children[self._bit(key, node.length)]
+        return found
+
+    def subtree(self, key: int, length: int) -> Optional[_Node]:
+        """Topmost node inside key/length, i.e. the root of everything it contains"""
+        node = self.root
+        while node is not None and node.length < length:
+            if not self._matches(node, key, length):
+                return None
+            node = node.children[self._bit(key, node.length)]
+        if node is None:
+            return None
+        shift = self.bits - length
+        return node if node.key >> shift == key >> shift else None
+
+    def exact(self, key: int, length: int) -> Optional[_Node]:
+        node = self.subtree(key, length)
+        return node if node is not None and node.length == length else None
+
+
+def _vrf_id(record: Mapping) -> Optional[int]:
+    vrf = record.get('vrf')
+    return vrf.get('id') if isinstance(vrf, Mapping) else None
+
+
+def parse_network(value: str, host: bool = False) -> Tuple[int, int, int]:
+    """
+    (version, network as int, prefix length) of an address or CIDR, host
+    bits cleared; with host=True the address itself as a full-length
+    network. Raises ValueError. Much cheaper than the ipaddress module,
+    which matters when indexing every cached address.
+    """
+    address, _, length = value.strip().partition('/')
+    family, version, bits = (socket.AF_INET6, 6, 128) if ':' in address else (socket.AF_INET, 4, 32)
+    try:
+        key = int.from_bytes(socket.inet_pton(family, address), 'big')
+    except OSError:
+        raise ValueError(f"{value!r} does not appear to be an IPv4 or IPv6 network")
+    if host or not length:
+        return version, key, bits
+    if not length.isdigit() or int(length) > bits:
+        raise ValueError(f"{value!r} has an invalid prefix length")
+    length = int(length)
+    return version, key >> (bits - length) << (bits - length), length
+
+
+class IPIndex:
+    """
+    Longest-prefix match, children and utilisation over the cached
+    ipam.prefixes and ipam.ip_addresses, one PrefixTrie per VRF and family
+    (VRF None being the global table)
+    """
+
+    def __init__(self, versions: Tuple[str, str] = ('', '')):
+        # Versions of the prefixes and ip_addresses entries this was built from
+        self.versions = versions
+        self.tries: Dict[Tuple[Optional[int], int], PrefixTrie] = {}
+        self.prefix_count = 0
+        self.address_count = 0
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, prefixes: Iterable[Mapping], addresses: Iterable[Mapping],
+              versions: Tuple[str, str] = ('', '')) -> 'IPIndex':
+        start = time.time()
+        index = cls(versions)
+        for record in prefixes:
+            node = index._insert(record, record.get('prefix'), host=False)
+            if node is not None:
+                if node.prefixes is None:
+                    node.prefixes = []
+                node.prefixes.append(record)
+                index.prefix_count += 1
+        for record in addresses:
+            node = index._insert(record, record.get('address'), host=True)
+            if node is not None:
+                if node.addresses is None:
+                    node.addresses = []
+                node.addresses.append(record)
+                index.address_count += 1
+        for trie in index.tries.values():
+            trie.count_addresses()
+        index.built_at = time.time()
+        index.build_seconds = index.built_at - start
+        return index
+
+    def _insert(self, record: Mapping, value: Optional[str], host: bool) -> Optional[_Node]:
+        if not value:
+            return None
+        try:
+            # An address is stored under its host route, ignoring the mask
+            version, key, length = parse_network(value, host=host)
+        except ValueError:
+            return None
+        trie = self.tries.get((_vrf_id(record), version))
+        if trie is None:
+            trie = self.tries[(_vrf_id(record), version)] = PrefixTrie(32 if version == 4 else 128)
+        return trie.node(key, length)
+
+    def _trie(self, version: int, vrf_id: Optional[int]) -> Optional[PrefixTrie]:
+        return self.tries.get((vrf_id, version))
+
+    def lookup(self, value: str, vrf_id: Optional[int] = None) -> Dict[str, Any]:
+        """Most specific prefix containing an address or network, with its parents"""
+        version, key, length = parse_network(value)
+        trie = self._trie(version, vrf_id)
+        nodes = trie.covering(key, length) if trie is not None else []
+        host = trie.exact(key, length) if trie is not None and length == trie.bits else None
+        return {
+            "query": value,
+            "vrf_id": vrf_id,
+            "prefix": nodes[-1].prefixes[0] if nodes else None,
+            "parents": [node.prefixes[0] for node in nodes[:-1]],
+            "ip_addresses": host.addresses or [] if host is not None else [],
+        }
+
+    def children(self, value: str, vrf_id: Optional[int] = None, limit: int = 1000) -> Dict[str, Any]:
+        """Direct child prefixes of a network and the addresses inside it"""
+        version, key, length = parse_network(value)
+        trie = self._trie(version, vrf_id)
+        top = trie.subtree(key, length) if trie is not None else None
+        child_nodes = self._child_prefix_nodes(top, length)
+
+        addresses = []
+        stack = [top] if top is not None else []
+        while stack and len(addresses) < limit:
+            node = stack.pop()
+            addresses.extend(node.addresses or ())
+            # Right child first so addresses come out in ascending order
+            stack.extend(child for child in reversed(node.children) if child is not None)
+
+        return {
+            "query": value,
+            "vrf_id": vrf_id,
+            "prefix": top.prefixes[0] if top is not None and top.length == length and top.prefixes else None,
+            "child_prefixes": [node.prefixes[0] for node in child_nodes],
+            "ip_address_count": top.address_count if top is not None else 0,
+            "ip_addresses": addresses[:limit],
+        }
+
+    def utilization(self, value: str, vrf_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Share of a network in use, NetBox style: containers by their child
+        prefixes, other prefixes by their addresses. Also lists the free
+        space left between child prefixes.
+        """
+        network = ipaddress.ip_network(value.strip(), strict=False)
+        version, key, length = network.version, int(network.network_address), network.prefixlen
+        trie = self._trie(version, vrf_id)
+        top = trie.subtree(key, length) if trie is not None else None
+        child_nodes = self._child_prefix_nodes(top, length)
+        record = top.prefixes[0] if top is not None and top.length == length and top.prefixes else None
+
+        size = network.num_addresses
+        covered = sum(1 << (network.max_prefixlen - node.length) for node in child_nodes)
+        addresses = top.address_count if top is not None else 0
+
+        status = record.get('status') if record is not None else None
+        if isinstance(status, Mapping):
+            status = status.get('value')
+        if status == 'container':
+            used, capacity = covered, size
+        else:
+            is_pool = bool(record.get('is_pool')) if record is not None else False
+            # Network and broadcast addresses are not assignable in IPv4
+            capacity = size - 2 if version == 4 and length < 31 and not is_pool else size
+            used = addresses
+
+        available = []
+        start = key
+        for node in child_nodes:
+            if node.key > start:
+                available.extend(_summarize(version, start, node.key - 1))
+            start = node.key + (1 << (network.max_prefixlen - node.length))
+        end = key + size - 1
+        if start <= end:
+            available.extend(_summarize(version, start, end))
+
+        return {
+            "query": value,
+            "vrf_id": vrf_id,
+            "prefix": record,
+            "size": _json_int(size),
+            "child_prefix_coverage": _json_int(covered),
+            "ip_address_count": addresses,
+            "utilization": round(100 * used / capacity, 2) if capacity > 0 else 100.0,
+            "available_prefixes": available,
+        }
+
+    @staticmethod
+    def _child_prefix_nodes(top: Optional[_Node], length: int) -> List[_Node]:
+        """Nearest prefixes below length inside top's subtree, in address order"""
+        found = []
+        stack = [top] if top is not None else []
+        while stack:
+            node = stack.pop()
+            if node.length > length and node.prefixes:
+                found.append(node)
+                continue
+            stack.extend(child for child in reversed(node.children) if child is not None)
+        return found
+
+
+def _json_int(value: int):
+    """IPv6 sizes overflow JSON numbers, those are sent as strings"""
+    return value if value < 2 ** 53 else str(value)
+
+
+def _summarize(version: int, first: int, last: int) -> List[str]:
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    return [str(network) for network in ipaddress.summarize_address_range(address(first), address(last))]
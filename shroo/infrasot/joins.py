@@ -0,0 +1,150 @@
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from .iptrie import IPIndex
+from .query import UnsupportedQuery
+
+
+def _nested_id(name: str) -> Callable[[Mapping], Any]:
+    def key(record: Mapping):
+        value = record.get(name)
+        return value.get('id') if isinstance(value, Mapping) else None
+    return key
+
+
+def _own_id(record: Mapping):
+    return record.get('id')
+
+
+def _assigned_device_id(record: Mapping):
+    """Device of the interface an address is assigned to"""
+    assigned = record.get('assigned_object')
+    if not isinstance(assigned, Mapping):
+        return None
+    device = assigned.get('device')
+    return device.get('id') if isinstance(device, Mapping) else None
+
+
+def _host_in_vrf(record: Mapping):
+    """Address without its mask length, and its VRF id"""
+    address = record.get('address')
+    if not isinstance(address, str):
+        return None
+    return address.split('/')[0], _nested_id('vrf')(record)
+
+
+# Not a map of JOIN_KEYS: the most specific prefix containing the key, from the IP index
+CONTAINING_PREFIX = 'containing_prefix'
+
+# Foreign-key maps built from each endpoint: map name -> key of a record
+JOIN_KEYS: Dict[str, Dict[str, Callable[[Mapping], Any]]] = {
+    'dcim.devices': {'by_id': _own_id, 'by_site': _nested_id('site')},
+    'ipam.ip_addresses': {'by_id': _own_id, 'by_device': _assigned_device_id},
+    'ipam.prefixes': {'by_vlan': _nested_id('vlan')},
+    'ipam.vlans': {'by_id': _own_id, 'by_site': _nested_id('site')},
+}
+
+
+class Relation(NamedTuple):
+    source: str                       # Endpoint holding the related records
+    join_map: str                     # Map of source looked up
+    key: Callable[[Mapping], Any]     # Value of the expanded record to look up
+    many: bool                        # List of records, or a single one
+
+
+# ?expand= relations per endpoint
+RELATIONS: Dict[str, Dict[str, Relation]] = {
+    'dcim.devices': {
+        'ip_addresses': Relation('ipam.ip_addresses', 'by_device', _own_id, True),
+        'primary_ip4': Relation('ipam.ip_addresses', 'by_id', _nested_id('primary_ip4'), False),
+        'primary_ip6': Relation('ipam.ip_addresses', 'by_id', _nested_id('primary_ip6'), False),
+        # Every VLAN at the device's site, not the ones on its interfaces
+        'site_vlans': Relation('ipam.vlans', 'by_site', _nested_id('site'), True),
+    },
+    'ipam.ip_addresses': {
+        'device': Relation('dcim.devices', 'by_id', _assigned_device_id, False),
+        'prefix': Relation('ipam.prefixes', CONTAINING_PREFIX, _host_in_vrf, False),
+    },
+    'ipam.prefixes': {
+        'vlan': Relation('ipam.vlans', 'by_id', _nested_id('vlan'), False),
+    },
+    'ipam.vlans': {
+        'prefixes': Relation('ipam.prefixes', 'by_vlan', _own_id, True),
+        'devices': Relation('dcim.devices', 'by_site', _nested_id('site'), True),
+    },
+}
+
+
+class EndpointJoins:
+    """The JOIN_KEYS maps of one cached entry: map name -> key -> records"""
+
+    def __init__(self, data: List[Mapping], keys: Dict[str, Callable[[Mapping], Any]], version: str = ''):
+        self.version = version
+        self.maps: Dict[str, Dict[Any, List[Mapping]]] = {name: {} for name in keys}
+        for record in data:
+            for name, key in keys.items():
+                value = key(record)
+                if value is not None:
+                    self.maps[name].setdefault(value, []).append(record)
+
+
+class JoinIndex:
+    """
+    Foreign-key maps between cached endpoints. Each endpoint's maps are
+    rebuilt on their own when its entry changes, and expanding a record is
+    one dict lookup per relation.
+    """
+
+    def __init__(self):
+        self.parts: Dict[str, EndpointJoins] = {}
+
+    def version(self, endpoint_name: str) -> Optional[str]:
+        part = self.parts.get(endpoint_name)
+        return part.version if part is not None else None
+
+    def update(self, endpoint_name: str, data: List[Mapping], version: str):
+        self.parts[endpoint_name] = EndpointJoins(data, JOIN_KEYS[endpoint_name], version)
+
+    @staticmethod
+    def relations(endpoint_name: str, names: List[str]) -> Dict[str, Relation]:
+        """Relations for ?expand= names; raises UnsupportedQuery for unknown ones"""
+        available = RELATIONS.get(endpoint_name, {})
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise UnsupportedQuery(
+                f"Can't expand {', '.join(unknown)} on {endpoint_name}, "
+                f"available: {', '.join(available) or 'none'}")
+        return {name: available[name] for name in names}
+
+    def expand(self, endpoint_name: str, records: List[Mapping], names: List[str],
+               ip_index: Optional[IPIndex] = None) -> List[Dict]:
+        """
+        Copies of records with each named relation resolved in place;
+        ip_index answers the CONTAINING_PREFIX ones
+        """
+        relations = self.relations(endpoint_name, names)
+        expanded = []
+        for record in records:
+            record = dict(record)
+            for name, relation in relations.items():
+                key = relation.key(record)
+                if relation.join_map == CONTAINING_PREFIX:
+                    related = _containing_prefix(ip_index, key)
+                else:
+                    part = self.parts.get(relation.source)
+                    join_map = part.maps[relation.join_map] if part is not None else {}
+                    related = join_map.get(key, []) if key is not None else []
+                record[name] = related if relation.many else (related[0] if related else None)
+            expanded.append(record)
+        return expanded
+
+
+def _containing_prefix(ip_index: Optional[IPIndex], key) -> List[Mapping]:
+    if ip_index is None or key is None:
+        return []
+    try:
+        prefix = ip_index.lookup(*key)['prefix']
+    except ValueError:
+        # Not an address NetBox would have accepted
+        return []
+    return [prefix] if prefix is not None else []
@@ -0,0 +1,334 @@
+import asyncio
+import gc
+import json
+import multiprocessing
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pynetbox
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse, JsonResponse
+from django.test import RequestFactory
+
+from infrasot import views
+from infrasot.apps import OptimizedNetBoxClient, estimate_size, json_dumps, json_loads, orjson
+from infrasot.columnar import ColumnarRecords
+from infrasot.responses import StreamingJSONResponse
+
+
+def fake_ip_address(i: int) -> dict:
+    """A record shaped like NetBox's /api/ipam/ip-addresses/ output"""
+    return {
+        "id": i,
+        "url": f"https://netbox.example.com/api/ipam/ip-addresses/{i}/",
+        "display": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}/24",
+        "family": {"value": 4, "label": "IPv4"},
+        "address": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}/24",
+        "vrf": None,
+        "tenant": {"id": 1 + i % 5, "url": f"https://netbox.example.com/api/tenancy/tenants/{1 + i % 5}/",
+                   "display": f"Tenant {i % 5}", "name": f"Tenant {i % 5}", "slug": f"tenant-{i % 5}"},
+        "status": {"value": "active", "label": "Active"},
+        "role": None,
+        "assigned_object_type": "dcim.interface",
+        "assigned_object_id": i,
+        "assigned_object": {
+            "id": i, "url": f"https://netbox.example.com/api/dcim/interfaces/{i}/",
+            "display": "eth0", "name": "eth0",
+            "device": {"id": i // 4, "url": f"https://netbox.example.com/api/dcim/devices/{i // 4}/",
+                       "display": f"device-{i // 4}", "name": f"device-{i // 4}"},
+        },
+        "nat_inside": None,
+        "nat_outside": [],
+        "dns_name": f"host-{i}.example.com",
+        "description": "",
+        "comments": "",
+        "tags": [{"id": 1, "url": "https://netbox.example.com/api/extras/tags/1/",
+                  "display": "prod", "name": "prod", "slug": "prod", "color": "ff0000"}],
+        "custom_fields": {},
+        "created": "2024-01-01T00:00:00.000000Z",
+        "last_updated": "2024-01-01T00:00:00.000000Z",
+    }
+
+
+def fake_device(i: int) -> dict:
+    """A record shaped like NetBox's /api/dcim/devices/ output"""
+    site, role, tenant, model = i % 40, i % 12, i % 8, i % 25
+
+    def nested(kind, pk, name, **extra):
+        return {"id": pk, "url": f"https://netbox.example.com/api/{kind}/{pk}/",
+                "display": name, "name": name, "slug": name.lower().replace(' ', '-'), **extra}
+
+    return {
+        "id": i,
+        "url": f"https://netbox.example.com/api/dcim/devices/{i}/",
+        "display": f"device-{i}",
+        "name": f"device-{i}",
+        "device_type": nested("dcim/device-types", model, f"Model {model}",
+                              manufacturer=nested("dcim/manufacturers", model % 4, f"Vendor {model % 4}")),
+        "role": nested("dcim/device-roles", role, f"Role {role}"),
+        "tenant": nested("tenancy/tenants", tenant, f"Tenant {tenant}"),
+        "platform": None,
+        "serial": f"SN{i:08d}",
+        "asset_tag": None,
+        "site": nested("dcim/sites", site, f"Site {site}"),
+        "location": None,
+        "rack": nested("dcim/racks", i // 40, f"Rack {i // 40}"),
+        "position": float(i % 42 + 1),
+        "face": {"value": "front", "label": "Front"},
+        "status": {"value": "active" if i % 10 else "offline", "label": "Active" if i % 10 else "Offline"},
+        "airflow": None,
+        "primary_ip": None,
+        "primary_ip4": None,
+        "cluster": None,
+        "description": "",
+        "comments": "",
+        "config_template": None,
+        "local_context_data": None,
+        "tags": [{"id": 1, "url": "https://netbox.example.com/api/extras/tags/1/",
+                  "display": "prod", "name": "prod", "slug": "prod", "color": "ff0000"}] if i % 3 else [],
+        "custom_fields": {},
+        "created": "2024-01-01T00:00:00.000000Z",
+        "last_updated": "2024-01-01T00:00:00.000000Z",
+    }
+
+
+def retained(func):
+    """Returns (result, bytes still allocated by func once it returned, peak bytes)"""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def peak_rss_growth(func) -> int:
+    """
+    Bytes the peak RSS grew by while func ran, measured in a forked child
+    so every run starts from the same baseline (Linux only)
+    """
+    def child(conn):
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            # Reset the peak (VmHWM) to the current RSS
+            clear_refs.write('5')
+        before = _proc_status('VmRSS')
+        func()
+        conn.send(_proc_status('VmHWM') - before)
+        conn.close()
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(target=child, args=(sender,))
+    process.start()
+    growth = receiver.recv()
+    process.join()
+    return growth
+
+
+def _proc_status(field: str) -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+
+def measure(func):
+    """
+    Returns (result, cpu seconds, peak traced bytes, live blocks after).
+    Timed and traced in separate runs, tracemalloc slows allocations down.
+    """
+    start = time.process_time()
+    func()
+    cpu = time.process_time() - start
+
+    tracemalloc.start()
+    result = func()
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    return result, cpu, peak, blocks
+
+
+class Command(BaseCommand):
+    help = "Offline benchmarks for the InfraSoT NetBox cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=['hydration', 'memory', 'concurrency', 'response'])
+        parser.add_argument('--records', type=int, default=50000)
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=200, help="concurrency: requests sent at once")
+        parser.add_argument('--keys', type=int, default=20, help="concurrency: distinct cold endpoints requested")
+        parser.add_argument('--latency', type=float, default=0.5, help="concurrency: seconds per NetBox fetch")
+        parser.add_argument('--threads', type=int, default=1,
+                            help="concurrency: WSGI threads, 1 like the sync worker in gunicorn-cfg.py")
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['suite']}")(options)
+
+    def bench_hydration(self, options):
+        """pynetbox Record hydration vs raw JSON pages, no NetBox needed"""
+        records = options['records']
+        page_size = options['page_size']
+        pages = [
+            json.dumps({"count": records, "results": [
+                fake_ip_address(i) for i in range(offset, min(offset + page_size, records))
+            ]}).encode()
+            for offset in range(0, records, page_size)
+        ]
+
+        api = pynetbox.api('https://netbox.example.com', token='benchmark')
+        endpoint = api.ipam.ip_addresses
+
+        def via_records():
+            data = []
+            for page in pages:
+                for values in json.loads(page)['results']:
+                    data.append(dict(endpoint.return_obj(values, api, endpoint)))
+            return data
+
+        def via_raw():
+            data = []
+            for page in pages:
+                data.extend(json_loads(page)['results'])
+            return data
+
+        self.stdout.write(f"{records} ip addresses in {len(pages)} pages, "
+                          f"parser: {'orjson' if orjson is not None else 'json'}")
+        results = {}
+        for name, func in (('pynetbox Record', via_records), ('raw JSON', via_raw)):
+            data, cpu, peak, blocks = measure(func)
+            results[name] = data
+            self.stdout.write(f"  {name:<16} cpu {cpu:7.3f}s  peak {peak / 2 ** 20:8.1f} MiB  "
+                              f"live blocks {blocks}")
+
+        if results['pynetbox Record'] != results['raw JSON']:
+            self.stdout.write(self.style.WARNING("  outputs differ between the two paths"))
+
+    def bench_memory(self, options):
+        """Retained memory of cached devices as a list of dicts vs ColumnarRecords"""
+        records = options['records']
+        page_size = options['page_size']
+        pages = [
+            json.dumps({"count": records, "results": [
+                fake_device(i) for i in range(offset, min(offset + page_size, records))
+            ]}).encode()
+            for offset in range(0, records, page_size)
+        ]
+
+        def as_dicts():
+            data = []
+            for page in pages:
+                data.extend(json_loads(page)['results'])
+            return data
+
+        def as_columns():
+            return ColumnarRecords(as_dicts())
+
+        self.stdout.write(f"{records} devices in {len(pages)} pages")
+        results = {}
+        for name, func in (('list of dicts', as_dicts), ('columnar', as_columns)):
+            start = time.perf_counter()
+            func()
+            build = time.perf_counter() - start
+            data, kept, peak = retained(func)
+            results[name] = data
+
+            start = time.perf_counter()
+            for record in data:
+                record['name'], record['site']['slug'], record['status']['value']
+            scan = time.perf_counter() - start
+
+            self.stdout.write(f"  {name:<14} retained {kept / 2 ** 20:8.1f} MiB  peak {peak / 2 ** 20:8.1f} MiB  "
+                              f"estimated {estimate_size(data) / 2 ** 20:8.1f} MiB  "
+                              f"build {build:6.3f}s  scan {scan:6.3f}s")
+
+        if results['list of dicts'] != results['columnar'].to_dicts():
+            self.stdout.write(self.style.WARNING("  outputs differ between the two layouts"))
+
+    def bench_concurrency(self, options):
+        """
+        Cold-cache requests against a slow NetBox: sync views on a WSGI-like
+        thread pool vs async views on one event loop, as served over ASGI
+        """
+        requests, keys, latency, threads = (options['requests'], options['keys'],
+                                            options['latency'], options['threads'])
+        factory = RequestFactory()
+        paths = [f"/dcim/devices{i % keys}/" for i in range(requests)]
+        fetches = []
+
+        def client():
+            nb = OptimizedNetBoxClient('https://netbox.example.com', 'benchmark', compact=False)
+
+            def slow_fetch(endpoint_name, filters=None, on_page=None):
+                fetches.append(endpoint_name)
+                time.sleep(latency)
+                return [fake_device(i) for i in range(50)]
+            nb._fetch_netbox_data_sync = slow_fetch
+            return nb
+
+        # Latency counts from when the whole batch was sent, queueing included
+        def timed_sync(path):
+            views.gimme(factory.get(path))
+            return time.perf_counter() - start
+
+        async def timed_async(path):
+            await views.gimme_async(factory.get(path))
+            return time.perf_counter() - start
+
+        def wsgi():
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                return list(pool.map(timed_sync, paths))
+
+        async def asgi():
+            return await asyncio.gather(*(timed_async(path) for path in paths))
+
+        self.stdout.write(f"{requests} requests over {keys} cold endpoints, "
+                          f"NetBox answering in {latency}s")
+        original = views.nb
+        start = 0.0
+        try:
+            for name, run in ((f'WSGI x{threads}', wsgi), ('ASGI', lambda: asyncio.run(asgi()))):
+                views.nb = client()
+                fetches.clear()
+                start = time.perf_counter()
+                durations = sorted(run())
+                wall = time.perf_counter() - start
+                self.stdout.write(
+                    f"  {name:<9} {requests / wall:8.1f} req/s  wall {wall:6.2f}s  "
+                    f"p50 {statistics.median(durations):6.2f}s  "
+                    f"p99 {durations[int(len(durations) * 0.99) - 1]:6.2f}s  "
+                    f"fetches {len(fetches)}")
+        finally:
+            views.nb = original
+
+    def bench_response(self, options):
+        """
+        Peak RSS growth while building and sending a large list of records
+        with JsonResponse, one json_dumps body, or StreamingJSONResponse
+        """
+        records = [fake_device(i) for i in range(options['records'])]
+        gc.collect()
+
+        def send(response):
+            sent = 0
+            for chunk in response:
+                sent += len(chunk)
+            return sent
+
+        variants = (
+            ('JsonResponse', lambda: send(JsonResponse(records, safe=False))),
+            ('json_dumps body', lambda: send(HttpResponse(json_dumps(records), content_type='application/json'))),
+            ('StreamingJSON', lambda: send(StreamingJSONResponse(records))),
+        )
+
+        self.stdout.write(f"{len(records)} devices, body {len(json_dumps(records)) / 2 ** 20:.1f} MiB")
+        for name, func in variants:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"  {name:<16} peak RSS +{peak_rss_growth(func) / 2 ** 20:8.1f} MiB  "
+                              f"time {elapsed:6.3f}s")
@@ -0,0 +1,117 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# Label sets are stored as sorted tuples of (name, value) pairs
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ClientMetrics:
+    """
+    Counters and histograms for OptimizedNetBoxClient, rendered in the
+    Prometheus text exposition format. Uses its own lock so recording a
+    metric never waits on the cache lock.
+    """
+
+    def __init__(self, namespace: str = 'infrasot'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._histogram_buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = ('counter', help_text)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self._help[name] = ('histogram', help_text)
+        self._histograms.setdefault(name, {})
+        self._histogram_buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = Histogram(self._histogram_buckets[name])
+            series[key].observe(value)
+
+    def value(self, name: str, **labels) -> float:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            return self._counters[name].get(key, 0)
+
+    def render(self, gauges: Dict[str, Tuple[str, Dict[Labels, float]]] = None) -> str:
+        """
+        Prometheus text format of everything recorded, plus the given gauges
+        ({name: (help, {labels: value})}) sampled by the caller
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._counters.items():
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {self._help[name][1]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+            for name, series in self._histograms.items():
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {self._help[name][1]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else _format_value(bound)
+                        lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+
+        for name, (help_text, series) in (gauges or {}).items():
+            full_name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
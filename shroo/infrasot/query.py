@@ -0,0 +1,316 @@
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Query string parameters that are not record filters
+RESERVED_PARAMS = {'ordering', 'limit', 'offset', 'expand'}
+# NetBox API parameters about the representation, ignored on cached data
+IGNORED_PARAMS = {'format', 'brief'}
+# Filters NetBox evaluates in ways cached records can't reproduce: search,
+# address/prefix match the host whatever the mask, MAC addresses are
+# normalized
+NETBOX_FILTERS = {'q', 'address', 'prefix', 'mac_address'}
+# Filters that NetBox matches against another field of the nested object
+# than the slug or name _flatten picks, vrf=<route distinguisher>
+NESTED_FILTER_FIELDS = {'vrf': 'rd'}
+
+# Fields indexed as soon as an entry is stored; any other field gets its
+# index built on first use
+INDEXED_FIELDS = ('status', 'site', 'site_id', 'role', 'role_id', 'tenant', 'tenant_id',
+                  'vlan', 'vlan_id', 'vrf', 'vrf_id', 'family', 'tag', 'device_type', 'platform')
+# Fields whose sort order is precomputed the same way
+ORDERED_FIELDS = ('name',)
+# Fields whose per-value counts are kept with every stored entry
+GROUPED_FIELDS = ('status', 'site', 'role', 'tenant')
+
+
+class UnsupportedQuery(ValueError):
+    """The filter can't be answered from cached data"""
+
+
+@dataclass
+class Query:
+    filters: Dict[str, List[str]] = field(default_factory=dict)
+    ordering: List[str] = field(default_factory=list)
+    limit: Optional[int] = None
+    offset: int = 0
+    # Relations to resolve on the returned rows, see joins.RELATIONS
+    expand: List[str] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return (not self.filters and not self.ordering and self.limit is None and not self.offset
+            and not self.expand)
+
+
+def parse_query(params) -> Query:
+    """
+    Build a Query from a QueryDict (or a plain dict of lists/values), e.g.
+    ?status=active&site=x&ordering=-name&limit=50&offset=100&expand=site_vlans
+    """
+    query = Query()
+    for key in params:
+        if key in IGNORED_PARAMS:
+            continue
+        values = params.getlist(key) if hasattr(params, 'getlist') else params[key]
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        values = [str(value) for value in values]
+
+        if key == 'ordering':
+            query.ordering = [name for value in values for name in value.split(',') if name]
+        elif key == 'limit':
+            query.limit = _parse_int(key, values[-1]) or None
+        elif key == 'offset':
+            query.offset = _parse_int(key, values[-1])
+        elif key == 'expand':
+            query.expand = [name for value in values for name in value.split(',') if name]
+        else:
+            query.filters[key] = values
+    return query
+
+
+def _parse_int(key: str, value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise UnsupportedQuery(f"{key} must be an integer")
+    if number < 0:
+        raise UnsupportedQuery(f"{key} must not be negative")
+    return number
+
+
+def filters_to_query(filters: Dict[str, Any]) -> Query:
+    """Query for a get_data_sync style filters dict ({'site_id': [1, 2], 'status': 'active'})"""
+    query = Query()
+    for name, value in filters.items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        query.filters[name] = [index_key(item) for item in values]
+    return query
+
+
+def can_evaluate(sample: Any, filters: Dict[str, Any]) -> bool:
+    """
+    True when every filter is an equality/__in/__n lookup on a field the
+    cached records actually carry, so the answer matches what NetBox would
+    return. Anything else (q, region, __ic, ...) has to go to NetBox.
+    """
+    if not isinstance(sample, Mapping) or not can_evaluate_names(filters):
+        return False
+    for name in filters:
+        base = name.partition('__')[0]
+        if '.' in base:
+            # Dotted path into a nested object, site.name
+            base = base.split('.')[0]
+        if base == 'tag':
+            if 'tags' not in sample:
+                return False
+        elif base not in sample and not (base.endswith('_id') and base[:-3] in sample):
+            return False
+    return True
+
+
+def can_evaluate_names(filters: Dict[str, Any]) -> bool:
+    """
+    can_evaluate going by the filter names alone, before any record is at
+    hand. False when the filters have to go to NetBox whatever the cached
+    records carry.
+    """
+    for name in filters:
+        base, _, lookup = name.partition('__')
+        if name in RESERVED_PARAMS or base in NETBOX_FILTERS or lookup not in ('', 'in', 'n'):
+            return False
+    return True
+
+
+def index_key(value: Any) -> str:
+    """Normalize a record value the way it appears in a query string"""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def field_values(record: Dict, name: str) -> List[Any]:
+    """
+    Values of a record for a NetBox-style filter name:
+    site -> nested slug (or name/value), site_id -> nested id,
+    status -> choice value, tag -> tag slugs, vrf -> nested RD,
+    site.name -> dotted path
+    """
+    if '.' in name:
+        value: Any = record
+        for part in name.split('.'):
+            value = value.get(part) if isinstance(value, Mapping) else None
+        return _flatten(value)
+
+    if name == 'tag':
+        return [tag.get('slug') for tag in record.get('tags') or () if isinstance(tag, Mapping)]
+
+    if name in NESTED_FILTER_FIELDS:
+        nested = record.get(name)
+        if isinstance(nested, Mapping):
+            # A VRF without an RD matches no vrf= filter (and isn't null)
+            value = nested.get(NESTED_FILTER_FIELDS[name])
+            return [value] if value is not None else []
+        return [None]
+
+    if name not in record and name.endswith('_id'):
+        nested = record.get(name[:-3])
+        if isinstance(nested, Mapping):
+            return [nested.get('id')]
+        if isinstance(nested, list):
+            return [item.get('id') for item in nested if isinstance(item, Mapping)]
+        return [None]
+
+    return _flatten(record.get(name))
+
+
+def _flatten(value: Any) -> List[Any]:
+    if isinstance(value, list):
+        return [item for element in value for item in _flatten(element)]
+    if isinstance(value, Mapping):
+        # Choice fields ({value, label}) and nested objects (slug, name, id)
+        for key in ('value', 'slug', 'name', 'id'):
+            if key in value:
+                return [value[key]]
+        return [None]
+    return [value]
+
+
+def sort_key(record: Dict, name: str):
+    """Sortable key for ordering=name, None sorts first"""
+    values = field_values(record, name)
+    value = values[0] if values else None
+    if value is None:
+        return 0, ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 1, value
+    return 2, str(value)
+
+
+class EntryIndex:
+    """
+    Secondary indexes over one cached list: per field, normalized value ->
+    sorted row positions, plus per-field sort ranks for ordering
+    """
+
+    def __init__(self, data: List[Dict]):
+        self.data = data
+        self.fields: Dict[str, Dict[str, List[int]]] = {}
+        self.ranks: Dict[str, List[int]] = {}
+
+    def build(self, names: Iterable[str], orderings: Iterable[str] = ()) -> 'EntryIndex':
+        """Eagerly index the given fields where the records have them"""
+        if self.data:
+            sample = self.data[0]
+            for name in names:
+                base = name[:-3] if name.endswith('_id') else name
+                if base in sample or (name == 'tag' and 'tags' in sample):
+                    self.field(name)
+            for name in orderings:
+                if name in sample:
+                    self.rank(name)
+        return self
+
+    def field(self, name: str) -> Dict[str, List[int]]:
+        index = self.fields.get(name)
+        if index is None:
+            index = {}
+            for position, record in enumerate(self.data):
+                for value in set(index_key(value) for value in field_values(record, name)):
+                    index.setdefault(value, []).append(position)
+            self.fields[name] = index
+        return index
+
+    def rank(self, name: str) -> List[int]:
+        """rank[position] = place of that row when sorted by name"""
+        ranks = self.ranks.get(name)
+        if ranks is None:
+            keys = [sort_key(record, name) for record in self.data]
+            order = sorted(range(len(self.data)), key=keys.__getitem__)
+            ranks = [0] * len(self.data)
+            place = 0
+            for i, position in enumerate(order):
+                # Equal keys share a rank so later ordering fields can break ties
+                if i and keys[position] != keys[order[i - 1]]:
+                    place = i
+                ranks[position] = place
+            self.ranks[name] = ranks
+        return ranks
+
+    def covers(self, query: Query, names: Iterable[str] = ()) -> bool:
+        """
+        True when select(query), and group_counts of names, only read indexes
+        that are already built
+        """
+        fields = [name.partition('__')[0] for name in query.filters] + list(names)
+        return (all(name in self.fields for name in fields)
+                and all(name.lstrip('-') in self.ranks for name in query.ordering))
+
+    def group_counts(self, name: str, positions: Optional[Set[int]] = None) -> Dict[str, int]:
+        """Records per value of name, over all rows or only the given positions"""
+        index = self.field(name)
+        if positions is None:
+            return {value: len(rows) for value, rows in index.items()}
+        counts = {}
+        for value, rows in index.items():
+            count = sum(1 for position in rows if position in positions)
+            if count:
+                counts[value] = count
+        return counts
+
+    def positions(self, filters: Dict[str, List[str]]) -> Optional[Set[int]]:
+        """
+        Row positions matching every filter (values of one filter are OR-ed,
+        like NetBox does), or None when there are no filters
+        """
+        result: Optional[Set[int]] = None
+        # Evaluate the most selective filters first
+        for name, values in sorted(filters.items(), key=lambda item: self._estimate(*item)):
+            matched = self._match(name, values)
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        return result
+
+    def _estimate(self, name: str, values: List[str]) -> int:
+        base, _, lookup = name.partition('__')
+        if base not in self.fields:
+            return len(self.data)
+        index = self.fields[base]
+        return sum(len(index.get(value, ())) for value in _lookup_values(lookup, values))
+
+    def _match(self, name: str, values: List[str]) -> Set[int]:
+        base, _, lookup = name.partition('__')
+        if lookup not in ('', 'in', 'n'):
+            raise UnsupportedQuery(f"Lookup {name} is not supported on cached data")
+
+        index = self.field(base)
+        matched = set()
+        for value in _lookup_values(lookup, values):
+            matched.update(index.get(value, ()))
+        if lookup == 'n':
+            return set(range(len(self.data))) - matched
+        return matched
+
+    def select(self, query: Query) -> Tuple[int, List[Dict]]:
+        """Filter, order and paginate; returns (total, rows of the requested page)"""
+        positions = self.positions(query.filters)
+        rows = list(range(len(self.data))) if positions is None else sorted(positions)
+
+        for name in reversed(query.ordering):
+            descending = name.startswith('-')
+            ranks = self.rank(name.lstrip('-'))
+            rows.sort(key=ranks.__getitem__, reverse=descending)
+
+        total = len(rows)
+        end = None if query.limit is None else query.offset + query.limit
+        return total, [self.data[position] for position in rows[query.offset:end]]
+
+
+def _lookup_values(lookup: str, values: List[str]) -> List[str]:
+    if lookup == 'in':
+        return [value for raw in values for value in raw.split(',')]
+    return values
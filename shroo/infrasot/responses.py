@@ -0,0 +1,81 @@
+import asyncio
+from collections.abc import Sequence
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
+
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .apps import json_dumps
+
+# Transform applied to each batch before encoding, e.g. expanding relations
+BatchTransform = Callable[[List[Any]], List[Any]]
+
+
+def iter_json_array(records: Sequence, transform: Optional[BatchTransform] = None,
+                    batch_size: int = 500, buffer_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    The JSON array of records, encoded batch_size records at a time and
+    yielded in chunks of about buffer_size bytes. Same bytes as
+    json_dumps(records).
+    """
+    buffer = bytearray(b'[')
+    first = True
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        if transform is not None:
+            batch = transform(batch)
+        encoded = json_dumps(batch)
+        if len(encoded) > 2:
+            if not first:
+                buffer += b','
+            # Drop the batch's own brackets without copying it
+            buffer += memoryview(encoded)[1:-1]
+            first = False
+        if len(buffer) >= buffer_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+async def aiter_json_array(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Async wrapper for iter_json_array. Django's ASGI handler would collect a
+    sync iterator into a list first, which defeats the point.
+    """
+    for chunk in chunks:
+        yield chunk
+        # Let other requests run between chunks
+        await asyncio.sleep(0)
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    JSON array response encoded incrementally, so a large result never
+    exists as one string: at most one encoded batch and one buffer are held
+    on top of the records themselves. Pass asynchronous=True from async views.
+    """
+
+    def __init__(self, records: Sequence, transform: Optional[BatchTransform] = None,
+                 batch_size: int = 500, buffer_size: int = 64 * 1024,
+                 asynchronous: bool = False, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        chunks = iter_json_array(records, transform, batch_size, buffer_size)
+        super().__init__(aiter_json_array(chunks) if asynchronous else chunks, **kwargs)
+
+
+def json_response(payload: Any, stream_min_bytes: int, transform: Optional[BatchTransform] = None,
+                  batch_size: int = 500, asynchronous: bool = False) -> HttpResponse:
+    """
+    HttpResponse of payload, or a StreamingJSONResponse for record lists
+    whose encoding is estimated (from the first batch) at stream_min_bytes
+    or more. transform is applied to record lists only.
+    """
+    if isinstance(payload, Sequence) and not isinstance(payload, (str, bytes)):
+        if stream_min_bytes and len(payload) > batch_size:
+            sample = payload[:batch_size]
+            sample = transform(sample) if transform is not None else sample
+            if len(json_dumps(sample)) * len(payload) / batch_size >= stream_min_bytes:
+                return StreamingJSONResponse(payload, transform, batch_size, asynchronous=asynchronous)
+        if transform is not None:
+            payload = transform(payload)
+    return HttpResponse(json_dumps(payload), content_type='application/json')
@@ -0,0 +1,119 @@
+import re
+import time
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Searched fields per endpoint with their weight in the ranking
+SEARCH_FIELDS: Dict[str, Dict[str, int]] = {
+    'dcim.devices': {'name': 3, 'serial': 2, 'asset_tag': 2, 'description': 1},
+    'ipam.ip_addresses': {'address': 3, 'dns_name': 2, 'description': 1},
+    'ipam.prefixes': {'prefix': 3, 'description': 1},
+    'ipam.vlans': {'name': 3, 'vid': 2, 'description': 1},
+}
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(value: Any) -> List[str]:
+    """
+    Lowercased words of a field value plus the whole value, so both "sw"
+    and "core-sw" find "core-sw-01". Address masks are dropped so
+    "10.1.2" finds "10.1.2.9/24".
+    """
+    if value is None or value == '':
+        return []
+    text = str(value).lower().strip()
+    tokens = _WORD.findall(text)
+    if text and not any(char.isspace() for char in text):
+        whole = _strip_mask(text)
+        if whole not in tokens:
+            tokens.append(whole)
+    return tokens
+
+
+def _strip_mask(text: str) -> str:
+    return text.split('/', 1)[0] or text
+
+
+class EndpointSearch:
+    """Inverted index over the records of one cached entry"""
+
+    def __init__(self, data: List[Mapping], fields: Dict[str, int], version: str = ''):
+        start = time.time()
+        self.data = data
+        self.version = version
+        # token -> {row position: best field weight}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        for position, record in enumerate(data):
+            for name, weight in fields.items():
+                for token in tokenize(record.get(name)):
+                    rows = self.postings.get(token)
+                    if rows is None:
+                        rows = self.postings[token] = {}
+                    if rows.get(position, 0) < weight:
+                        rows[position] = weight
+        # Sorted once so prefix matches are a bisect and a short scan
+        self.tokens = sorted(self.postings)
+        self.build_seconds = time.time() - start
+
+    def scores(self, term: str) -> Dict[int, int]:
+        """Row position -> score for one query term, exact tokens counting double"""
+        scores: Dict[int, int] = {}
+        i = bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            token = self.tokens[i]
+            factor = 2 if token == term else 1
+            for position, weight in self.postings[token].items():
+                score = weight * factor
+                if scores.get(position, 0) < score:
+                    scores[position] = score
+            i += 1
+        return scores
+
+    def search(self, terms: List[str], limit: int) -> Tuple[int, List[Mapping]]:
+        """(matches, best limit records) for records matching every term"""
+        total: Optional[Dict[int, int]] = None
+        for term in terms:
+            scores = self.scores(term)
+            if total is None:
+                total = scores
+            else:
+                total = {position: score + scores[position]
+                         for position, score in total.items() if position in scores}
+            if not total:
+                return 0, []
+
+        ranked = sorted(total.items(), key=lambda item: (-item[1], item[0]))
+        return len(ranked), [self.data[position] for position, _ in ranked[:limit]]
+
+
+class SearchIndex:
+    """
+    One EndpointSearch per searched endpoint. Parts are replaced one at a
+    time, so refreshing one endpoint never re-indexes the others.
+    """
+
+    def __init__(self):
+        self.parts: Dict[str, EndpointSearch] = {}
+
+    def version(self, endpoint_name: str) -> Optional[str]:
+        part = self.parts.get(endpoint_name)
+        return part.version if part is not None else None
+
+    def update(self, endpoint_name: str, data: List[Mapping], version: str):
+        self.parts[endpoint_name] = EndpointSearch(data, SEARCH_FIELDS[endpoint_name], version)
+
+    def search(self, query: str, limit: int = 10,
+               endpoints: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Ranked matches per endpoint, at most limit records each"""
+        terms = [_strip_mask(term) for term in query.lower().split()]
+        results = {}
+        for endpoint_name in endpoints or SEARCH_FIELDS:
+            part = self.parts.get(endpoint_name)
+            if part is None or not terms:
+                count, records = 0, []
+            else:
+                count, records = part.search(terms, limit)
+            results[endpoint_name] = {"count": count, "results": records}
+        return results
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, Future, TimeoutError as FutureTimeoutError, wait as concurrent_wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ('future', 'started_at', 'waiters')
+
+    def __init__(self):
+        self.future: Future = Future()
+        # Running futures can't be cancelled, so a waiter giving up (or an
+        # asyncio wrapper being cancelled) never cancels it for the others
+        self.future.set_running_or_notify_cancel()
+        self.started_at = time.time()
+        self.waiters = 1
+
+
+class SingleFlight:
+    """
+    In-flight call registry shared by threads and coroutines: the first
+    caller for a key runs the function, everyone arriving while it runs
+    gets the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def _join(self, key: str, not_before: float) -> Tuple[_Call, bool]:
+        """(call to wait on, True if we must run it ourselves)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+            if call.started_at < not_before:
+                # Too old for this caller, wait it out and try again
+                return call, False
+            call.waiters += 1
+            return call, False
+
+    def _run(self, key: str, call: _Call, func: Callable[[], Any]):
+        try:
+            result = func()
+        except BaseException as e:
+            self.settle(key, call, error=e)
+        else:
+            self.settle(key, call, result=result)
+
+    def lead(self, key: str) -> Optional[_Call]:
+        """
+        Register a call for key that the caller runs itself, for work that
+        doesn't fit in one function call. None when a call is already in
+        flight. The caller must settle() it.
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+            call = self._calls[key] = _Call()
+            return call
+
+    def settle(self, key: str, call: _Call, result: Any = None, error: Optional[BaseException] = None):
+        """Hand result (or error) to everyone waiting on call and unregister it"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def do(self, key: str, func: Callable[[], Any], timeout: Optional[float] = None,
+           not_before: float = 0) -> Tuple[Any, bool]:
+        """
+        Run func once per key across concurrent callers. Returns (result,
+        shared), shared being True when another caller ran it. Calls started
+        before not_before are not joined. Raises TimeoutError when waiting
+        longer than timeout for someone else's call.
+        """
+        deadline = _Deadline(timeout)
+        while True:
+            call, leader = self._join(key, not_before)
+            if leader:
+                self._run(key, call, func)
+                return call.future.result(), False
+            try:
+                if call.started_at >= not_before:
+                    return call.future.result(deadline.remaining()), True
+                # Outcome of the older call doesn't matter, only that it's done
+                concurrent_wait([call.future], deadline.remaining())
+                deadline.check(key)
+            except FutureTimeoutError:
+                raise deadline.error(key)
+
+    async def do_async(self, key: str, func: Callable[[], Any], executor: Optional[Executor] = None,
+                       timeout: Optional[float] = None, not_before: float = 0) -> Tuple[Any, bool]:
+        """
+        Same as do, the leader runs func on executor (the loop's default one
+        if None) instead of blocking the event loop
+        """
+        deadline = _Deadline(timeout)
+        while True:
+            call, leader = self._join(key, not_before)
+            if leader:
+                try:
+                    asyncio.get_running_loop().run_in_executor(executor, self._run, key, call, func)
+                except RuntimeError as e:
+                    # Executor shut down, fail this call instead of leaving it registered
+                    self._run(key, call, lambda: _raise(e))
+            elif call.started_at < not_before:
+                await asyncio.wait([asyncio.wrap_future(call.future)], timeout=deadline.remaining())
+                deadline.check(key)
+                continue
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(call.future), deadline.remaining()), not leader
+            except asyncio.TimeoutError:
+                raise deadline.error(key)
+
+    def in_flight(self) -> Dict[str, Dict[str, Any]]:
+        """Per key: callers waiting on the running call (leader included) and its age"""
+        now = time.time()
+        with self._lock:
+            return {
+                key: {"waiters": call.waiters, "age_seconds": round(now - call.started_at, 3)}
+                for key, call in self._calls.items()
+            }
+
+
+class _Deadline:
+    def __init__(self, timeout: Optional[float]):
+        self.timeout = timeout
+        self.at = None if timeout is None else time.time() + timeout
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else max(0.0, self.at - time.time())
+
+    def error(self, key: str) -> TimeoutError:
+        return TimeoutError(f"Gave up waiting {self.timeout}s for the in-flight call for {key}")
+
+    def check(self, key: str):
+        if self.at is not None and time.time() >= self.at:
+            raise self.error(key)
+
+
+def _raise(error: BaseException):
+    raise error
@@ -0,0 +1,128 @@
+import os
+import pickle
+import struct
+import threading
+from mmap import mmap, ACCESS_READ
+from typing import Dict, Iterable, Optional, Tuple
+
+MAGIC = b'INFRASOT-SNAP1\n'
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+def write_snapshot(path: str, blobs: Dict[str, Tuple[bytes, float]]):
+    """
+    Write pickled cache entries, given as {key: (blob, entry timestamp)}, to
+    path, replacing it atomically.
+
+    Layout: magic, header length, pickled header {key: (offset, length,
+    timestamp)}, then the entry blobs back to back, so a reader can mmap the
+    file and unpickle single entries without touching the rest.
+    """
+    header = {}
+    offset = 0
+    for key, (blob, timestamp) in blobs.items():
+        header[key] = (offset, len(blob), timestamp)
+        offset += len(blob)
+    header_bytes = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    # Only we may write what gets unpickled at the next start
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for blob, _ in blobs.values():
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """Read side of a snapshot file, entries are unpickled on demand"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            directory = os.path.dirname(os.path.abspath(path))
+            check_private(f"snapshot {path}", os.fstat(f.fileno()))
+            check_private(f"snapshot directory {directory}", os.stat(directory))
+            self._map = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not an InfraSoT cache snapshot")
+
+        start = len(MAGIC)
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._map, start)
+        start += _HEADER_LENGTH.size
+        self._index: Dict[str, Tuple[int, ...]] = pickle.loads(self._map[start:start + header_length])
+        self._data_start = start + header_length
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str) -> Optional['Snapshot']:
+        """The snapshot at path, or None if there is no usable one"""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, pickle.UnpicklingError, struct.error) as e:
+            print(e)
+            return None
+
+    def keys(self) -> Iterable[str]:
+        with self._lock:
+            return list(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def blob(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            position = self._index.get(key)
+            if position is None:
+                return None
+            offset, length = position[:2]
+            start = self._data_start + offset
+            return self._map[start:start + length]
+
+    def timestamp(self, key: str) -> Optional[float]:
+        """When key's entry was fetched, 0 for snapshots written without timestamps"""
+        with self._lock:
+            position = self._index.get(key)
+            if position is None:
+                return None
+            return position[2] if len(position) > 2 else 0.0
+
+    def load(self, key: str):
+        """Unpickle the entry stored for key, or None"""
+        blob = self.blob(key)
+        return pickle.loads(blob) if blob is not None else None
+
+    def discard(self, key: str):
+        """Forget key, e.g. once the live cache holds a newer entry"""
+        with self._lock:
+            self._index.pop(key, None)
+
+    def close(self):
+        with self._lock:
+            self._index.clear()
+            self._map.close()
+
+
+def check_private(what: str, stat: os.stat_result):
+    """
+    Unpickling runs whatever code the data holds, so refuse files (and the
+    directories they sit in) that another user could have written: they
+    must be ours (or root's) and not writable by group or others.
+    """
+    if stat.st_uid not in (os.geteuid(), 0) or stat.st_mode & 0o022:
+        raise ValueError(f"Not loading {what}: it belongs to or is writable by another user")
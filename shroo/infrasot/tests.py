@@ -1,3 +1,1260 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import hmac
+import ipaddress
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import views
+from .apps import OptimizedNetBoxClient, json_dumps, json_loads, patch_records
+from .backends import DjangoCacheBackend, SharedFileBackend
+from .columnar import ColumnarRecords
+from .iptrie import IPIndex
+from .query import (EntryIndex, Query, UnsupportedQuery, can_evaluate, can_evaluate_names, field_values,
+                    index_key, parse_query)
+from .singleflight import SingleFlight
+
+
+def device(id, status='active', site=1, **fields):
+    return {'id': id, 'name': f'dev{id}', 'status': {'value': status, 'label': status.title()},
+            'site': {'id': site, 'slug': f'site{site}', 'name': f'Site {site}'}, 'tags': [], **fields}
+
+
+class FakeRecord(dict):
+    """Plain dict that also reads like a pynetbox Record (change.id)"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeEndpoint:
+    """
+    NetBox list endpoint over records, filtering them with field_values.
+    fetches counts count() calls, one per full fetch; while gate is set
+    to a cleared Event, page requests wait for it.
+    """
+
+    def __init__(self, records, url='http://netbox.invalid/api/fake'):
+        self.records = records
+        self.url = url
+        self.fetches = 0
+        self.pages = 0
+        self.gate = None
+
+    def _matching(self, filters):
+        filters = dict(filters)
+        ordering = filters.pop('ordering', None)
+        rows = [record for record in self.records
+                if all(_matches(record, name, value) for name, value in filters.items())]
+        if ordering:
+            rows.sort(key=lambda record: record[ordering.lstrip('-')], reverse=ordering.startswith('-'))
+        return rows
+
+    def count(self, **filters):
+        self.fetches += 1
+        return len(self._matching(filters))
+
+    def filter(self, limit=None, offset=0, **filters):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.pages += 1
+        rows = self._matching(filters)
+        return [FakeRecord(record) for record in rows[offset:offset + limit if limit else None]]
+
+
+def _matches(record, name, value):
+    if name == 'q':
+        return value in record['name']
+    if name == 'address':
+        return record['address'].split('/')[0] == value
+    if name.endswith('__gt'):
+        return record[name[:-len('__gt')]] > value
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return bool({index_key(item) for item in values} & {index_key(item) for item in field_values(record, name)})
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting for the background work")
+        time.sleep(0.01)
+
+
+class ClientTestCase(SimpleTestCase):
+    """Clients over fake NetBox endpoints, torn down after each test"""
+
+    def setUp(self):
+        self.netbox = {
+            'dcim.devices': FakeEndpoint([device(1), device(2, 'offline'), device(3, site=2)]),
+            'ipam.vlans': FakeEndpoint([{'id': 1, 'vid': 10, 'name': 'users', 'site': {'id': 1, 'slug': 'site1'}}]),
+        }
+
+    def make_client(self, **options):
+        options.setdefault('page_size', 2)
+        client = OptimizedNetBoxClient('http://netbox.invalid', 'token', **options)
+        client._resolve_endpoint = self.netbox.__getitem__
+        self.addCleanup(client.stop_cache_manager)
+        return client
+
+    @staticmethod
+    def age(client, cache_key, seconds):
+        """Pretend the cached entry was stored seconds earlier"""
+        client.cache.get(cache_key).timestamp -= seconds
+
+    def serve(self, client, view, path, **headers):
+        """view's response to GET path, with client as the app's NetBox client"""
+        with mock.patch.object(views, 'nb', client):
+            return view(RequestFactory().get(path, headers=headers))
+
+    def serve_async(self, client, view, path, **headers):
+        """serve for async views"""
+        async def respond():
+            with mock.patch.object(views, 'nb', client):
+                return await view(RequestFactory().get(path, headers=headers))
+        return asyncio.run(respond())
+
+
+class StaleWhileRevalidateTests(ClientTestCase):
+
+    def test_stale_entry_served_while_refreshing(self):
+        client = self.make_client(stale_grace=60)
+        devices = self.netbox['dcim.devices']
+        self.assertEqual(len(client.get_data_sync('dcim.devices')), 3)
+        devices.records.append(device(4))
+        self.age(client, 'dcim.devices', 310)
+
+        # The refresh is held up, the stale copy comes back anyway
+        devices.gate = threading.Event()
+        entry = client.get_entry_sync('dcim.devices')
+        self.assertEqual((entry.freshness, len(entry.data)), ('stale', 3))
+        # Further readers don't start more refreshes
+        client.get_entry_sync('dcim.devices')
+        devices.gate.set()
+
+        wait_for(lambda: len(client.cache.get('dcim.devices').data) == 4)
+        self.assertEqual(devices.fetches, 2)
+        self.assertEqual(client.get_entry_sync('dcim.devices').freshness, 'fresh')
+        wait_for(lambda: not client.refreshing)
+
+    def test_past_the_grace_window_refetches(self):
+        client = self.make_client(stale_grace=60)
+        client.get_data_sync('dcim.devices')
+        self.netbox['dcim.devices'].records.append(device(4))
+        self.age(client, 'dcim.devices', 400)
+
+        entry = client.get_entry_sync('dcim.devices')
+        self.assertEqual((entry.freshness, len(entry.data)), ('fresh', 4))
+
+    def test_disabled_without_grace(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        self.netbox['dcim.devices'].records.append(device(4))
+        self.age(client, 'dcim.devices', 301)
+
+        self.assertEqual(len(client.get_data_sync('dcim.devices')), 4)
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 2)
+
+
+def change(id, object_id, action, object_type='dcim.device'):
+    return {'id': id, 'changed_object_type': object_type, 'changed_object_id': object_id,
+            'action': {'value': action, 'label': action.title()}}
+
+
+class DeltaSyncTests(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.changelog = self.netbox['core.object_changes'] = FakeEndpoint([change(1, 1, 'create')])
+
+    def test_changes_patch_the_cached_list(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        client.get_data_sync('dcim.devices', {'q': 'dev'})
+        # The first run only pins the cursor
+        self.assertEqual(client.sync_changes(), 0)
+        self.assertEqual(client.change_cursor, 1)
+
+        devices = self.netbox['dcim.devices']
+        devices.records[1] = device(2, 'active')
+        devices.records.append(device(4))
+        del devices.records[2]
+        self.changelog.records += [change(2, 2, 'update'), change(3, 4, 'create'), change(4, 3, 'delete'),
+                                   change(5, 9, 'update', 'dcim.site')]
+        self.assertEqual(client.sync_changes(), 4)
+
+        entry = client.cache.get('dcim.devices')
+        self.assertEqual([(record['id'], record['status']['value']) for record in entry.data],
+                         [(1, 'active'), (2, 'active'), (4, 'active')])
+        # Filtered entries can't be patched, they are dropped
+        self.assertEqual(list(client.cache.keys()), ['dcim.devices'])
+        # Changed records were fetched by id, not the whole list again
+        self.assertEqual(devices.fetches, 2)
+        self.assertEqual((client.change_cursor, client.delta_status['changes_applied']), (5, 4))
+
+    def test_lost_change_window_refetches(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        client.sync_changes()
+        # Retention pruned our cursor and what followed it
+        self.changelog.records = [change(7, 1, 'update')]
+        self.netbox['dcim.devices'].records.append(device(4))
+
+        self.assertEqual(client.sync_changes(), 0)
+        self.assertEqual(len(client.cache.get('dcim.devices').data), 4)
+        self.assertEqual((client.change_cursor, client.delta_status['full_refetches']), (7, 1))
+
+
+class PatchRecordsTests(SimpleTestCase):
+
+    def test_patch(self):
+        data = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]
+        patched = patch_records(data, [{'id': 2, 'name': 'B'}, {'id': 4, 'name': 'd'}], {3})
+        self.assertEqual(patched, [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'B'}, {'id': 4, 'name': 'd'}])
+        # The cached list itself is left alone
+        self.assertEqual(data, [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}])
+        self.assertIs(patched[0], data[0])
+
+    def test_delete_wins_and_unknown_ids(self):
+        data = [{'id': 1}, {'id': 2}]
+        self.assertEqual(patch_records(data, [], {2, 99}), [{'id': 1}])
+        self.assertEqual(patch_records(data, [], set()), data)
+        self.assertEqual(patch_records([], [{'id': 5}], set()), [{'id': 5}])
+
+@override_settings(CACHES={'infrasot-tests': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                              'LOCATION': 'infrasot-tests'}})
+
+
+class SharedBackendTests(ClientTestCase):
+    """Two clients over one shared backend stand in for two gunicorn workers"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, 'cache')
+
+    def workers(self, kind):
+        if kind == 'shm':
+            return [self.make_client(backend=SharedFileBackend(self.directory)) for _ in range(2)]
+        backends = [DjangoCacheBackend('infrasot-tests', lock_timeout=5) for _ in range(2)]
+        backends[0].clear()
+        return [self.make_client(backend=backend) for backend in backends]
+
+    def test_workers_share_entries(self):
+        devices = self.netbox['dcim.devices']
+        for kind in ('shm', 'django'):
+            with self.subTest(kind):
+                devices.fetches = 0
+                first, second = self.workers(kind)
+                first.get_data_sync('dcim.devices')
+                self.assertEqual(len(second.get_data_sync('dcim.devices')), 3)
+                self.assertEqual(second.cache.info('dcim.devices').item_count, 3)
+                self.assertEqual(devices.fetches, 1)
+
+                # A refresh by one worker replaces what the other one kept unpickled
+                devices.records.append(device(4))
+                first.get_data_sync('dcim.devices', force_refresh=True)
+                self.assertEqual(len(second.get_data_sync('dcim.devices')), 4)
+                first.force_refresh('dcim.devices')
+                self.assertNotIn('dcim.devices', second.cache)
+                self.assertEqual(list(second.cache.keys()), [])
+                del devices.records[3]
+
+    def test_one_worker_fills_a_key(self):
+        devices = self.netbox['dcim.devices']
+        for kind in ('shm', 'django'):
+            with self.subTest(kind):
+                devices.fetches = 0
+                devices.gate = threading.Event()
+                with ThreadPoolExecutor(2) as pool:
+                    results = [pool.submit(worker.get_data_sync, 'dcim.devices') for worker in self.workers(kind)]
+                    time.sleep(0.2)
+                    devices.gate.set()
+                    self.assertEqual([len(result.result(5)) for result in results], [3, 3])
+                self.assertEqual(devices.fetches, 1)
+                devices.gate = None
+
+    def test_shm_files_stay_private(self):
+        client = self.workers('shm')[0]
+        client.get_data_sync('dcim.devices')
+        path = client.cache._path('dcim.devices')
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+        # Anything someone else could have written is never unpickled
+        os.chmod(path, 0o666)
+        other = SharedFileBackend(self.directory)
+        self.assertIsNone(other.get('dcim.devices'))
+        self.assertIsNone(other.info('dcim.devices'))
+        os.chmod(self.directory, 0o777)
+        with self.assertRaises(ValueError):
+            SharedFileBackend(self.directory)
+
+
+class EvictionTests(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.netbox['dcim.sites'] = FakeEndpoint([{'id': 1, 'slug': 'site1'}])
+
+    def read(self, client, *endpoints):
+        for endpoint_name in endpoints:
+            client.get_data_sync(endpoint_name)
+            # Distinct access times
+            time.sleep(0.01)
+
+    def test_lru_evicts_least_recently_used(self):
+        client = self.make_client(max_entries=2)
+        self.read(client, 'dcim.devices', 'ipam.vlans', 'dcim.devices', 'dcim.sites')
+        self.assertCountEqual(client.cache.keys(), ['dcim.devices', 'dcim.sites'])
+        self.assertEqual(client.evictions, 1)
+
+    def test_lfu_evicts_least_frequently_used(self):
+        client = self.make_client(max_entries=2, eviction_policy='lfu')
+        self.read(client, 'dcim.devices', 'dcim.devices', 'dcim.devices', 'ipam.vlans', 'dcim.sites')
+        self.assertCountEqual(client.cache.keys(), ['dcim.devices', 'dcim.sites'])
+
+    def test_byte_budget(self):
+        client = self.make_client()
+        self.read(client, 'dcim.devices')
+        size = client.cache.info('dcim.devices').size_bytes
+        self.assertGreater(size, 0)
+
+        client = self.make_client(max_bytes=size + 1)
+        self.read(client, 'dcim.devices', 'dcim.devices', 'ipam.vlans')
+        # Both don't fit, the older one makes room
+        self.assertEqual(list(client.cache.keys()), ['ipam.vlans'])
+        self.assertEqual((client.evictions, client.evicted_bytes), (1, size))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.make_client(eviction_policy='fifo')
+
+
+class ETagTests(ClientTestCase):
+
+    def test_not_modified(self):
+        client = self.make_client()
+        response = self.serve(client, views.gimme, '/dcim/devices')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, json_dumps(self.netbox['dcim.devices'].records))
+        self.assertEqual(response['ETag'], f'"{client.cache.get("dcim.devices").version}"')
+        self.assertEqual((response['Cache-Control'], response['X-Cache-Freshness']), ('no-cache', 'fresh'))
+
+        revalidated = self.serve(client, views.gimme, '/dcim/devices', if_none_match=response['ETag'])
+        self.assertEqual((revalidated.status_code, revalidated.content), (304, b''))
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+    def test_version_follows_the_content(self):
+        client = self.make_client()
+        etag = self.serve(client, views.gimme, '/dcim/devices')['ETag']
+        # Refetching the same records keeps the version
+        client.get_data_sync('dcim.devices', force_refresh=True)
+        self.assertEqual(self.serve(client, views.gimme, '/dcim/devices', if_none_match=etag).status_code, 304)
+
+        self.netbox['dcim.devices'].records.append(device(4))
+        client.get_data_sync('dcim.devices', force_refresh=True)
+        response = self.serve(client, views.gimme, '/dcim/devices', if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CompressionTests(ClientTestCase):
+
+    def test_served_by_accept_encoding(self):
+        client = self.make_client(compress_min_bytes=0)
+        identity = self.serve(client, views.gimme, '/dcim/devices')
+        self.assertNotIn('Content-Encoding', identity)
+
+        compressed = self.serve(client, views.gimme, '/dcim/devices', accept_encoding='br;q=1, gzip;q=0.5')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), identity.content)
+        # Each representation has its own ETag, caches key on the header
+        self.assertEqual(compressed['ETag'], identity['ETag'][:-1] + '-gzip"')
+        self.assertEqual(compressed['Vary'], 'Accept-Encoding')
+        revalidated = self.serve(client, views.gimme, '/dcim/devices', accept_encoding='gzip',
+                                 if_none_match=compressed['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        for accept_encoding in ('gzip;q=0', 'identity', '*;q=0'):
+            response = self.serve(client, views.gimme, '/dcim/devices', accept_encoding=accept_encoding)
+            self.assertNotIn('Content-Encoding', response, accept_encoding)
+        self.assertEqual(self.serve(client, views.gimme, '/dcim/devices', accept_encoding='*')['Content-Encoding'],
+                         'gzip')
+
+    def test_small_bodies_stay_uncompressed(self):
+        client = self.make_client(compress_min_bytes=1024 * 1024)
+        response = self.serve(client, views.gimme, '/dcim/devices', accept_encoding='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(client.cache.get('dcim.devices').encodings, {})
+
+
+class SnapshotTests(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'snapshots', 'cache.snap')
+
+    def restart(self, max_age=86400):
+        """A client for the next process, started from the last snapshot"""
+        client = self.make_client()
+        client.load_snapshot(self.path, max_age)
+        return client
+
+    def test_restored_entries_served_then_refreshed(self):
+        client = self.restart()
+        client.get_data_sync('dcim.devices')
+        client.get_data_sync('ipam.vlans')
+        self.assertEqual(client.save_snapshot(), 2)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+        devices = self.netbox['dcim.devices']
+        devices.records.append(device(4))
+        client = self.restart()
+        entry = client.get_entry_sync('dcim.devices')
+        self.assertTrue(entry.restored)
+        self.assertEqual(len(entry.data), 3)
+        # Changes made while no process ran show up once the refresh is in
+        wait_for(lambda: len(client.cache.get('dcim.devices').data) == 4)
+        self.assertFalse(client.cache.get('dcim.devices').restored)
+        self.assertEqual(devices.fetches, 2)
+        self.assertEqual(client.snapshot_status['restored_entries'], 1)
+
+    def test_carried_over_entries_expire(self):
+        client = self.restart(max_age=60)
+        client.get_data_sync('dcim.devices')
+        client.get_data_sync('ipam.vlans')
+        self.age(client, 'ipam.vlans', 50)
+        client.save_snapshot()
+
+        # Never requested by the next process, ipam.vlans carries over with
+        # its original timestamp and is dropped once past max_age
+        client = self.restart(max_age=60)
+        client.get_data_sync('dcim.devices')
+        with mock.patch('time.time', return_value=time.time() + 30):
+            self.assertEqual(client.save_snapshot(), 1)
+        self.assertEqual(self.restart(max_age=60).snapshot.keys(), ['dcim.devices'])
+        # Nor does loading pick up entries already too old
+        with mock.patch('time.time', return_value=time.time() + 70):
+            self.assertEqual(self.restart(max_age=60).snapshot.keys(), [])
+
+
+
+DEVICES = [
+    {'id': 1, 'name': 'sw-b', 'status': {'value': 'active', 'label': 'Active'},
+     'site': {'id': 10, 'slug': 'ams', 'name': 'Amsterdam'}, 'tenant': None, 'tags': [{'slug': 'core'}]},
+    {'id': 2, 'name': 'sw-a', 'status': {'value': 'offline', 'label': 'Offline'},
+     'site': {'id': 10, 'slug': 'ams', 'name': 'Amsterdam'}, 'tenant': {'id': 5, 'slug': 'acme'}, 'tags': []},
+    {'id': 3, 'name': 'rtr-a', 'status': {'value': 'active', 'label': 'Active'},
+     'site': {'id': 20, 'slug': 'fra', 'name': 'Frankfurt'}, 'tenant': None, 'tags': [{'slug': 'core'}, {'slug': 'edge'}]},
+    {'id': 4, 'name': 'sw-a', 'status': {'value': 'planned', 'label': 'Planned'},
+     'site': {'id': 20, 'slug': 'fra', 'name': 'Frankfurt'}, 'tenant': {'id': 6, 'slug': 'globex'}, 'tags': []},
+]
+
+
+class EntryIndexTests(SimpleTestCase):
+
+    def select(self, query_string, records=DEVICES):
+        params = dict(item.split('=') for item in query_string.split('&')) if query_string else {}
+        total, rows = EntryIndex(records).select(parse_query(params))
+        return total, [row['id'] for row in rows]
+
+    def test_filters(self):
+        self.assertEqual(self.select('status=active'), (2, [1, 3]))
+        self.assertEqual(self.select('site=fra'), (2, [3, 4]))
+        self.assertEqual(self.select('site_id=10&status=offline'), (1, [2]))
+        self.assertEqual(self.select('status__in=active,planned'), (3, [1, 3, 4]))
+        self.assertEqual(self.select('status__n=active'), (2, [2, 4]))
+        self.assertEqual(self.select('tag=edge'), (1, [3]))
+        self.assertEqual(self.select('tenant=null'), (2, [1, 3]))
+        self.assertEqual(self.select('site.name=Frankfurt'), (2, [3, 4]))
+        self.assertEqual(self.select('status=decommissioning'), (0, []))
+
+    def test_compact_rows(self):
+        # Compact storage is the default, its row views must filter the same
+        compact = ColumnarRecords(DEVICES)
+        for query_string in ('status=active', 'site_id=10&status=offline', 'tag=edge', 'tenant=null',
+                             'site.name=Frankfurt', 'tenant.slug=acme', 'ordering=name,-id'):
+            self.assertEqual(self.select(query_string, compact), self.select(query_string), query_string)
+        self.assertEqual(self.select('site.name=Frankfurt', compact), (2, [3, 4]))
+
+    def test_repeated_values_are_or_ed(self):
+        total, rows = EntryIndex(DEVICES).select(parse_query({'site_id': ['10', '20'], 'status': ['offline']}))
+        self.assertEqual((total, [row['id'] for row in rows]), (1, [2]))
+
+    def test_ordering_and_pagination(self):
+        self.assertEqual(self.select('ordering=name'), (4, [3, 2, 4, 1]))
+        # Ties keep the next ordering field
+        self.assertEqual(self.select('ordering=name,-id'), (4, [3, 4, 2, 1]))
+        self.assertEqual(self.select('ordering=-name&limit=2'), (4, [1, 2]))
+        self.assertEqual(self.select('ordering=id&limit=2&offset=1'), (4, [2, 3]))
+        self.assertEqual(self.select('status=active&offset=5'), (2, []))
+
+    def test_matches_a_scan(self):
+        rng = random.Random(7)
+        records = [{'id': i, 'status': {'value': rng.choice(['active', 'offline', 'planned'])},
+                    'site': {'id': rng.randrange(5), 'slug': 'site'}} for i in range(500)]
+        index = EntryIndex(records)
+        for _ in range(50):
+            status = rng.choice(['active', 'offline', 'planned'])
+            sites = rng.sample(range(5), rng.randint(1, 3))
+            query = parse_query({'status__n': [status], 'site_id__in': [','.join(map(str, sites))]})
+            total, rows = index.select(query)
+            expected = [record for record in records
+                        if record['status']['value'] != status and record['site']['id'] in sites]
+            self.assertEqual(total, len(expected))
+            self.assertEqual(rows, expected)
+
+    def test_unsupported_lookup(self):
+        with self.assertRaises(UnsupportedQuery):
+            EntryIndex(DEVICES).select(Query(filters={'name__ic': ['sw']}))
+
+    def test_parse_query(self):
+        query = parse_query({'format': 'json', 'brief': '1', 'status': 'active', 'limit': '5', 'expand': 'site_vlans'})
+        self.assertEqual(query.filters, {'status': ['active']})
+        self.assertEqual((query.limit, query.expand), (5, ['site_vlans']))
+        for params in ({'limit': 'abc'}, {'offset': '-1'}):
+            with self.assertRaises(UnsupportedQuery):
+                parse_query(params)
+
+    def test_can_evaluate(self):
+        sample = DEVICES[0]
+        for filters in ({'status': 'active'}, {'site_id': '10'}, {'site': 'ams', 'status__n': 'offline'},
+                        {'tag': 'core'}, {'tenant__in': 'null'}, {'site.name': 'Amsterdam'}, {}):
+            self.assertTrue(can_evaluate(sample, filters), filters)
+        # Left to NetBox: search, fields the records don't carry, other lookups
+        for filters in ({'q': 'sw'}, {'region': 'eu'}, {'name__ic': 'sw'}, {'rack_id': '1'},
+                        {'status': 'active', 'role': 'core'}, {'limit': '5'}):
+            self.assertFalse(can_evaluate(sample, filters), filters)
+        self.assertFalse(can_evaluate(None, {'status': 'active'}))
+        # Those going by the name alone are known before any record is fetched
+        self.assertTrue(can_evaluate_names({'status': 'active', 'rack_id': '1'}))
+        for filters in ({'q': 'sw'}, {'name__ic': 'sw'}, {'limit': '5'}):
+            self.assertFalse(can_evaluate_names(filters), filters)
+
+
+class QueryViewTests(ClientTestCase):
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [record['id'] for record in json_loads(response.content)]
+
+    def test_filtered_from_the_cached_list(self):
+        client = self.make_client()
+        response = self.serve(client, views.gimme, '/dcim/devices?status=active&format=json&ordering=-id')
+        self.assertEqual(self.ids(response), [3, 1])
+        self.assertEqual(response['X-Total-Count'], '2')
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices?site_id=2')), [3])
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+
+    def test_netbox_only_filters_skip_the_full_list(self):
+        client = self.make_client()
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices?q=dev1')), [1])
+        self.assertNotIn('dcim.devices', client.cache)
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+
+    def test_fields_the_records_lack_go_to_netbox(self):
+        client = self.make_client()
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices?rack_id=1')), [])
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 2)
+
+    def test_bad_limit(self):
+        response = self.serve(self.make_client(), views.gimme, '/dcim/devices?limit=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+class DerivedEntryTests(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.netbox['ipam.ip_addresses'] = FakeEndpoint([
+            {'id': 1, 'address': '10.0.0.1/24', 'vrf': {'id': 1, 'name': 'blue', 'rd': '65000:1'}},
+            {'id': 2, 'address': '10.0.0.2/24', 'vrf': None},
+        ])
+
+    def ids(self, client, endpoint_name, filters):
+        return [record['id'] for record in client.get_data_sync(endpoint_name, filters)]
+
+    def test_filtered_from_the_full_list(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        entry = client.get_entry_sync('dcim.devices', {'status': 'active'})
+        self.assertEqual([record['id'] for record in entry.data], [1, 3])
+        self.assertEqual(self.ids(client, 'dcim.devices', {'site_id': [2, 3], 'status__n': 'offline'}), [3])
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+        self.assertEqual(list(client.cache.keys()), ['dcim.devices'])
+        # Encoded only once something serves it
+        self.assertEqual(entry.body, b'')
+        self.assertEqual(entry.json_body(), json_dumps([device(1), device(3, site=2)]))
+
+    def test_version_follows_the_full_list(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        version = client.get_entry_sync('dcim.devices', {'site_id': 1}).version
+        self.assertEqual(client.get_entry_sync('dcim.devices', {'site_id': 1}).version, version)
+        self.assertNotEqual(client.get_entry_sync('dcim.devices', {'site_id': 2}).version, version)
+
+        self.netbox['dcim.devices'].records.append(device(4))
+        client.get_data_sync('dcim.devices', force_refresh=True)
+        self.assertNotEqual(client.get_entry_sync('dcim.devices', {'site_id': 1}).version, version)
+
+    def test_filters_netbox_evaluates_differently(self):
+        client = self.make_client()
+        addresses = self.netbox['ipam.ip_addresses']
+        client.get_data_sync('ipam.ip_addresses')
+        # vrf= takes the route distinguisher
+        self.assertEqual(self.ids(client, 'ipam.ip_addresses', {'vrf': '65000:1'}), [1])
+        self.assertEqual(self.ids(client, 'ipam.ip_addresses', {'vrf': 'blue'}), [])
+        self.assertEqual(self.ids(client, 'ipam.ip_addresses', {'vrf': 'null'}), [2])
+        self.assertEqual(addresses.fetches, 1)
+        # address= matches whatever the mask, only NetBox knows
+        self.assertEqual(self.ids(client, 'ipam.ip_addresses', {'address': '10.0.0.1'}), [1])
+        self.assertEqual(addresses.fetches, 2)
+
+
+class CountTests(ClientTestCase):
+
+    def count(self, client, path):
+        response = self.serve(client, views.gimme, path)
+        self.assertEqual(response.status_code, 200)
+        return json_loads(response.content)
+
+    def test_counts_from_the_cached_list(self):
+        client = self.make_client()
+        devices = self.netbox['dcim.devices']
+        # Nothing cached yet, NetBox counts
+        self.assertEqual(self.count(client, '/dcim/devices/count'), [3])
+        self.assertEqual((devices.fetches, devices.pages), (1, 0))
+
+        client.get_data_sync('dcim.devices')
+        self.assertEqual(self.count(client, '/dcim/devices/count?status=active'), [2])
+        self.assertEqual(self.count(client, '/dcim/devices/count?site_id=2&status__n=active'), [0])
+        self.assertEqual(devices.fetches, 2)
+
+    def test_group_by(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        self.assertEqual(self.count(client, '/dcim/devices/count?group_by=status,site'), {
+            'count': 3,
+            'group_by': {'status': {'active': 2, 'offline': 1}, 'site': {'site1': 2, 'site2': 1}},
+        })
+        self.assertEqual(self.count(client, '/dcim/devices/count?status=active&group_by=site'),
+                         {'count': 2, 'group_by': {'site': {'site1': 1, 'site2': 1}}})
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+
+        # NetBox filters, the groups are counted over what it returned
+        self.assertEqual(self.count(client, '/dcim/devices/count?q=dev3&group_by=status'),
+                         {'count': 1, 'group_by': {'status': {'active': 1}}})
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 2)
+
+
+class ColumnarRecordsTests(SimpleTestCase):
+    records = [
+        {'id': 1, 'name': 'sw-a', 'site': {'id': 10, 'slug': 'ams'}, 'tags': [{'slug': 'core'}], 'serial': None},
+        {'id': 2, 'name': 'sw-b', 'site': {'id': 10, 'slug': 'ams'}, 'tags': [], 'serial': 'X1'},
+        # Other key order, a missing key, an extra one and values that don't fit an int64 column
+        {'name': 'rtr', 'id': 2 ** 70, 'site': None, 'weight': 1.5},
+        {'id': True, 'name': '', 'site': {'id': 10, 'slug': 'ams'}, 'tags': [{'slug': 'core'}], 'serial': 0},
+    ]
+
+    def test_round_trip(self):
+        columnar = ColumnarRecords(self.records)
+        self.assertEqual(len(columnar), len(self.records))
+        self.assertEqual(columnar.to_dicts(), self.records)
+        for row, record in zip(columnar, self.records):
+            self.assertEqual(list(row), list(record))
+            self.assertEqual(row, record)
+            self.assertEqual([type(value) for value in row.values()], [type(value) for value in record.values()])
+        self.assertNotIn('weight', columnar[0])
+        self.assertIsNone(columnar[0].get('weight'))
+        with self.assertRaises(KeyError):
+            columnar[0]['weight']
+        self.assertEqual(columnar[-1], self.records[-1])
+        self.assertEqual(columnar[1:3], self.records[1:3])
+        with self.assertRaises(IndexError):
+            columnar[len(self.records)]
+
+    def test_nested_values_are_shared(self):
+        columnar = ColumnarRecords(self.records)
+        self.assertIs(columnar[0]['site'], columnar[1]['site'])
+        self.assertIs(columnar[0]['tags'], columnar[3]['tags'])
+
+    def test_pickle(self):
+        columnar = ColumnarRecords(self.records)
+        restored = pickle.loads(pickle.dumps(columnar, protocol=pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(restored.to_dicts(), self.records)
+        self.assertEqual(restored.nbytes, columnar.nbytes)
+        self.assertIs(restored[0]['site'], restored[1]['site'])
+
+    def test_empty(self):
+        columnar = ColumnarRecords([])
+        self.assertEqual(len(columnar), 0)
+        self.assertEqual(columnar.to_dicts(), [])
+
+
+class IPIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = random.Random(3)
+        networks = {ipaddress.ip_network('10.0.0.0/8')}
+        while len(networks) < 300:
+            length = rng.randint(12, 30)
+            networks.add(ipaddress.ip_network((rng.randrange(1 << 24) | 10 << 24, length), strict=False))
+        networks.update(ipaddress.ip_network(f'2001:db8:{i:x}::/48') for i in range(20))
+        self.prefixes = [{'id': i, 'prefix': str(network), 'vrf': None}
+                         for i, network in enumerate(sorted(networks, key=lambda n: (n.version, n)))]
+        # Same network in a VRF doesn't leak into the global table
+        self.prefixes.append({'id': 1000, 'prefix': '10.0.0.0/24', 'vrf': {'id': 7}})
+        self.addresses = [{'id': i, 'address': f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}/24',
+                           'vrf': None} for i in range(1000)]
+        self.index = IPIndex.build(self.prefixes, self.addresses)
+        self.networks = [(ipaddress.ip_network(record['prefix']), record) for record in self.prefixes
+                         if record['vrf'] is None]
+
+    def containing(self, address):
+        address = ipaddress.ip_address(address)
+        matches = [(network, record) for network, record in self.networks
+                   if network.version == address.version and address in network]
+        return [record for _, record in sorted(matches, key=lambda match: match[0].prefixlen)]
+
+    def test_lookup_matches_ipaddress(self):
+        rng = random.Random(4)
+        queries = [str(ipaddress.ip_address(10 << 24 | rng.randrange(1 << 24))) for _ in range(300)]
+        queries += ['2001:db8:3::1', '2001:db8:ffff::1', '192.168.1.1']
+        for query in queries:
+            expected = self.containing(query)
+            result = self.index.lookup(query)
+            self.assertEqual(result['prefix'], expected[-1] if expected else None, query)
+            self.assertEqual(result['parents'], expected[:-1], query)
+
+    def test_lookup_in_vrf(self):
+        self.assertEqual(self.index.lookup('10.0.0.1', vrf_id=7)['prefix']['id'], 1000)
+        self.assertIsNone(self.index.lookup('10.1.0.1', vrf_id=7)['prefix'])
+
+    def test_lookup_finds_host_addresses(self):
+        record = self.addresses[0]
+        host = record['address'].split('/')[0]
+        found = self.index.lookup(host)['ip_addresses']
+        self.assertIn(record, found)
+        self.assertTrue(all(address['address'].split('/')[0] == host for address in found))
+
+    def test_children_match_ipaddress(self):
+        for network, record in self.networks[:80]:
+            if network.version != 4:
+                continue
+            result = self.index.children(str(network), limit=10000)
+            inside = [address for address in self.addresses
+                      if ipaddress.ip_address(address['address'].split('/')[0]) in network]
+            self.assertEqual(result['prefix'], record)
+            self.assertEqual(result['ip_address_count'], len(inside), network)
+            self.assertCountEqual(result['ip_addresses'], inside)
+            # Direct children: inside network, and no other child in between
+            children = [other for other, _ in self.networks
+                        if other.version == 4 and other != network and other.subnet_of(network)]
+            direct = [child for child in children
+                      if not any(child != other and child.subnet_of(other) for other in children)]
+            self.assertEqual([ipaddress.ip_network(child['prefix']) for child in result['child_prefixes']],
+                             sorted(direct))
+
+    def test_utilization_free_space(self):
+        index = IPIndex.build([
+            {'id': 1, 'prefix': '10.0.0.0/24', 'status': {'value': 'container'}, 'vrf': None},
+            {'id': 2, 'prefix': '10.0.0.0/26', 'vrf': None},
+            {'id': 3, 'prefix': '10.0.0.128/25', 'vrf': None},
+        ], [])
+        result = index.utilization('10.0.0.0/24')
+        self.assertEqual(result['utilization'], 75.0)
+        self.assertEqual(result['available_prefixes'], ['10.0.0.64/26'])
+
+    def test_invalid_query(self):
+        with self.assertRaises(ValueError):
+            self.index.lookup('not-an-address')
+
+
+class IPIndexViewTests(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.netbox['ipam.prefixes'] = FakeEndpoint([
+            {'id': 1, 'prefix': '10.0.0.0/16', 'vrf': None},
+            {'id': 2, 'prefix': '10.0.1.0/24', 'vrf': None},
+        ])
+        self.netbox['ipam.ip_addresses'] = FakeEndpoint([{'id': 1, 'address': '10.0.1.5/24', 'vrf': None}])
+
+    def test_lookup(self):
+        client = self.make_client()
+        response = self.serve(client, views.ip_lookup, '/ipam/ip_index/lookup?address=10.0.1.5')
+        result = json_loads(response.content)
+        self.assertEqual((result['prefix']['id'], [parent['id'] for parent in result['parents']]), (2, [1]))
+        self.assertEqual([address['id'] for address in result['ip_addresses']], [1])
+        # Answered from the index, no further fetches
+        self.serve(client, views.ip_utilization, '/ipam/ip_index/utilization?prefix=10.0.0.0/16')
+        self.assertEqual([self.netbox[name].fetches for name in ('ipam.prefixes', 'ipam.ip_addresses')], [1, 1])
+
+    def test_bad_request(self):
+        client = self.make_client()
+        for query in ('', '?address=nope', '?address=10.0.0.1&vrf_id=x'):
+            self.assertEqual(self.serve(client, views.ip_lookup, '/ipam/ip_index/lookup' + query).status_code, 400, query)
+
+
+class ExpandTests(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.netbox['ipam.prefixes'] = FakeEndpoint([
+            {'id': 1, 'prefix': '10.0.0.0/16', 'vrf': None},
+            {'id': 2, 'prefix': '10.0.0.0/24', 'vrf': {'id': 7, 'rd': '65000:7'}},
+        ])
+        self.netbox['ipam.ip_addresses'] = FakeEndpoint([
+            {'id': 1, 'address': '10.0.0.5/24', 'vrf': None},
+            {'id': 2, 'address': '10.0.0.6/24', 'vrf': {'id': 7, 'rd': '65000:7'}},
+            {'id': 3, 'address': '192.168.0.1/24', 'vrf': None},
+        ])
+
+    def expanded(self, client, path, name):
+        response = self.serve(client, views.gimme, path)
+        self.assertEqual(response.status_code, 200)
+        return {record['id']: record[name] for record in json_loads(response.content)}
+
+    def test_related_records(self):
+        client = self.make_client()
+        site_vlans = self.expanded(client, '/dcim/devices?expand=site_vlans', 'site_vlans')
+        self.assertEqual({id: [vlan['id'] for vlan in vlans] for id, vlans in site_vlans.items()},
+                         {1: [1], 2: [1], 3: []})
+        # The cached copies stay as they were
+        self.assertNotIn('site_vlans', client.cache.get('dcim.devices').data[0])
+
+    def test_containing_prefix_in_the_same_vrf(self):
+        client = self.make_client()
+        prefixes = self.expanded(client, '/ipam/ip_addresses?expand=prefix', 'prefix')
+        self.assertEqual({id: prefix and prefix['id'] for id, prefix in prefixes.items()}, {1: 1, 2: 2, 3: None})
+
+    def test_unknown_relation(self):
+        response = self.serve(self.make_client(), views.gimme, '/dcim/devices?expand=cables')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('site_vlans', json_loads(response.content)['error'])
+
+
+class SharedFillTests(ClientTestCase):
+
+    def test_sync_and_async_callers_share_one_fetch(self):
+        client = self.make_client()
+        devices = self.netbox['dcim.devices']
+        devices.gate = threading.Event()
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            readers = [client.get_data_async('dcim.devices') for _ in range(4)]
+            readers += [loop.run_in_executor(None, client.get_data_sync, 'dcim.devices') for _ in range(4)]
+            await loop.run_in_executor(None, wait_for, lambda: devices.fetches)
+            await asyncio.sleep(0.1)
+            devices.gate.set()
+            return await asyncio.gather(*readers)
+
+        self.assertEqual([len(data) for data in asyncio.run(main())], [3] * 8)
+        self.assertEqual(devices.fetches, 1)
+        self.assertEqual(client.fills.in_flight(), {})
+
+
+class AsyncViewTests(ClientTestCase):
+
+    def respond(self, client, path):
+        """The async view's response, and whether it had to leave the event loop"""
+        with mock.patch.object(views, 'sync_to_async', wraps=views.sync_to_async) as offloaded:
+            response = self.serve_async(client, views.gimme_async, path)
+        self.assertEqual(response.status_code, 200)
+        return json_loads(response.content), offloaded.called
+
+    def test_same_answers_as_the_sync_views(self):
+        client = self.make_client()
+        for path in ('/dcim/devices', '/dcim/devices?status=active', '/dcim/devices?ordering=-id&limit=2',
+                     '/dcim/devices?q=dev2', '/dcim/devices/count?site_id=1',
+                     '/dcim/devices/count?group_by=status,site', '/dcim/devices/count?status=active&group_by=id'):
+            with self.subTest(path):
+                self.assertEqual(self.respond(client, path)[0],
+                                 json_loads(self.serve(client, views.gimme, path).content))
+
+    def test_index_reads_stay_on_the_event_loop(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        self.assertFalse(self.respond(client, '/dcim/devices?status=active&ordering=name')[1])
+        self.assertFalse(self.respond(client, '/dcim/devices/count?site_id=1&group_by=status')[1])
+        # Building an index (or expanding) is left to a thread, once
+        self.assertTrue(self.respond(client, '/dcim/devices?ordering=id')[1])
+        self.assertFalse(self.respond(client, '/dcim/devices?ordering=id')[1])
+        self.assertTrue(self.respond(client, '/dcim/devices/count?group_by=name')[1])
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+
+
+class StreamTests(ClientTestCase):
+
+    def ids(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json_loads(line)['id'] for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_streamed_then_cached(self):
+        client = self.make_client()
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices/stream')), [1, 2, 3])
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices/stream?status=active')), [1, 3])
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+
+    def test_limit_and_offset(self):
+        client = self.make_client()
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices/stream?limit=1&offset=1')), [2])
+        # Not NetBox filters: the full list gets cached under its own key
+        wait_for(lambda: 'dcim.devices' in client.cache)
+        self.assertEqual(list(client.cache.keys()), ['dcim.devices'])
+        self.assertEqual(self.ids(self.serve(client, views.gimme, '/dcim/devices/stream?offset=1&format=json')), [2, 3])
+
+    def test_async(self):
+        client = self.make_client()
+
+        async def read(response):
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        response = self.serve_async(client, views.gimme_async, '/dcim/devices/stream?limit=2')
+        lines = asyncio.run(read(response)).splitlines()
+        self.assertEqual([json_loads(line)['id'] for line in lines], [1, 2])
+
+    def test_needs_the_whole_list(self):
+        client = self.make_client()
+        for query in ('ordering=name', 'expand=site_vlans', 'limit=x'):
+            self.assertEqual(self.serve(client, views.gimme, '/dcim/devices/stream?' + query).status_code, 400, query)
+
+
+class BatchTests(ClientTestCase):
+    body = {'requests': [
+        {'endpoint': 'dcim.devices'},
+        {'endpoint': 'dcim.devices.count', 'filters': {'status': 'active'}, 'key': 'active'},
+        {'endpoint': 'ipam.vlans'},
+        {'endpoint': 'dcim.cables'},
+    ]}
+
+    def post(self, client, view, body):
+        request = RequestFactory().post('/batch', data=json_dumps(body), content_type='application/json')
+        with mock.patch.object(views, 'nb', client):
+            response = view(request)
+            if asyncio.iscoroutine(response):
+                response = asyncio.run(response)
+        return response
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        if not response.streaming:
+            return json_loads(response.content)
+        if response.is_async:
+            async def read():
+                return b''.join([chunk async for chunk in response.streaming_content])
+            return json_loads(asyncio.run(read()))
+        return json_loads(b''.join(response.streaming_content))
+
+    def test_one_round_trip(self):
+        for view in (views.batch, views.batch_async):
+            for stream in (False, True):
+                with self.subTest(view=view.__name__, stream=stream):
+                    result = self.content(self.post(self.make_client(), view, dict(self.body, stream=stream)))
+                    # Streamed parts come as they are ready, the others in request order
+                    keys = ['dcim.devices', 'active', 'ipam.vlans', 'dcim.cables']
+                    self.assertEqual(sorted(result) if stream else list(result), sorted(keys) if stream else keys)
+                    self.assertEqual(result['dcim.devices'], self.netbox['dcim.devices'].records)
+                    self.assertEqual(result['active'], [2])
+                    self.assertEqual(result['ipam.vlans'], self.netbox['ipam.vlans'].records)
+                    # A failed part doesn't fail the others
+                    self.assertIn('error', result['dcim.cables'])
+
+    def test_cache_hits(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        body = {'requests': [{'endpoint': 'dcim.devices'}, {'endpoint': 'dcim.devices.count'}]}
+        self.assertEqual(self.content(self.post(client, views.batch, body)),
+                         {'dcim.devices': self.netbox['dcim.devices'].records, 'dcim.devices.count': [3]})
+        self.assertEqual(self.netbox['dcim.devices'].fetches, 1)
+
+    def test_bad_requests(self):
+        client = self.make_client()
+        for body in ({}, {'requests': []}, {'requests': [{'endpoint': '../admin'}]},
+                     {'requests': [{'endpoint': 'dcim.devices'}, {'endpoint': 'dcim.devices'}]},
+                     {'requests': [{'endpoint': 'dcim.devices', 'filters': ['status']}]},
+                     {'requests': [{'endpoint': 'dcim.devices'}] * (views.BATCH_MAX_REQUESTS + 1)}):
+            self.assertEqual(self.post(client, views.batch, body).status_code, 400, body)
+
+
+class EventsTests(ClientTestCase):
+
+    def events(self, client, path, count, act=None, **headers):
+        """The first count events of the SSE stream at path after its retry line, act running in a thread"""
+        async def read():
+            response = await views.events_async(RequestFactory().get(path, headers=headers))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = aiter(response.streaming_content)
+            self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+            if act is not None:
+                await asyncio.get_running_loop().run_in_executor(None, act)
+            return [await asyncio.wait_for(anext(chunks), 5) for _ in range(count)]
+
+        # Until the stream is closed, it unsubscribes then
+        with mock.patch.object(views, 'nb', client):
+            return [_parse_event(chunk) for chunk in asyncio.run(read())]
+
+    def test_cache_changes(self):
+        client = self.make_client()
+
+        def act():
+            client.get_data_sync('ipam.vlans')
+            client.get_data_sync('dcim.devices')
+            client.get_data_sync('dcim.devices', force_refresh=True)
+
+        first, second = self.events(client, '/events?endpoints=dcim.devices', 2, act)
+        self.assertEqual((first['event'], first['data']['key'], first['data']['count']),
+                         ('refreshed', 'dcim.devices', 3))
+        self.assertTrue(first['data']['changed'])
+        # Same records again, same version
+        self.assertEqual((second['data']['changed'], second['data']['version']), (False, first['data']['version']))
+        self.assertEqual(int(second['id']), int(first['id']) + 1)
+        # Gone once the client disconnects
+        self.assertEqual(client.events.subscribers, set())
+
+    def test_resume_from_last_event_id(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        client.get_data_sync('ipam.vlans')
+        [event] = self.events(client, '/events', 1, last_event_id=str(client.events.last_event_id - 1))
+        self.assertEqual((event['event'], event['data']['key']), ('refreshed', 'ipam.vlans'))
+
+        client.events.history.clear()
+        [event] = self.events(client, '/events', 1, last_event_id='1')
+        self.assertEqual(event['event'], 'reset')
+
+    def test_keepalive(self):
+        with mock.patch.object(views, 'EVENTS_KEEPALIVE', 0.05):
+            self.assertEqual(self.events(self.make_client(), '/events', 1), [{'comment': 'keepalive'}])
+
+    def test_needs_asgi(self):
+        self.assertEqual(views.events(RequestFactory().get('/events')).status_code, 501)
+
+
+def _parse_event(chunk):
+    """A text/event-stream chunk as {field: value}, data decoded"""
+    lines = chunk.decode().strip().split('\n')
+    if lines[0].startswith(': '):
+        return {'comment': lines[0][2:]}
+    event = dict(line.split(': ', 1) for line in lines)
+    event['data'] = json_loads(event['data'])
+    return event
+
+
+class WebhookTests(ClientTestCase):
+    secret = 'hook-secret'
+
+    def post(self, client, body, signature=None):
+        body = json_dumps(body)
+        if signature is None:
+            signature = hmac.new(self.secret.encode(), body, hashlib.sha512).hexdigest()
+        request = RequestFactory().post('/webhook', data=body, content_type='application/json',
+                                        headers={'X-Hook-Signature': signature})
+        with mock.patch.object(views, 'nb', client), mock.patch.object(views, 'WEBHOOK_SECRET', self.secret):
+            return views.webhook(request)
+
+    def test_signature(self):
+        client = self.make_client()
+        body = {'event': 'updated', 'model': 'device', 'data': {'id': 1}}
+        self.assertEqual(self.post(client, body, signature='0' * 128).status_code, 403)
+        self.assertEqual(self.post(client, body, signature='').status_code, 403)
+        with mock.patch.object(self, 'secret', ''):
+            self.assertEqual(self.post(client, body).status_code, 403)
+        self.assertEqual(self.post(client, body).status_code, 202)
+
+    def test_bodies(self):
+        client = self.make_client()
+        self.assertEqual(self.post(client, ['not', 'a', 'webhook']).status_code, 400)
+        response = self.post(client, {'event': 'created', 'model': 'journalentry', 'data': {'id': 1}})
+        self.assertEqual(json_loads(response.content)['action'], 'ignored')
+        response = self.post(client, {'event': 'updated', 'model': 'vlan', 'data': {'id': 1}})
+        self.assertEqual(json_loads(response.content),
+                         {'object_type': 'ipam.vlan', 'event': 'updated', 'id': 1, 'action': 'queued'})
+
+    def test_changes_patched_in(self):
+        client = self.make_client()
+        devices = self.netbox['dcim.devices']
+        client.get_data_sync('dcim.devices')
+        client.get_data_sync('dcim.devices', {'q': 'dev'})
+
+        devices.records[1] = device(2, 'active')
+        self.assertEqual(self.post(client, {'event': 'updated', 'model': 'device', 'data': {'id': 2}}).status_code,
+                         202)
+        wait_for(lambda: client.cache.get('dcim.devices').data[1]['status']['value'] == 'active')
+        # Filtered entries can't be patched, they go
+        self.assertEqual(list(client.cache.keys()), ['dcim.devices'])
+
+        del devices.records[2]
+        self.assertEqual(client.apply_webhook('dcim.device', 'deleted', 3), 'patched')
+        self.assertEqual([record['id'] for record in client.cache.get('dcim.devices').data], [1, 2])
+        # Only the initial fetches, patches fetch changed records by id
+        self.assertEqual(devices.fetches, 2)
+
+    def test_nested_model_changes_drop_entries(self):
+        client = self.make_client()
+        client.get_data_sync('dcim.devices')
+        client.get_data_sync('ipam.vlans')
+        self.assertEqual(client.apply_webhook('dcim.site', 'updated', 1), 'invalidated')
+        self.assertEqual(list(client.cache.keys()), [])
+        self.assertEqual(client.apply_webhook('extras.journalentry', 'updated', 1), 'ignored')
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return 'data'
+
+        with ThreadPoolExecutor(8) as pool:
+            futures = [pool.submit(flight.do, 'key', fetch) for _ in range(8)]
+            while sum(info['waiters'] for info in flight.in_flight().values()) < 8:
+                time.sleep(0.01)
+            release.set()
+            results = [future.result(5) for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ['data'] * 8)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertEqual(flight.in_flight(), {})
+
+    def test_async_callers_share_one_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'data'
+
+        async def main():
+            return await asyncio.gather(*(flight.do_async('key', fetch) for _ in range(8)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ['data'] * 8)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+
+    def test_sync_caller_joins_async_call(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            return 'data'
+
+        async def main():
+            task = asyncio.ensure_future(flight.do_async('key', fetch))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            waiter = asyncio.get_running_loop().run_in_executor(None, flight.do, 'key', lambda: 'other')
+            await asyncio.sleep(0.05)
+            release.set()
+            return await task, await waiter
+
+        leader, waiter = asyncio.run(main())
+        self.assertEqual(leader, ('data', False))
+        self.assertEqual(waiter, ('data', True))
+
+    def test_not_before_skips_older_call(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def old():
+            calls.append('old')
+            started.set()
+            release.wait(5)
+            return 'old'
+
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(flight.do, 'key', old)
+            started.wait(5)
+            cutoff = time.time() + 0.001
+            time.sleep(0.002)
+            second = pool.submit(flight.do, 'key', lambda: calls.append('new') or 'new', None, cutoff)
+            time.sleep(0.05)
+            # Still waiting for the old call to finish, not sharing its result
+            self.assertFalse(second.done())
+            release.set()
+            self.assertEqual(first.result(5), ('old', False))
+            self.assertEqual(second.result(5), ('new', False))
+        self.assertEqual(calls, ['old', 'new'])
+
+    def test_waiter_timeout(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'data'
+
+        with ThreadPoolExecutor(1) as pool:
+            leader = pool.submit(flight.do, 'key', slow)
+            started.wait(5)
+            with self.assertRaises(TimeoutError):
+                flight.do('key', lambda: 'other', timeout=0.05)
+
+            async def wait_async():
+                return await flight.do_async('key', lambda: 'other', timeout=0.05)
+
+            with self.assertRaises(TimeoutError):
+                asyncio.run(wait_async())
+            # Giving up doesn't affect the call itself
+            release.set()
+            self.assertEqual(leader.result(5), ('data', False))
+
+    def test_error_reaches_every_caller(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def failing():
+            release.wait(5)
+            raise ValueError('NetBox is down')
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(flight.do, 'key', failing) for _ in range(4)]
+            while sum(info['waiters'] for info in flight.in_flight().values()) < 4:
+                time.sleep(0.01)
+            release.set()
+            for future in futures:
+                with self.assertRaisesMessage(ValueError, 'NetBox is down'):
+                    future.result(5)
+        # The failed call is not kept around
+        self.assertEqual(flight.do('key', lambda: 'data'), ('data', False))
+
+    def test_lead_and_settle(self):
+        flight = SingleFlight()
+        call = flight.lead('key')
+        self.assertIsNotNone(call)
+        self.assertIsNone(flight.lead('key'))
+        flight.settle('key', call, result='data')
+        self.assertEqual(call.future.result(0), 'data')
+        self.assertEqual(flight.in_flight(), {})
 
-# Create your tests here.
@@ -3,10 +3,20 @@ from django.contrib import admin
 from django.urls import path, re_path
 from . import views
 
+if views.ASYNC_VIEWS:
+    gimme, ip_lookup, ip_children, ip_utilization = (
+        views.gimme_async, views.ip_lookup_async, views.ip_children_async, views.ip_utilization_async)
+else:
+    gimme, ip_lookup, ip_children, ip_utilization = (
+        views.gimme, views.ip_lookup, views.ip_children, views.ip_utilization)
+
 urlpatterns = [
-    re_path('^devices/?.*', views.gimme, name='devices'),
-    re_path('^prefixes/?.*', views.gimme, name='prefixes'),
-    re_path('^vlans/?.*', views.gimme, name='vlans'),
-    re_path('^ip_addresses/?.*', views.gimme, name='ip_addresses'),
-    re_path('^object_changes/?.*', views.gimme),
+    re_path('^devices/?.*', gimme, name='devices'),
+    re_path('^prefixes/?.*', gimme, name='prefixes'),
+    re_path('^vlans/?.*', gimme, name='vlans'),
+    re_path('^ip_addresses/?.*', gimme, name='ip_addresses'),
+    re_path('^object_changes/?.*', gimme),
+    re_path('^ip_index/lookup/?$', ip_lookup, name='ip_lookup'),
+    re_path('^ip_index/children/?$', ip_children, name='ip_children'),
+    re_path('^ip_index/utilization/?$', ip_utilization, name='ip_utilization'),
 ]
\ No newline at end of file
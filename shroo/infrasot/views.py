@@ -1,28 +1,582 @@
+import hashlib
+import hmac
 import json
+import re
 from pprint import pprint
 
-from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from .apps import nb
+from django.utils.cache import parse_etags, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .apps import nb, json_dumps, json_loads, DEPENDENT_MODELS, SYNCED_MODELS
+from .query import can_evaluate, can_evaluate_names, parse_query, UnsupportedQuery, IGNORED_PARAMS, RESERVED_PARAMS
+from .responses import json_response
+from .search import SEARCH_FIELDS
 
 
+# Query results estimated above this many bytes are encoded incrementally
+STREAM_JSON_MIN_BYTES = config('INFRASOT_STREAM_JSON_MIN_BYTES', default=1024 * 1024, cast=int)
+
+# Requests accepted in one batch, and the endpoints they may name (the
+# ones routed to gimme)
+BATCH_MAX_REQUESTS = config('INFRASOT_BATCH_MAX_REQUESTS', default=50, cast=int)
+_BATCH_ENDPOINT = re.compile(r'^(dcim|ipam|core)\.[a-z_]+(\.count)?$')
+
+# Seconds between SSE keepalive comments, below proxy read timeouts
+EVENTS_KEEPALIVE = config('INFRASOT_EVENTS_KEEPALIVE', default=15, cast=float)
+
+# Key NetBox signs webhook bodies with; webhooks are refused without one
+WEBHOOK_SECRET = config('INFRASOT_WEBHOOK_SECRET', default='')
+# Default webhook bodies only name the model, not its app
+_WEBHOOK_MODELS = {object_type.split('.')[1]: object_type for object_type in [*SYNCED_MODELS, *DEPENDENT_MODELS]}
+
 # Create your views here.
 def index(request):
     return HttpResponse("Hello, world. You're at the polls index.")
 
 def get_devices(request):
     assert nb is not None
-    devices = nb.get_data_sync(request.path[1:].replace('/', '.'))
-    return JsonResponse({"devices": devices})
+    entry = nb.get_entry_sync(request.path[1:].replace('/', '.'))
+    return _cached_response(request, entry, wrap=b'devices')
 
 def get_count(request):
     assert nb is not None
     print('request:',request.path[1:].replace('/', '.'))
-    count=nb.get_data_sync(request.path[1:].replace('/', '.'))
+    entry = nb.get_entry_sync(request.path[1:].replace('/', '.'))
 
-    return JsonResponse({"count": count})
+    return _cached_response(request, entry, wrap=b'count')
 
 def gimme(request,*args, **kwargs):
     assert nb is not None
-    result=nb.get_data_sync(request.path[1:].replace('/', '.').rstrip('.'))
-    return JsonResponse(result, safe=False)
+    endpoint_name = request.path[1:].replace('/', '.').rstrip('.')
+    if endpoint_name.endswith('.count'):
+        return _count_response(request, endpoint_name)
+    if endpoint_name.endswith('.stream'):
+        return _stream_response(request, endpoint_name)
+    if request.GET:
+        entry, filters = _filtered_entry(request.GET, endpoint_name)
+        return _query_response(request, entry, netbox_filtered=bool(filters))
+    return _cached_response(request, nb.get_entry_sync(endpoint_name))
+
+def _count_response(request, endpoint_name):
+    """
+    Record count, filtered by the query string, taken from the cached list
+    when it is fresh. ?group_by=status,site adds the count per value of
+    those fields.
+    """
+    params = request.GET.copy()
+    group_by = _group_by(params)
+    if not group_by:
+        filters = _query_filters(params)
+        return _cached_response(request, nb.get_entry_sync(endpoint_name, filters or None))
+
+    entry, filters = _filtered_entry(params, endpoint_name[:-len('.count')])
+    return _group_counts_response(request, params, group_by, entry, filters)
+
+def _group_by(params):
+    """Pop ?group_by=status,site off params, as a list of field names"""
+    return [name for value in params.pop('group_by', []) for name in value.split(',') if name]
+
+def _group_counts_response(request, params, group_by, entry, filters):
+    """The .count?group_by= answer from entry, which NetBox already filtered by filters if any"""
+    try:
+        query = parse_query(params)
+        query.limit = 0
+        if filters:
+            query.filters = {}
+        total, _ = nb.query_entry(entry, query)
+        groups = nb.count_groups(entry, group_by, query.filters)
+    except UnsupportedQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return _query_digest_response(request, entry, {"count": total, "group_by": groups})
+
+def _stream_response(request, endpoint_name):
+    """
+    Records as NDJSON, one per line, sent as NetBox pages arrive (or
+    straight from the cache) so the first bytes don't wait for the last
+    page. The query string filters like on .count, limit and offset
+    apply. A failure after the response started ends the stream with an
+    {"error": ...} line.
+    """
+    try:
+        query = _stream_query(request.GET)
+    except UnsupportedQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    filters = _query_filters(request.GET)
+    pages = nb.stream_pages_sync(endpoint_name[:-len('.stream')], filters or None)
+
+    def lines():
+        try:
+            start = 0
+            for page in pages:
+                rows = _window(page, start, query)
+                start += len(page)
+                if rows:
+                    yield _ndjson(rows)
+                if query.limit is not None and start >= query.offset + query.limit:
+                    break
+        except Exception as e:
+            yield json_dumps({"error": str(e)}) + b'\n'
+
+    return _ndjson_response(lines())
+
+def _stream_query(params):
+    """The limit and offset of a stream's query string, refusing what needs the whole list first"""
+    query = parse_query(params)
+    if query.ordering or query.expand:
+        raise UnsupportedQuery("Streams can't be ordered or expanded, use the list endpoint")
+    return query
+
+def _window(page, start, query):
+    """The rows of page, the stream's records from number start on, within the query's offset and limit"""
+    end = len(page) if query.limit is None else query.offset + query.limit - start
+    return page[max(query.offset - start, 0):max(end, 0)]
+
+def _query_filters(params):
+    """Query string filters as NetBox filters, repeated parameters as lists"""
+    return {key: values[0] if len(values) == 1 else values for key, values in params.lists()
+            if key not in IGNORED_PARAMS and key not in RESERVED_PARAMS}
+
+def _netbox_filters(params, entry=None):
+    """
+    The filters of the query string as NetBox filters when the cached
+    records can't evaluate them (q, region, __ic, a field they don't
+    carry...), None when they can. Like any other filtered request, those
+    are fetched from NetBox and only ordered and paginated here.
+    Without entry this goes by the filter names alone.
+    """
+    try:
+        query = parse_query(params)
+    except UnsupportedQuery:
+        # Reported by _query_response
+        return None
+    if not query.filters:
+        return None
+    if entry is None:
+        local = can_evaluate_names(query.filters)
+    else:
+        local = not entry.data or can_evaluate(entry.data[0], query.filters)
+    return None if local else _query_filters(params)
+
+def _filtered_entry(params, endpoint_name):
+    """
+    The entry to answer the query string from and the filters NetBox
+    applied to it, if any. The full list is only fetched when its records
+    might evaluate the filters, not just to find out they can't.
+    """
+    filters = _netbox_filters(params)
+    if not filters:
+        entry = nb.get_entry_sync(endpoint_name)
+        filters = _netbox_filters(params, entry)
+    if filters:
+        entry = nb.get_entry_sync(endpoint_name, filters)
+    return entry, filters
+
+async def _filtered_entry_async(params, endpoint_name):
+    """Async _filtered_entry"""
+    filters = _netbox_filters(params)
+    if not filters:
+        entry = await nb.get_entry_async(endpoint_name)
+        filters = _netbox_filters(params, entry)
+    if filters:
+        entry = await nb.get_entry_async(endpoint_name, filters)
+    return entry, filters
+
+def _ndjson(records):
+    return b''.join(json_dumps(record) + b'\n' for record in records)
+
+def _ndjson_response(lines):
+    response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the whole stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _query_response(request, entry, asynchronous=False, netbox_filtered=False):
+    """
+    Filter/order/paginate the cached list per the query string and expand
+    related records, no NetBox calls once the related entries are cached.
+    netbox_filtered when entry already holds NetBox's answer to the filters.
+    """
+    try:
+        query = parse_query(request.GET)
+        if netbox_filtered:
+            query.filters = {}
+        total, rows = nb.query_entry(entry, query)
+        # Expanded batch by batch while encoding, the copies add up
+        expand = nb.expander(entry.endpoint_name, query.expand) if query.expand else None
+    except UnsupportedQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    response = _query_digest_response(request, entry, rows, expand, asynchronous)
+    response['X-Total-Count'] = str(total)
+    return response
+
+def _query_digest_response(request, entry, payload, transform=None, asynchronous=False):
+    """
+    JSON response computed from entry, versioned by the entry and the query
+    string. Large record lists are streamed, transform applying per batch;
+    asynchronous when the response goes out through an async view.
+    """
+    # Same cached version and same query string give the same result
+    query_digest = hashlib.blake2b(request.META.get('QUERY_STRING', '').encode(), digest_size=6).hexdigest()
+    etag = f'"{entry.version}-{query_digest}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = json_response(payload, STREAM_JSON_MIN_BYTES, transform, asynchronous=asynchronous)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return _mark_freshness(response, entry)
+
+def ip_lookup(request, *args, **kwargs):
+    """Most specific prefix containing ?address=, with its parents"""
+    return _ip_index_response(request, 'address', lambda index, value, vrf_id: index.lookup(value, vrf_id))
+
+def ip_children(request, *args, **kwargs):
+    """Direct child prefixes of ?prefix= and the addresses inside it"""
+    def children(index, value, vrf_id):
+        return index.children(value, vrf_id, limit=int(request.GET.get('limit', 1000)))
+    return _ip_index_response(request, 'prefix', children)
+
+def ip_utilization(request, *args, **kwargs):
+    """Utilisation and free space of ?prefix="""
+    return _ip_index_response(request, 'prefix', lambda index, value, vrf_id: index.utilization(value, vrf_id))
+
+def _ip_index_response(request, param, answer):
+    assert nb is not None
+    value = request.GET.get(param)
+    if not value:
+        return JsonResponse({"error": f"{param} is required"}, status=400)
+    try:
+        vrf_id = int(request.GET['vrf_id']) if request.GET.get('vrf_id') else None
+        result = answer(nb.get_ip_index(), value, vrf_id)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return HttpResponse(json_dumps(result), content_type='application/json')
+
+def search(request):
+    """
+    Ranked search over cached devices, addresses, prefixes and VLANs:
+    ?q=core-sw&limit=10 (per type)&types=devices,prefixes
+    """
+    assert nb is not None
+    types = [name for value in request.GET.getlist('types') for name in value.split(',') if name]
+    endpoints = [name for name in SEARCH_FIELDS if not types or name.split('.')[-1] in types]
+    if not endpoints:
+        return JsonResponse({"error": "types must be one of devices, ip_addresses, prefixes, vlans"}, status=400)
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return JsonResponse({"error": "limit must be an integer"}, status=400)
+
+    query = request.GET.get('q', '')
+    results = nb.get_search_index(endpoints).search(query, limit, endpoints)
+    return HttpResponse(json_dumps({
+        "query": query,
+        "results": {name.split('.')[-1]: result for name, result in results.items()},
+    }), content_type='application/json')
+
+# Native async variants, routed instead of the ones above when served over
+# ASGI (shroo/asgi.py turns this on). Cache hits and callers waiting on an in-flight fill
+# don't hold a thread, only the NetBox fetch itself runs in an executor.
+ASYNC_VIEWS = config('INFRASOT_ASYNC_VIEWS', default=False, cast=bool)
+
+async def gimme_async(request, *args, **kwargs):
+    assert nb is not None
+    endpoint_name = request.path[1:].replace('/', '.').rstrip('.')
+    if endpoint_name.endswith('.count'):
+        return await _count_response_async(request, endpoint_name)
+    if endpoint_name.endswith('.stream'):
+        return _stream_response_async(request, endpoint_name)
+    if request.GET:
+        entry, filters = await _filtered_entry_async(request.GET, endpoint_name)
+        if _indexed(entry, request.GET, bool(filters)):
+            return _query_response(request, entry, True, bool(filters))
+        return await sync_to_async(_query_response, thread_sensitive=False)(request, entry, True, bool(filters))
+    return _cached_response(request, await nb.get_entry_async(endpoint_name))
+
+async def _count_response_async(request, endpoint_name):
+    """Async _count_response, counted in a thread unless the indexes are all there"""
+    params = request.GET.copy()
+    group_by = _group_by(params)
+    if not group_by:
+        filters = _query_filters(params)
+        return _cached_response(request, await nb.get_entry_async(endpoint_name, filters or None))
+
+    entry, filters = await _filtered_entry_async(params, endpoint_name[:-len('.count')])
+    if _indexed(entry, params, bool(filters), group_by):
+        return _group_counts_response(request, params, group_by, entry, filters)
+    return await sync_to_async(_group_counts_response, thread_sensitive=False)(
+        request, params, group_by, entry, filters)
+
+def _indexed(entry, params, netbox_filtered, group_by=()):
+    """
+    True when answering params (and counting group_by) from entry only
+    reads indexes it already has, cheap enough to do on the event loop.
+    Building one, or expanding (which may wait for other entries), is
+    left to a thread.
+    """
+    try:
+        query = parse_query(params)
+    except UnsupportedQuery:
+        # Answered with a 400 right away
+        return True
+    if query.expand or entry.index is None:
+        return False
+    if netbox_filtered:
+        query.filters = {}
+    return entry.index.covers(query, group_by)
+
+def _stream_response_async(request, endpoint_name):
+    """Async _stream_response, no thread held while waiting for NetBox pages"""
+    try:
+        query = _stream_query(request.GET)
+    except UnsupportedQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    filters = _query_filters(request.GET)
+    pages = nb.stream_pages_async(endpoint_name[:-len('.stream')], filters or None)
+
+    async def lines():
+        try:
+            start = 0
+            async for page in pages:
+                rows = _window(page, start, query)
+                start += len(page)
+                if rows:
+                    yield _ndjson(rows)
+                if query.limit is not None and start >= query.offset + query.limit:
+                    break
+        except Exception as e:
+            yield json_dumps({"error": str(e)}) + b'\n'
+
+    return _ndjson_response(lines())
+
+@csrf_exempt
+@require_POST
+async def batch_async(request):
+    """Async batch, no thread held per miss while waiting for NetBox"""
+    assert nb is not None
+    try:
+        keys, requests, stream = _parse_batch(request.body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    results = nb.iter_entries_async(requests)
+    if stream:
+        async def chunks():
+            yield b'{'
+            i = 0
+            async for position, result in results:
+                yield (b',' if i else b'') + _batch_part(keys[position], result)
+                i += 1
+            yield b'}'
+        return StreamingHttpResponse(chunks(), content_type='application/json')
+    collected = sorted([result async for result in results], key=lambda result: result[0])
+    return HttpResponse(b''.join(_batch_chunks(keys, collected)), content_type='application/json')
+
+def events(request):
+    """
+    /events without ASYNC_VIEWS: WSGI collects an async stream into a list
+    before sending it, so the client would never get a byte
+    """
+    return JsonResponse({"error": "events need the ASGI server, see shroo/asgi.py"}, status=501)
+
+async def events_async(request):
+    """
+    Server-Sent Events stream of cache changes: refreshed, patched and
+    evicted, each with the entry's key and version, plus reset when the
+    client fell too far behind and should refetch everything.
+    ?endpoints=dcim.devices,ipam.vlans narrows it down, ?delta=1 adds the
+    upserted records and deleted ids to patched events. Reconnecting
+    browsers resume from Last-Event-ID. ASGI only, see events.
+    """
+    assert nb is not None
+    endpoints = [name for value in request.GET.getlist('endpoints') for name in value.split(',') if name]
+    delta = request.GET.get('delta', '').lower() in ('1', 'true', 'yes')
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    subscription = nb.events.subscribe(endpoints, int(last_event_id) if last_event_id.isdigit() else None)
+
+    async def stream():
+        try:
+            # Browser reconnect delay
+            yield b'retry: 5000\n\n'
+            while True:
+                event = await subscription.get(EVENTS_KEEPALIVE)
+                yield event.encode(delta) if event is not None else b': keepalive\n\n'
+        finally:
+            nb.events.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# Index builds lock and may take seconds, keep them off the event loop
+ip_lookup_async = sync_to_async(ip_lookup, thread_sensitive=False)
+ip_children_async = sync_to_async(ip_children, thread_sensitive=False)
+ip_utilization_async = sync_to_async(ip_utilization, thread_sensitive=False)
+search_async = sync_to_async(search, thread_sensitive=False)
+
+@csrf_exempt
+@require_POST
+def batch(request):
+    """
+    Several datasets in one round-trip. POST
+    {"requests": [{"endpoint": "dcim.devices.count", "filters": {"status": "active"},
+                   "key": "active_devices"}, ...], "stream": false}
+    to get {"active_devices": [42], ...} back, key defaulting to the
+    endpoint. A failed request gives {"error": ...} under its key. Cache hits
+    are answered right away and misses fetched concurrently; with "stream"
+    each part is sent as soon as it is ready, in that order.
+    """
+    assert nb is not None
+    try:
+        keys, requests, stream = _parse_batch(request.body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    results = nb.iter_entries_sync(requests)
+    if stream:
+        return StreamingHttpResponse(_batch_chunks(keys, results), content_type='application/json')
+    return HttpResponse(b''.join(_batch_chunks(keys, sorted(results, key=lambda result: result[0]))),
+                        content_type='application/json')
+
+def _parse_batch(body):
+    """(keys, (endpoint, filters) requests, stream) of a batch body; raises ValueError"""
+    try:
+        spec = json_loads(body)
+    except ValueError:
+        raise ValueError("Body must be JSON")
+    items = spec.get('requests') if isinstance(spec, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("requests must be a non-empty list")
+    if len(items) > BATCH_MAX_REQUESTS:
+        raise ValueError(f"At most {BATCH_MAX_REQUESTS} requests per batch")
+
+    keys, requests = [], []
+    for item in items:
+        endpoint_name = item.get('endpoint') if isinstance(item, dict) else None
+        if not isinstance(endpoint_name, str) or not _BATCH_ENDPOINT.match(endpoint_name):
+            raise ValueError(f"Invalid endpoint in {item!r}")
+        filters = item.get('filters') or None
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError(f"filters must be an object in {item!r}")
+        key = item.get('key', endpoint_name)
+        if not isinstance(key, str) or key in keys:
+            raise ValueError(f"Duplicate or invalid key {key!r}")
+        keys.append(key)
+        requests.append((endpoint_name, filters))
+    return keys, requests, bool(spec.get('stream'))
+
+def _batch_chunks(keys, results):
+    """The combined JSON object, one chunk per (position, entry or error) result"""
+    yield b'{'
+    for i, (position, result) in enumerate(results):
+        yield (b',' if i else b'') + _batch_part(keys[position], result)
+    yield b'}'
+
+def _batch_part(key, result):
+    # Cached entries carry their encoded body, nothing gets re-encoded
+    if isinstance(result, Exception):
+        return json_dumps(key) + b':' + json_dumps({"error": str(result)})
+    return json_dumps(key) + b':' + result.json_body()
+
+@csrf_exempt
+@require_POST
+def webhook(request):
+    """
+    Receiver for NetBox webhooks with the default body. X-Hook-Signature
+    must be the HMAC-SHA512 of the body keyed with INFRASOT_WEBHOOK_SECRET.
+    Changed devices, prefixes, VLANs and addresses are patched into their
+    cached lists, changes to models nested in them (sites, tenants, ...)
+    drop the affected entries. The work runs in the background, NetBox
+    gets a 202 right away.
+    """
+    assert nb is not None
+    if not WEBHOOK_SECRET:
+        return JsonResponse({"error": "Webhooks are disabled, set INFRASOT_WEBHOOK_SECRET"}, status=403)
+    signature = hmac.new(WEBHOOK_SECRET.encode(), request.body, hashlib.sha512).hexdigest()
+    if not hmac.compare_digest(signature, request.headers.get('X-Hook-Signature', '')):
+        return JsonResponse({"error": "Invalid signature"}, status=403)
+
+    try:
+        payload = json_loads(request.body)
+        event = payload['event']
+        object_type = payload.get('object_type') or _WEBHOOK_MODELS.get(payload['model'], payload['model'])
+        object_id = (payload.get('data') or {}).get('id')
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({"error": "Not a NetBox webhook body"}, status=400)
+
+    summary = {"object_type": object_type, "event": event, "id": object_id}
+    if object_type not in SYNCED_MODELS and object_type not in DEPENDENT_MODELS:
+        return JsonResponse(dict(summary, action="ignored"))
+    try:
+        nb.thread_pool.submit(nb.apply_webhook, object_type, event, object_id)
+    except RuntimeError:
+        return JsonResponse({"error": "Shutting down"}, status=503)
+    return JsonResponse(dict(summary, action="queued"), status=202)
+
+def metrics(request):
+    assert nb is not None
+    return HttpResponse(nb.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _cached_response(request, entry, wrap=None):
+    """
+    Serve the entry's pre-encoded JSON body, or a 304 when the client
+    already holds this version. wrap nests the body under a single key.
+    """
+    encoding = None
+    if wrap is None:
+        encoding = _pick_encoding(request.headers.get('Accept-Encoding', ''), entry.encodings)
+
+    # Each representation needs its own strong ETag
+    etag = f'"{entry.version}-{encoding}"' if encoding else f'"{entry.version}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    elif encoding:
+        response = HttpResponse(entry.encodings[encoding], content_type='application/json')
+        response['Content-Encoding'] = encoding
+    else:
+        body = entry.json_body() if wrap is None else b'{"' + wrap + b'":' + entry.json_body() + b'}'
+        response = HttpResponse(body, content_type='application/json')
+
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    # Let browsers keep the body but always revalidate it
+    response['Cache-Control'] = 'no-cache'
+    return _mark_freshness(response, entry)
+
+def _pick_encoding(accept_encoding, available):
+    """
+    First of the entry's pre-compressed encodings (kept in server preference
+    order) that the client accepts, or None for identity
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+
+    for encoding in available:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def _mark_freshness(response, entry):
+    """Tell the client whether it got fresh data or a stale copy being revalidated"""
+    response['X-Cache-Freshness'] = entry.freshness
+    response['Age'] = str(int(entry.age_seconds))
+    return response
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shroo.settings')
+# Route the InfraSoT endpoints to their async views
+os.environ.setdefault('INFRASOT_ASYNC_VIEWS', 'true')
+# Serving process: warm, sync and snapshot the InfraSoT cache
+os.environ.setdefault('INFRASOT_BACKGROUND_JOBS', 'true')
 
 application = get_asgi_application()
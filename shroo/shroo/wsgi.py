@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shroo.settings')
+# Serving process: warm, sync and snapshot the InfraSoT cache
+os.environ.setdefault('INFRASOT_BACKGROUND_JOBS', 'true')
 
 application = get_wsgi_application()